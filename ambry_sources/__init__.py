@@ -10,7 +10,7 @@ from  .__meta__ import __version__, __author__
 from .fetch import get_source, import_source, download, extract_file_from_zip
 from .sources.spec import ColumnSpec, SourceSpec
 from .mpf import MPRowsFile
-from .sources import RowProxy
+from .sources import RowProxy, row_class
 
 import logging
 
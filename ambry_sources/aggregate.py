@@ -0,0 +1,397 @@
+# -*- coding: utf-8 -*-
+"""
+
+Streaming hash aggregation (group-by) over the positional rows of an MPR file.
+
+Copyright (c) 2015 Civic Knowledge. This file is licensed under the terms of the
+Revised BSD License, included in this distribution as LICENSE.txt
+"""
+
+from itertools import islice
+import logging
+import os
+import shutil
+import sys
+import tempfile
+
+import msgpack
+from six import iteritems, iterkeys, reraise, string_types
+
+logger = logging.getLogger(__name__)
+
+
+class AggregateError(Exception):
+    pass
+
+
+# Number of state slots, and the initial value of each slot, for each aggregate function.
+AGGREGATES = {
+    'count': [0],
+    'sum': [None],
+    'min': [None],
+    'max': [None],
+    'mean': [None, 0],  # sum, count
+    'count_distinct': [None],  # A set, created when the group is created.
+}
+
+# Code for updating the state slots of a group from a non-None value, v. {0} is the first slot.
+UPDATE_CODE = {
+    'count': ['s[{0}] += 1'],
+    'sum': ['s[{0}] = v if s[{0}] is None else s[{0}] + v'],
+    'min': ['if s[{0}] is None or v < s[{0}]: s[{0}] = v'],
+    'max': ['if s[{0}] is None or v > s[{0}]: s[{0}] = v'],
+    'mean': ['s[{0}] = v if s[{0}] is None else s[{0}] + v', 's[{1}] += 1'],
+    'count_distinct': ['s[{0}].add(v)'],
+}
+
+
+class HashAggregator(object):
+    """Compute aggregates of columns, grouped by the values of other columns, from an iterator of
+    positional rows.
+
+    The group table is held in a dict. When it grows beyond max_groups entries, the partial aggregates are
+    spilled to temporary files, partitioned by the hash of the group key, and the partitions are merged one at
+    a time when the results are generated.
+
+    >>> agg = HashAggregator(['county', 'year', 'x'], ['county'], {'x': ['count', 'sum']})
+    >>> for row in agg.run(rows):
+    >>>     print row  # (county, x_count, x_sum)
+
+    """
+
+    MAX_GROUPS = 250000  # Number of groups to hold in memory before spilling to disk
+    N_PARTITIONS = 16  # Number of spill files
+    BATCH_SIZE = 10000  # Number of rows sent to a worker process at a time
+    PENDING_BATCHES = 2  # Number of batches per worker process sent ahead of the merged results
+
+    def __init__(self, headers, group_by, aggs, max_groups=None):
+        """
+
+        Args:
+            headers (list of str): names of the columns of the rows that will be aggregated.
+            group_by (list of str): names of the columns to group on.
+            aggs (dict): keys are column names, values are an aggregate function name, or a list of
+                them. The functions are count, sum, min, max, mean and count_distinct.
+            max_groups (int, optional): number of groups to hold in memory before spilling.
+
+        """
+
+        self._headers = list(headers)
+        self.group_by = [group_by] if isinstance(group_by, string_types) else list(group_by)
+        self.aggs = []
+
+        for col_name, funcs in sorted(iteritems(aggs)):
+            for func in ([funcs] if isinstance(funcs, string_types) else funcs):
+                if func not in AGGREGATES:
+                    raise AggregateError("Unknown aggregate function '{}'; must be one of {}"
+                                         .format(func, sorted(iterkeys(AGGREGATES))))
+                self.aggs.append((col_name, func))
+
+        for col_name in self.group_by + [e[0] for e in self.aggs]:
+            if col_name not in self._headers:
+                raise AggregateError("Column '{}' not in headers {}".format(col_name, self._headers))
+
+        self.max_groups = max_groups or self.MAX_GROUPS
+
+        self.table = {}
+        self.n_rows = 0
+
+        self._spill_dir = None
+        self._spilled = False  # True once groups have been written to the spill files
+        self._slots = []  # Index of the first state slot for each aggregate
+
+        template = []
+        for col_name, func in self.aggs:
+            self._slots.append(len(template))
+            template.extend(AGGREGATES[func])
+
+        self._template = template
+        self._distinct_slots = [slot for slot, (_, func) in zip(self._slots, self.aggs)
+                                if func == 'count_distinct']
+
+        self._update, self._update_code, self._update_lines = self.build()
+
+    @property
+    def headers(self):
+        """Names of the columns of the result rows"""
+        return self.group_by + ['{}_{}'.format(col_name, func) for col_name, func in self.aggs]
+
+    @property
+    def spec(self):
+        """Arguments to re-create the aggregator, in another process"""
+        aggs = {}
+        for col_name, func in self.aggs:
+            aggs.setdefault(col_name, []).append(func)
+
+        return self._headers, self.group_by, aggs, self.max_groups
+
+    def new_state(self):
+        s = list(self._template)
+        for slot in self._distinct_slots:
+            s[slot] = set()
+        return s
+
+    def build(self):
+        """Generate a function that updates the group table from a list of rows. Returns the function, its code
+        and a dict from the line numbers of the code to the (column name, function) of the aggregate the line
+        updates. """
+
+        pos = {name: i for i, name in enumerate(self._headers)}
+
+        key = ', '.join('row[{}]'.format(pos[name]) for name in self.group_by)
+
+        parts = []
+        lines = {}
+
+        for (col_name, func), slot in zip(self.aggs, self._slots):
+            parts.append('v = row[{}]'.format(pos[col_name]))
+            parts.append('if v is not None:')
+            for line in UPDATE_CODE[func]:
+                lines[len(parts) + 7] = (col_name, func)  # The parts start on the seventh line
+                parts.append('    ' + line.format(slot, slot + 1))
+
+        code = 'def _update(table, rows, new_state):\n' \
+               '    for row in rows:\n' \
+               '        k = ({},)\n' \
+               '        s = table.get(k)\n' \
+               '        if s is None:\n' \
+               '            s = table[k] = new_state()\n' \
+               '        {}\n'.format(key, '\n        '.join(parts))
+
+        namespace = {}
+        exec(compile(code, '<aggregate>', 'exec'), namespace)
+
+        return namespace['_update'], code, lines
+
+    def process(self, rows):
+        """Add a list of rows to the group table"""
+
+        try:
+            self._update(self.table, rows, self.new_state)
+        except TypeError as e:
+            tb = sys.exc_info()[2]
+
+            # The line of the generated function that failed tells which aggregate it was computing
+            lineno = None
+            while tb is not None:
+                if tb.tb_frame.f_code.co_filename == '<aggregate>':
+                    lineno = tb.tb_lineno
+                tb = tb.tb_next
+
+            if lineno in self._update_lines:
+                col_name, func = self._update_lines[lineno]
+                message = "Failed to compute the {} of column '{}': {}".format(func, col_name, e)
+            else:
+                message = 'Failed to group on columns {}: {}'.format(self.group_by, e)
+
+            reraise(TypeError, TypeError(message), sys.exc_info()[2])
+
+        self.n_rows += len(rows)
+
+        if len(self.table) > self.max_groups:
+            self._spill()
+
+    def merge(self, table):
+        """Merge a partial group table, such as one computed in another process, into the group table"""
+
+        self._merge_into(self.table, iteritems(table))
+
+        if len(self.table) > self.max_groups:
+            self._spill()
+
+    def _merge_into(self, table, items):
+
+        for k, o in items:
+            s = table.get(k)
+
+            if s is None:
+                table[k] = o
+                continue
+
+            for (col_name, func), slot in zip(self.aggs, self._slots):
+
+                if func in ('sum', 'mean'):
+                    if o[slot] is not None:
+                        s[slot] = o[slot] if s[slot] is None else s[slot] + o[slot]
+                    if func == 'mean':
+                        s[slot + 1] += o[slot + 1]
+                elif func == 'count':
+                    s[slot] += o[slot]
+                elif func == 'min':
+                    if s[slot] is None or (o[slot] is not None and o[slot] < s[slot]):
+                        s[slot] = o[slot]
+                elif func == 'max':
+                    if s[slot] is None or (o[slot] is not None and o[slot] > s[slot]):
+                        s[slot] = o[slot]
+                elif func == 'count_distinct':
+                    s[slot] |= o[slot]
+
+    def run(self, source, processes=None):
+        """Aggregate all of the rows from an iterator.
+
+        Args:
+            source (iterator): generates positional rows, tuples or lists.
+            processes (int, optional): if greater than 1, aggregate batches of rows in a pool of worker
+                processes, and merge the partial aggregates.
+
+        Returns:
+            HashAggregator: self, which can be iterated to get the result rows.
+
+        """
+
+        source = iter(source)
+
+        def batches():
+            while True:
+                batch = list(islice(source, self.BATCH_SIZE))
+                if not batch:
+                    break
+                yield batch
+
+        if processes and processes > 1:
+            from collections import deque
+            from multiprocessing import Pool
+
+            pool = Pool(processes)
+            pending = deque()
+            max_pending = self.PENDING_BATCHES * processes
+
+            def merge_next():
+                n_rows, table = pending.popleft().get()
+                self.n_rows += n_rows
+                self.merge(table)
+
+            try:
+                spec = self.spec
+                for batch in batches():
+                    pending.append(pool.apply_async(_aggregate_batch, ((spec, batch),)))
+
+                    if len(pending) >= max_pending:
+                        merge_next()
+
+                while pending:
+                    merge_next()
+            finally:
+                pool.close()
+                pool.join()
+
+        else:
+            for batch in batches():
+                self.process(batch)
+
+        return self
+
+    def _row(self, k, s):
+        """Convert a group key and state into a result row"""
+
+        values = list(k)
+
+        for (col_name, func), slot in zip(self.aggs, self._slots):
+            if func == 'mean':
+                values.append(float(s[slot]) / s[slot + 1] if s[slot + 1] else None)
+            elif func == 'count_distinct':
+                values.append(len(s[slot]))
+            else:
+                values.append(s[slot])
+
+        return tuple(values)
+
+    def __iter__(self):
+        """Generate the result rows. If the groups were spilled to disk, the spill files are removed after
+        the rows are generated, so the results can only be iterated once. """
+
+        if self._spill_dir is None:
+            if self._spilled:
+                raise AggregateError('The results of an aggregation that spilled to disk can only be '
+                                     'iterated once')
+
+            for k, s in iteritems(self.table):
+                yield self._row(k, s)
+            return
+
+        self._spill()
+
+        try:
+            for i in range(self.N_PARTITIONS):
+                table = {}
+                self._merge_into(table, self._read_partition(i))
+
+                for k, s in iteritems(table):
+                    yield self._row(k, s)
+        finally:
+            self.close()
+
+    def _partition_path(self, i):
+        return os.path.join(self._spill_dir, 'partition{}.msg'.format(i))
+
+    def _spill(self):
+        """Write the partial aggregates of the group table to the spill files, then clear it. """
+        from .mpf import MPRowsFile
+
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.mkdtemp(prefix='ambry-aggregate-')
+
+        self._spilled = True
+
+        logger.debug('Spilling {} groups to {}'.format(len(self.table), self._spill_dir))
+
+        partitions = [[] for _ in range(self.N_PARTITIONS)]
+
+        for k, s in iteritems(self.table):
+            for slot in self._distinct_slots:
+                s[slot] = list(s[slot])
+
+            partitions[hash(k) % self.N_PARTITIONS].append((k, s))
+
+        for i, entries in enumerate(partitions):
+            if entries:
+                with open(self._partition_path(i), 'ab') as f:
+                    f.write(msgpack.packb(entries, default=MPRowsFile.encode_obj, encoding='utf-8'))
+
+        self.table = {}
+
+    def _read_partition(self, i):
+        from .mpf import MPRowsFile
+
+        path = self._partition_path(i)
+
+        if not os.path.exists(path):
+            return
+
+        with open(path, 'rb') as f:
+            unpacker = msgpack.Unpacker(f, object_hook=MPRowsFile.decode_obj, use_list=False, encoding='utf-8')
+
+            for entries in unpacker:
+                for k, s in entries:
+                    s = list(s)
+                    for slot in self._distinct_slots:
+                        s[slot] = set(s[slot])
+                    yield k, s
+
+    def close(self):
+        """Remove the spill files"""
+
+        if self._spill_dir is not None:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+            self._spill_dir = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+        if exc_val:
+            return False
+
+
+def _aggregate_batch(args):
+    """Aggregate a batch of rows in a worker process and return the partial group table. """
+
+    (headers, group_by, aggs, max_groups), rows = args
+
+    # The parent process handles spilling, so the worker table is only limited by the batch size.
+    agg = HashAggregator(headers, group_by, aggs, max_groups=len(rows) + 1)
+    agg.process(rows)
+
+    return agg.n_rows, agg.table
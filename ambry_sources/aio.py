@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+
+Asynchronous iteration over the rows of MPR and HDF files, for use with asyncio. The blocking work of reading,
+decompressing and decoding the rows runs in a thread pool executor, a configurable number of batches ahead of
+the consumer, so the event loop is free to run other tasks while a large file is read.
+
+>>> async for batch in MPRowsFile(fs, 'foobar').aiter_batches():
+>>>     handle(batch)
+
+The iterators are written without the async syntax, so this module can be imported in Python 2, but they can
+only be used with asyncio on Python 3.5 or later.
+
+Copyright (c) 2015 Civic Knowledge. This file is licensed under the terms of the
+Revised BSD License, included in this distribution as LICENSE.txt
+"""
+
+from collections import deque
+
+_END = object()  # Returned by the executor when the batch iterator is exhausted
+
+
+class _BlockingBatches(object):
+    """Holds the blocking iterator of batches, which is created by the first read, in the executor, so opening
+    the file doesn't block the loop either. """
+
+    def __init__(self, batches):
+        self._batches = batches
+        self._it = None
+
+    def next(self):
+        if self._it is None:
+            self._it = iter(self._batches())
+
+        try:
+            return next(self._it)
+        except StopIteration:
+            return _END
+
+    def close(self):
+        close = getattr(self._it, 'close', None)
+        if close:
+            close()
+
+
+class AsyncBatchIterator(object):
+    """An asynchronous iterator over the batches generated by a blocking iterator.
+
+    Each batch is read by calling next() on the blocking iterator in an executor. Up to prefetch calls are
+    queued ahead of the consumer. The default executor has a single thread, so the calls run in order, one
+    at a time.
+
+    """
+
+    PREFETCH = 2  # Number of batches to read ahead of the consumer
+
+    def __init__(self, batches, prefetch=None, loop=None, executor=None):
+        """
+
+        Args:
+            batches (callable): returns the blocking iterator of batches. It is called in the executor.
+            prefetch (int, optional): number of batches to read ahead of the consumer.
+            loop (asyncio event loop, optional): defaults to the current event loop.
+            executor (concurrent.futures.Executor, optional): the executor for the blocking calls. It must
+                run the calls in order; if not given, a single thread executor is created and shut down
+                when iteration ends.
+
+        """
+        import asyncio
+
+        self._blocking = _BlockingBatches(batches)
+        self._loop = loop or asyncio.get_event_loop()
+        self.prefetch = max(prefetch or self.PREFETCH, 1)
+
+        if executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            self._executor = ThreadPoolExecutor(max_workers=1)
+            self._own_executor = True
+        else:
+            self._executor = executor
+            self._own_executor = False
+
+        self._pending = deque()
+        self._claimed = deque()  # (result, read) of the calls that are waiting for a read, in order
+        self._done = False
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        """Return a future for the next batch. The future is resolved by a callback from the loop, so other
+        tasks run between batches, even if the batch was already read. """
+
+        result = self._loop.create_future()
+
+        if self._done:
+            result.set_exception(StopAsyncIteration())
+            return result
+
+        self._reclaim()
+
+        while len(self._pending) < self.prefetch:
+            self._pending.append(self._loop.run_in_executor(self._executor, self._blocking.next))
+
+        read = self._pending.popleft()
+        self._claimed.append((result, read))
+
+        def on_batch(f):
+            if result.cancelled():
+                return
+
+            if f.cancelled():
+                result.cancel()
+            elif f.exception() is not None:
+                self._finish()
+                result.set_exception(f.exception())
+            elif f.result() is _END:
+                self._finish()
+                result.set_exception(StopAsyncIteration())
+            else:
+                result.set_result(f.result())
+
+        read.add_done_callback(lambda f: self._loop.call_soon(on_batch, f))
+
+        return result
+
+    def _reclaim(self):
+        """Put the reads of cancelled calls back at the front of the queue, in order, so a consumer that is
+        cancelled while waiting doesn't lose the batch. """
+
+        for result, read in reversed(self._claimed):
+            if result.cancelled():
+                self._pending.appendleft(read)
+
+        self._claimed = deque((result, read) for result, read in self._claimed if not result.done())
+
+    def _finish(self):
+        """Stop reading, close the blocking iterator and release the executor"""
+
+        if self._done:
+            return
+
+        self._done = True
+
+        for f in self._pending:
+            f.cancel()
+
+        self._pending.clear()
+        self._claimed.clear()
+
+        # Runs after any read that is already running, since the executor runs calls in order.
+        self._executor.submit(self._blocking.close)
+
+        if self._own_executor:
+            self._executor.shutdown(wait=False)
+
+    def aclose(self):
+        """Stop iteration early and close the underlying reader. Returns a future. """
+        self._finish()
+
+        f = self._loop.create_future()
+        f.set_result(None)
+        return f
+
+
+class AsyncRowIterator(object):
+    """An asynchronous iterator over the rows of the batches from an AsyncBatchIterator. Rows within a batch are
+    returned without waiting; the loop runs other tasks when the next batch is fetched. """
+
+    def __init__(self, batches):
+        self._batches = batches
+        self._batch = []
+        self._pos = 0
+        self._loop = batches._loop
+        self._fetching = None  # (result, [batch future]) of the last call that fetched a batch
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+
+        self._reclaim()
+
+        if self._pos < len(self._batch):
+            result = self._loop.create_future()
+            result.set_result(self._batch[self._pos])
+            self._pos += 1
+            return result
+
+        result = self._loop.create_future()
+        current = [None]  # The future for the batch being fetched
+
+        def fetch():
+            current[0] = self._batches.__anext__()
+            current[0].add_done_callback(on_batch)
+
+        def on_batch(f):
+            if result.cancelled():
+                return
+
+            if f.cancelled():
+                result.cancel()
+                return
+
+            if f.exception() is not None:
+                result.set_exception(f.exception())
+                return
+
+            self._batch = f.result()
+            self._pos = 0
+
+            if not self._batch:  # Skip empty batches
+                fetch()
+                return
+
+            result.set_result(self._batch[0])
+            self._pos = 1
+
+        self._fetching = (result, current)
+        fetch()
+
+        return result
+
+    def _reclaim(self):
+        """If the last call that fetched a batch was cancelled, hand the batch back to the batch iterator, or
+        keep it if it has already been read. """
+
+        if self._fetching is None or not self._fetching[0].cancelled():
+            return
+
+        f = self._fetching[1][0]
+        self._fetching = None
+
+        if not f.cancel() and not f.cancelled() and f.exception() is None:
+            self._batch = f.result()
+            self._pos = 0
+
+    def aclose(self):
+        return self._batches.aclose()
+
+
+def aiter_batches(batches, prefetch=None, loop=None, executor=None):
+    """Return an asynchronous iterator over the batches from a function that returns a blocking iterator
+    of batches, such as the iter_batches() method of MPRowsFile or HDFPartition. """
+    return AsyncBatchIterator(batches, prefetch=prefetch, loop=loop, executor=executor)
+
+
+def aiter_rows(batches, prefetch=None, loop=None, executor=None):
+    """Return an asynchronous iterator over the rows of the batches from a function that returns a blocking
+    iterator of batches. """
+    return AsyncRowIterator(AsyncBatchIterator(batches, prefetch=prefetch, loop=loop, executor=executor))
@@ -0,0 +1,522 @@
+# -*- coding: utf-8 -*-
+"""
+
+A repeatable benchmark suite for writing, reading and analyzing MPR and HDF files, over synthetic datasets with
+different shapes: narrow and wide, numeric and string, date heavy, and with many nulls. Results are emitted as
+JSON, so runs can be compared.
+
+    $ ampr bench -n 20000 -d narrow -d dates -b mpr_write_block -b mpr_read_rows -o results.json
+
+>>> results = run(n_rows=10000, datasets=['narrow'])
+>>> print json.dumps(results, indent=4)
+
+Copyright (c) 2015 Civic Knowledge. This file is licensed under the terms of the
+Revised BSD License, included in this distribution as LICENSE.txt
+"""
+
+import argparse
+import datetime
+import json
+import platform
+import random
+import sys
+import time
+
+from fs.opener import fsopendir
+import six
+
+from .__meta__ import __version__
+from .mpf import MPRowsFile, MPRWriter
+
+N_ROWS = 20000  # Default number of rows in each dataset
+REPEAT = 3  # Default number of times to run each benchmark; the best time is reported
+
+
+def _narrow(rand, i):
+    return [i, rand.randint(0, 1000), rand.random(), rand.random() * 1000]
+
+
+def _wide(rand, i):
+    return [i] + [rand.randint(0, 1000) if j % 2 else rand.random() for j in range(49)]
+
+
+_WORDS = ('alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel', 'india', 'juliet')
+
+
+def _strings(rand, i):
+    return [i,
+            rand.choice(_WORDS),
+            ' '.join(rand.choice(_WORDS) for _ in range(rand.randint(2, 12))),
+            '{:032x}'.format(rand.getrandbits(128)),
+            'CA-{:05d}'.format(rand.randint(0, 500))]
+
+
+_EPOCH = datetime.datetime(2000, 1, 1)
+
+
+def _dates(rand, i):
+    dt = _EPOCH + datetime.timedelta(seconds=rand.randint(0, 16 * 365 * 86400))
+    return [i, dt.date(), dt, dt.time(), (dt + datetime.timedelta(days=rand.randint(0, 90))).date()]
+
+
+def _nulls(rand, i):
+    row = _narrow(rand, i) + _strings(rand, i)[1:3] + _dates(rand, i)[1:2]
+    return [None if j and rand.random() < 0.3 else v for j, v in enumerate(row)]
+
+
+# Dataset name: (headers, row generator)
+DATASETS = {
+    'narrow': (['id', 'count', 'ratio', 'amount'], _narrow),
+    'wide': (['id'] + ['c{}'.format(j) for j in range(1, 50)], _wide),
+    'strings': (['id', 'word', 'phrase', 'hash', 'code'], _strings),
+    'dates': (['id', 'date', 'datetime', 'time', 'due'], _dates),
+    'nulls': (['id', 'count', 'ratio', 'amount', 'word', 'phrase', 'date'], _nulls),
+}
+
+
+class UnsupportedDataset(Exception):
+    """Raised by a benchmark that can't run over a dataset. The result is recorded as skipped"""
+
+
+def dataset(name, n_rows, seed=0):
+    """Return the headers and a list of n_rows rows for a dataset. The rows are the same for the same seed. """
+
+    headers, f = DATASETS[name]
+    rand = random.Random(seed)
+
+    return headers, [f(rand, i) for i in range(n_rows)]
+
+
+def _kind(values):
+    """Return the testing.KINDS kind of a column, from its first value that isn't None"""
+
+    v = next((v for v in values if v is not None), None)
+
+    # datetime before date, since it is a subclass of date
+    for type_, kind in ((datetime.datetime, 'datetime'), (datetime.date, 'date'), (datetime.time, 'time'),
+                        (float, 'float'), (six.integer_types, 'int')):
+        if isinstance(v, type_):
+            return kind
+
+    return 'str'
+
+
+class _Context(object):
+    """The data, files and shared setup for the benchmarks of one dataset"""
+
+    def __init__(self, fs, name, headers, rows):
+        self.fs = fs
+        self.name = name
+        self.headers = headers
+        self.rows = rows
+        self._mpr = None
+        self._hdf = None
+
+    def new_mpr(self, suffix):
+        f = MPRowsFile(self.fs, '{}_{}'.format(self.name, suffix))
+        if f.exists:
+            f.remove()
+        return f
+
+    @property
+    def mpr(self):
+        """An MPR file with the dataset's rows, types and stats"""
+        from .sources import GeneratorSource, SourceSpec
+
+        if not self._mpr:
+            f = self.new_mpr('loaded')
+            source = GeneratorSource(SourceSpec(self.name), iter([self.headers] + self.rows))
+            self._mpr = f.load_rows(source, intuit_rows=False)
+
+        return self._mpr
+
+    @property
+    def hdf(self):
+        """An HDF partition with the dataset's rows """
+        if not self._hdf:
+            self._hdf = self.write_hdf('loaded')
+
+        return self._hdf
+
+    def source(self, fmt):
+        """A source accessor, from sources.accessors, for a file of the dataset's rows in a format that
+        testing.write() writes: 'csv', 'fixed' or 'xlsx'"""
+        from . import testing
+
+        if fmt == 'xlsx' and len(self.rows) + 1 > testing.EXCEL_MAX_ROWS:
+            raise UnsupportedDataset('Excel sheets can have at most {} rows'.format(testing.EXCEL_MAX_ROWS))
+
+        path = '{}_source.{}'.format(self.name, 'txt' if fmt == 'fixed' else fmt)
+
+        # Fixed width columns fit the longest value
+        columns = [(name, _kind(values), dict(width=None))
+                   for name, values in zip(self.headers, zip(*self.rows))]
+
+        source_spec = testing.write(dict(format=fmt, columns=columns, header_rows=0 if fmt == 'fixed' else 1),
+                                    self.rows, len(self.rows), fs=self.fs, path=path)
+
+        return testing.open_source(source_spec, self.fs, path)
+
+    def write_hdf(self, suffix):
+        from .hdf_partitions import HDFPartition
+
+        f = HDFPartition(self.fs, '{}_{}'.format(self.name, suffix))
+        if f.exists:
+            f.remove()
+
+        with self.mpr.reader as r:
+            types = [c.type for c in r.columns]
+
+        with f.writer as w:
+            w.headers = self.headers
+            for c, t in zip(w.columns, types):
+                c.type = t
+            w.insert_rows(self.rows)
+
+        return f
+
+
+def mpr_write_rows(ctx):
+    """Write rows one at a time, with insert_row()"""
+    def bench():
+        with ctx.new_mpr('rows').writer as w:
+            for row in ctx.rows:
+                w.insert_row(row)
+    return bench
+
+
+def mpr_write_block(ctx):
+    """Write rows in blocks of MPRWriter.BLOCK_SIZE, with insert_rows()"""
+    def bench():
+        with ctx.new_mpr('block').writer as w:
+            for i in range(0, len(ctx.rows), MPRWriter.BLOCK_SIZE):
+                w.insert_rows(ctx.rows[i:i + MPRWriter.BLOCK_SIZE])
+    return bench
+
+
+def mpr_read_rows(ctx):
+    """Iterate the rows as tuples"""
+    f = ctx.mpr
+
+    def bench():
+        with f.reader as r:
+            for row in r.rows:
+                pass
+    return bench
+
+
+def mpr_read_raw(ctx):
+    """Iterate all rows, including the header, as tuples"""
+    f = ctx.mpr
+
+    def bench():
+        with f.reader as r:
+            for row in r.raw:
+                pass
+    return bench
+
+
+def mpr_read_proxy(ctx):
+    """Iterate the rows as a RowProxy, accessing one column by name"""
+    f, name = ctx.mpr, ctx.headers[1]
+
+    def bench():
+        with f.reader as r:
+            for row in r:
+                row[name]
+    return bench
+
+
+def mpr_read_records(ctx):
+    """Iterate the rows as RowRecords, accessing one column by attribute"""
+    f, name = ctx.mpr, ctx.headers[1]
+
+    def bench():
+        with f.reader as r:
+            for row in r.iter_records():
+                getattr(row, name)
+    return bench
+
+
+def mpr_read_batches(ctx):
+    """Iterate the batches of rows"""
+    f = ctx.mpr
+
+    def bench():
+        with f.reader as r:
+            for batch in r.iter_batches():
+                pass
+    return bench
+
+
+def mpr_select(ctx):
+    """Select half of the rows and project one column, with select() and a predicate function over RowProxy
+    objects"""
+    f, name = ctx.mpr, ctx.headers[1]
+
+    def bench():
+        for row in f.select(lambda row: row.id % 2 == 0, [name]):
+            pass
+    return bench
+
+
+def mpr_query(ctx):
+    """Select half of the rows and project one column, with a compiled query()"""
+    f, name = ctx.mpr, ctx.headers[1]
+
+    def bench():
+        for row in f.query('id % 2 == 0', [name]):
+            pass
+    return bench
+
+
+def mpr_accessors(ctx):
+    """Read the headers, row count and metadata 100 times with the MPRowsFile properties, which each open
+    a reader"""
+    f = MPRowsFile(ctx.fs, ctx.mpr.path)
+
+    def bench():
+        for i in range(bench.calls):
+            f.headers, f.n_rows, f.meta
+    bench.calls = 100
+    return bench
+
+
+def _source_bench(ctx, fmt):
+    source = ctx.source(fmt)
+
+    def bench():
+        for row in source:
+            pass
+    return bench
+
+
+def csv_source(ctx):
+    """Iterate the rows of a CSV file with CsvSource"""
+    return _source_bench(ctx, 'csv')
+
+
+def fixed_source(ctx):
+    """Iterate the rows of a fixed width file with FixedSource"""
+    return _source_bench(ctx, 'fixed')
+
+
+def excel_source(ctx):
+    """Iterate the rows of an Excel sheet with ExcelSource"""
+    return _source_bench(ctx, 'xlsx')
+
+
+def type_intuiter(ctx):
+    """Run the TypeIntuiter over the rows"""
+    from .intuit import TypeIntuiter
+
+    def bench():
+        TypeIntuiter().process_header(ctx.headers).run(ctx.rows, len(ctx.rows))
+    return bench
+
+
+def row_intuiter(ctx):
+    """Run the RowIntuiter over the head and tail of the rows"""
+    from .intuit import RowIntuiter
+
+    n = RowIntuiter.N_TEST_ROWS
+    rows = [ctx.headers] + ctx.rows
+
+    def bench():
+        RowIntuiter().run(rows[:n], rows[-n:], len(rows))
+    return bench
+
+
+def stats(ctx):
+    """Compute the stats of the rows, as RowRecords"""
+    from six.moves import map
+    from .sources import row_class
+    from .stats import Stats
+
+    with ctx.mpr.reader as r:
+        columns = [(c.name, c.type) for c in r.columns]
+
+    Row = row_class(ctx.headers)
+
+    def bench():
+        Stats(columns, len(ctx.rows)).run(map(Row, ctx.rows), sample_from=len(ctx.rows))
+    return bench
+
+
+def hdf_write(ctx):
+    """Write the rows to an HDF partition"""
+    ctx.mpr  # For the column types
+
+    def bench():
+        ctx.write_hdf('write')
+    return bench
+
+
+def hdf_read(ctx):
+    """Iterate the rows of an HDF partition"""
+    f = ctx.hdf
+
+    def bench():
+        with f.reader as r:
+            for row in r.rows:
+                pass
+    return bench
+
+
+def hdf_accessors(ctx):
+    """Read the headers, row count and metadata 100 times with the HDFPartition properties"""
+    f = ctx.hdf
+
+    def bench():
+        for i in range(bench.calls):
+            f.headers, f.n_rows, f.meta
+    bench.calls = 100
+    return bench
+
+
+# Each benchmark function does any setup, such as writing the file to read, and returns the function to time.
+BENCHMARKS = [mpr_write_rows, mpr_write_block, mpr_read_rows, mpr_read_raw, mpr_read_proxy, mpr_read_records,
+              mpr_read_batches, mpr_select, mpr_query, mpr_accessors, csv_source, fixed_source, excel_source,
+              type_intuiter, row_intuiter, stats, hdf_write, hdf_read, hdf_accessors]
+
+
+def _has_hdf():
+    try:
+        import tables  # noqa
+        return True
+    except ImportError:
+        return False
+
+
+def run(n_rows=None, datasets=None, benchmarks=None, repeat=None, seed=0, fs=None, callback=None):
+    """
+    Run benchmarks over datasets, and return the results as a dict that can be serialized to JSON.
+
+    :param n_rows: Number of rows in each dataset
+    :param datasets: Names of datasets, from DATASETS. Defaults to all of them.
+    :param benchmarks: Names of benchmarks, from BENCHMARKS. Defaults to all of them.
+    :param repeat: Number of times to run each benchmark. The best time is reported.
+    :param seed: Random seed for the datasets
+    :param fs: Filesystem for the benchmark files. Defaults to a temporary directory.
+    :param callback: If given, called with each result as it is produced
+    :return: a dict with the run parameters, and a list of results, one per dataset and benchmark.
+    """
+
+    n_rows = n_rows or N_ROWS
+    repeat = repeat or REPEAT
+    datasets = datasets or sorted(DATASETS)
+
+    funcs = {f.__name__: f for f in BENCHMARKS}
+    names = benchmarks or [f.__name__ for f in BENCHMARKS]
+
+    for name in list(datasets) + list(names):
+        if name not in DATASETS and name not in funcs:
+            raise ValueError("Unknown dataset or benchmark '{}'".format(name))
+
+    fs = fs or fsopendir('temp://')
+    has_hdf = _has_hdf()
+
+    results = []
+
+    for ds_name in datasets:
+        headers, rows = dataset(ds_name, n_rows, seed)
+        ctx = _Context(fs, ds_name, headers, rows)
+
+        for name in names:
+            result = dict(dataset=ds_name, benchmark=name, rows=n_rows)
+
+            if name.startswith('hdf') and not has_hdf:
+                result['skipped'] = 'pytables is not installed'
+            else:
+                try:
+                    bench = funcs[name](ctx)
+
+                    times = []
+                    for i in range(repeat):
+                        t = time.time()
+                        bench()
+                        times.append(time.time() - t)
+
+                except UnsupportedDataset as e:
+                    result['skipped'] = str(e)
+
+                else:
+                    best = min(times)
+                    calls = getattr(bench, 'calls', None)
+
+                    result.update(seconds=round(best, 6), mean_seconds=round(sum(times) / len(times), 6))
+
+                    if calls:
+                        result['calls_per_second'] = round(calls / best, 1) if best else None
+                    else:
+                        result['rows_per_second'] = round(n_rows / best, 1) if best else None
+
+            results.append(result)
+
+            if callback:
+                callback(result)
+
+    return dict(
+        version=__version__,
+        python=platform.python_version(),
+        platform=platform.platform(),
+        time=time.time(),
+        n_rows=n_rows,
+        repeat=repeat,
+        seed=seed,
+        results=results)
+
+
+def make_arg_parser(parser=None):
+
+    if not parser:
+        parser = argparse.ArgumentParser(
+            prog='ampr bench',
+            description='Run the Ambry Message Pack Rows benchmarks and output the results as JSON')
+
+    parser.add_argument('-n', '--rows', type=int, default=N_ROWS,
+                        help='Number of rows in each dataset. Default: {}'.format(N_ROWS))
+    parser.add_argument('-r', '--repeat', type=int, default=REPEAT,
+                        help='Number of times to run each benchmark. Default: {}'.format(REPEAT))
+    parser.add_argument('-d', '--dataset', action='append', choices=sorted(DATASETS),
+                        help='Dataset to use. May be repeated. Default: all')
+    parser.add_argument('-b', '--benchmark', action='append', choices=[f.__name__ for f in BENCHMARKS],
+                        help='Benchmark to run. May be repeated. Default: all')
+    parser.add_argument('-s', '--seed', type=int, default=0, help='Random seed for the datasets')
+    parser.add_argument('-o', '--output', help='Write the JSON results to a file, rather than stdout')
+    parser.add_argument('-l', '--list', action='store_true', help='List the datasets and benchmarks')
+
+    return parser
+
+
+def main(argv=None):
+    import logging
+
+    args = make_arg_parser().parse_args(argv)
+
+    # The HDF reader warns about each missing metadata table, on each read
+    logging.getLogger('ambry_sources.hdf_partitions.core').setLevel(logging.ERROR)
+
+    if args.list:
+        print('DATASETS')
+        for name in sorted(DATASETS):
+            print('    {:<20s} {}'.format(name, ', '.join(DATASETS[name][0][:8])))
+        print('BENCHMARKS')
+        for f in BENCHMARKS:
+            print('    {:<20s} {}'.format(f.__name__, f.__doc__))
+        return
+
+    def progress(result):
+        sys.stderr.write('{dataset:<10s} {benchmark:<20s} {0}\n'.format(
+            result.get('rows_per_second', result.get('calls_per_second', result.get('skipped'))), **result))
+
+    results = run(n_rows=args.rows, datasets=args.dataset, benchmarks=args.benchmark, repeat=args.repeat,
+                  seed=args.seed, callback=progress)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+    else:
+        print(json.dumps(results, indent=4))
+
+    return results
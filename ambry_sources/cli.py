@@ -21,7 +21,8 @@ def make_arg_parser(parser=None):
     if not parser:
         parser = argparse.ArgumentParser(
             prog='ampr',
-            description='Ambry Message Pack Rows file access version:'.format(__version__))
+            description='Ambry Message Pack Rows file access version:'.format(__version__),
+            epilog='Run `ampr bench -h` for the benchmark suite')
 
     parser.add_argument('-m', '--meta', action='store_true',
                         help='Show metadata')
@@ -52,6 +53,12 @@ def make_arg_parser(parser=None):
 def main(args=None):
     from operator import itemgetter
     from datetime import datetime
+    import sys
+
+    if not args and sys.argv[1:2] == ['bench']:
+        from .bench import main as bench_main
+        bench_main(sys.argv[2:])
+        return
 
     if not args:
         parser = make_arg_parser()
@@ -87,10 +94,15 @@ def main(args=None):
             with open(args.csv, 'wb') as out_f:
                 w = csv.writer(out_f)
                 w.writerow(r.headers)
-                for i, row in enumerate(r.rows):
-                    w.writerow(row)
+                n = 0
+                for batch in r.iter_batches():
+                    if limit and n + len(batch) > limit + 1:
+                        batch = batch[:limit + 1 - n]
+
+                    w.writerows(batch)
+                    n += len(batch)
 
-                    if limit and i >= limit:
+                    if limit and n > limit:
                         break
 
         return
@@ -3,24 +3,28 @@
 Writing data to a HDF partition.
 """
 
+from collections import OrderedDict
 from copy import deepcopy
 from functools import reduce
+import datetime
+from operator import itemgetter
 import json
 import logging
 import math
 import time
 import os
 import re
+import sys
 
-from tables import open_file, StringCol, Int64Col, Float64Col, BoolCol, Int32Col
+from tables import open_file, StringCol, Int64Col, Float64Col, BoolCol, Int32Col, VLStringAtom, Float64Atom
+from tables.parameters import EXPECTED_ROWS_TABLE
 from tables.exceptions import NoSuchNodeError
 import numpy as np
 
 import six
 from six import string_types, iteritems, text_type, binary_type
 
-from ambry_sources.sources import RowProxy
-from ambry_sources.stats import Stats
+from ambry_sources.sources import RowProxy, row_class
 from ambry_sources.mpf import MPRowsFile
 
 logger = logging.getLogger(__name__)
@@ -29,6 +33,17 @@ logger = logging.getLogger(__name__)
 MIN_INT32 = np.iinfo(np.int32).min
 MIN_INT64 = np.iinfo(np.int64).min
 
+# The numexpr operators of the names of the ast nodes of conditions.
+_CONDITION_OPS = {
+    'Eq': '==', 'NotEq': '!=', 'Lt': '<', 'LtE': '<=', 'Gt': '>', 'GtE': '>=',
+    'Add': '+', 'Sub': '-', 'Mult': '*', 'Div': '/', 'Mod': '%', 'Pow': '**', 'LShift': '<<', 'RShift': '>>',
+    'BitAnd': '&', 'BitOr': '|', 'BitXor': '^', 'Invert': '~', 'USub': '-', 'UAdd': '+'}
+
+# Size of the string columns with no length or width in the schema, and the largest size of a string column.
+# Values that don't fit in their column are kept whole in the overflow store.
+DEFAULT_STRING_SIZE = 255
+MAX_STRING_SIZE = 1024
+
 
 class HDFError(Exception):
     pass
@@ -40,14 +55,27 @@ class HDFPartition(object):
     EXTENSION = '.h5'
     VERSION = 1
 
-    def __init__(self, url_or_fs, path=None):
+    # Default compression of the rows table. Blosc is much faster than zlib, at a similar ratio.
+    COMPLIB = 'blosc'
+    COMPLEVEL = 5
+
+    def __init__(self, url_or_fs, path=None, metrics=None, complib=None, complevel=None, shuffle=True):
         """
 
         Args:
             url_or_fs (str or filesystem):
             path (str):
+            metrics (MetricsCollector, optional): collects the metrics of the load and stats phases. If not
+                given, the partition gets its own collector, in the metrics property.
+            complib (str, optional): compression library for the rows table of new files; 'blosc', 'zlib',
+                'lzo' or 'bzip2'. Defaults to COMPLIB.
+            complevel (int, optional): compression level, 0 to 9, where 0 disables compression. Defaults
+                to COMPLEVEL.
+            shuffle (boolean, optional): if True, shuffle the bytes of values before compression.
         """
         from fs.opener import opener
+        from tables import Filters
+        from ambry_sources.metrics import MetricsCollector
 
         if path:
             self._fs, self._path = url_or_fs, path
@@ -64,6 +92,14 @@ class HDFPartition(object):
         self._process = None  # Process name for report_progress
         self._start_time = 0
 
+        self.metrics = metrics or MetricsCollector()
+
+        # The filters are stored with the rows table, so they only apply when the table is created.
+        self.filters = Filters(
+            complevel=self.COMPLEVEL if complevel is None else complevel,
+            complib=complib or self.COMPLIB,
+            shuffle=shuffle)
+
         if not self._path.endswith(self.EXTENSION):
             self._path = self._path + self.EXTENSION
 
@@ -121,30 +157,51 @@ class HDFPartition(object):
         with self.reader as r:
             return r.headers
 
-    def run_stats(self):
-        """Run the stats process and store the results back in the metadata"""
+    def run_stats(self, start=0):
+        """Run the stats process and store the results back in the metadata
+
+        Args:
+            start (int, optional): position of the first row to read. The stats of the rows before it are
+                restored from the state saved by the last run, if it was for those rows; otherwise all of the
+                rows are read.
+
+        """
+        from .stats import ColumnStats
 
         try:
             self._process = 'run_stats'
             self._start_time = time.time()
 
-            with self.reader as r:
-                stats = Stats([(c.name, c.type) for c in r.columns]).run(r, sample_from=r.n_rows)
+            with self.metrics.phase('run_stats') as phase:
+                with self.reader as r:
+                    # The stats are computed from the stored arrays, a column at a time.
+                    stats = ColumnStats([(c.name, c.type) for c in r.columns], n_rows=r.n_rows)
+                    state = r.stats_state if start else None
+
+                    if state and list(state) == list(stats.dict) and all(s['n'] == start for s, _ in state.values()):
+                        stats.restore(state)
+                    else:
+                        start = 0
+
+                    stats = stats.run(r, start=start)
+                    phase.rows = r.n_rows - start
 
-            with self.writer as w:
-                w.set_stats(stats)
+                with self.writer as w:
+                    w.set_stats(stats)
 
         finally:
             self._process = 'none'
 
         return stats
 
-    def load_rows(self, source, run_stats=True):
+    def load_rows(self, source, run_stats=True, indexes=None):
         """ Loads rows from given source.
 
         Args:
             source (SourceFile):
             run_stats (boolean, optional): if True then collect stat and save it to meta.
+            indexes (list of str, optional): names of columns to index, with full indexes, after the rows
+                are loaded.
 
         Returns:
             HDFPartition:
@@ -159,16 +216,125 @@ class HDFPartition(object):
             self._process = 'load_rows'
             self._start_time = time.time()
 
-            with self.writer as w:
-                w.load_rows(source)
+            with self.metrics.phase('load_rows') as load_phase:
+
+                with self.metrics.phase('write_rows') as write_phase:
+                    with self.writer as w:
+                        w.load_rows(source)
+
+                        for column in (indexes or []):
+                            w.create_index(column)
+
+                    write_phase.bytes_out = os.path.getsize(self.syspath)
+
+                if run_stats:
+                    self.run_stats()
+
+                load_phase.rows, load_phase.bytes_out = write_phase.rows, write_phase.bytes_out
+        finally:
+            self._process = None
+
+        return self
+
+    def append_rows(self, source, run_stats=True):
+        """ Appends rows from given source to the rows already loaded, and updates the file header. The stats
+        are updated from the new rows only, when the state of the stats saved by the last run_stats() is for all
+        of the rows before them; otherwise they are computed again from all rows. A partition with no rows is
+        loaded with load_rows().
+
+        Args:
+            source (SourceFile):
+            run_stats (boolean, optional): if True then update the stats and save them to meta.
+
+        Returns:
+            HDFPartition:
+
+        """
+        if not self.n_rows:
+            return self.load_rows(source, run_stats=run_stats)
+
+        try:
+
+            self._process = 'append_rows'
+            self._start_time = time.time()
+
+            with self.metrics.phase('append_rows') as append_phase:
+
+                with self.metrics.phase('write_rows') as write_phase:
+                    with self.writer as w:
+                        start = w.n_rows
+                        w.load_rows(source)
 
-            if run_stats:
-                self.run_stats()
+                    write_phase.bytes_out = os.path.getsize(self.syspath)
+
+                if run_stats:
+                    self.run_stats(start=start)
+
+                append_phase.rows, append_phase.bytes_out = write_phase.rows, write_phase.bytes_out
         finally:
             self._process = None
 
         return self
 
+    @classmethod
+    def from_mpr(cls, mpr, url_or_fs=None, path=None, workers=None, **kwargs):
+        """ Creates an HDF partition from an MPR file. The metadata and stats are copied from the MPR file
+        rather than computed again, and the rows are converted by a pipeline of threads and worker
+        processes; see HDFWriter.load_mpr().
+
+        Args:
+            mpr (MPRowsFile):
+            url_or_fs (str or filesystem, optional): Defaults to the filesystem of the MPR file.
+            path (str, optional): Defaults to the path of the MPR file, without its extension.
+            workers (int, optional): number of worker processes that decode and convert the blocks of rows.
+            **kwargs: other arguments of HDFPartition(), such as the compression.
+
+        Returns:
+            HDFPartition:
+
+        Raises:
+            HDFError: if the partition already has rows.
+
+        """
+        if url_or_fs is None:
+            url_or_fs, path = mpr._fs, path or os.path.splitext(mpr.path)[0]
+
+        f = cls(url_or_fs, path, **kwargs)
+
+        if f.n_rows:
+            raise HDFError("Can't convert MPR file; rows already loaded. n_rows = {}".format(f.n_rows))
+
+        try:
+            f._process = 'from_mpr'
+            f._start_time = time.time()
+
+            with f.metrics.phase('from_mpr') as phase:
+                with f.writer as w:
+                    w.load_mpr(mpr, workers=workers)
+
+                phase.bytes_out = os.path.getsize(f.syspath)
+        finally:
+            f._process = None
+
+        return f
+
+    def create_index(self, column, kind='full', optlevel=None):
+        """ Creates an index on a column, which where() conditions on the column use. See
+        HDFWriter.create_index() """
+
+        with self.writer as w:
+            w.create_index(column, kind=kind, optlevel=optlevel)
+
+    @property
+    def indexes(self):
+        """ Names of the indexed columns. """
+
+        if not self.exists:
+            return None
+
+        with self.reader as r:
+            return r.indexes
+
     @property
     def reader(self):
         if not self._reader:
@@ -184,6 +350,22 @@ class HDFPartition(object):
             for row in r:
                 yield row
 
+    def __getitem__(self, key):
+        """ Returns a row, as a tuple, for an int key, or a list of rows for a slice, read with the reader's
+        read() method. """
+
+        with self.reader as r:
+            if isinstance(key, slice):
+                return r.read(key.start, key.stop, key.step)
+
+            n_rows = r.n_rows
+            pos = key + n_rows if key < 0 else key
+
+            if not 0 <= pos < n_rows:
+                raise IndexError('Row {} out of range for {} rows'.format(key, n_rows))
+
+            return r.read(pos, pos + 1)[0]
+
     def select(self, predicate=None, headers=None):
         """Iterate the results from the reader's select() method"""
 
@@ -191,6 +373,59 @@ class HDFPartition(object):
             for row in r.select(predicate, headers):
                 yield row
 
+    def query(self, where=None, columns=None):
+        """Iterate the results from the reader's query() method"""
+
+        with self.reader as r:
+            for row in r.query(where, columns):
+                yield row
+
+    def where(self, condition, columns=None):
+        """Iterate the results from the reader's where() method"""
+
+        with self.reader as r:
+            for row in r.where(condition, columns):
+                yield row
+
+    def iter_batches(self, size=None):
+        """Iterate the batches of rows from the reader's iter_batches() method"""
+
+        with self.reader as r:
+            for batch in r.iter_batches(size):
+                yield batch
+
+    def iter_numpy(self, batch_rows=None):
+        """Iterate the NumPy structured arrays from the reader's iter_numpy() method"""
+
+        with self.reader as r:
+            for batch in r.iter_numpy(batch_rows):
+                yield batch
+
+    def aiter_batches(self, size=None, prefetch=None, loop=None, executor=None):
+        """ Returns an asyncio asynchronous iterator over batches of rows, which are read in an executor.
+        Requires Python 3.5 or later.
+
+        Args:
+            size (int, optional): number of rows in each batch.
+            prefetch (int, optional): number of batches to read ahead of the consumer.
+            loop (asyncio event loop, optional):
+            executor (concurrent.futures.Executor, optional): must run the calls in order.
+
+        Returns:
+            ambry_sources.aio.AsyncBatchIterator:
+
+        """
+        from ambry_sources.aio import aiter_batches
+
+        return aiter_batches(lambda: self.iter_batches(size), prefetch=prefetch, loop=loop, executor=executor)
+
+    def aiter_rows(self, size=None, prefetch=None, loop=None, executor=None):
+        """ Returns an asyncio asynchronous iterator over the rows, which are read in batches in an executor,
+        like aiter_batches(). """
+        from ambry_sources.aio import aiter_rows
+
+        return aiter_rows(lambda: self.iter_batches(size), prefetch=prefetch, loop=loop, executor=executor)
+
     @property
     def writer(self):
         if not self._writer:
@@ -200,7 +435,7 @@ class HDFPartition(object):
                 self._fs.makedir(os.path.dirname(self.path), recursive=True)
 
             # we can't use self.syspath here because it may be empty if file does not existf
-            self._writer = HDFWriter(self, self._fs.getsyspath(self.path))
+            self._writer = HDFWriter(self, self._fs.getsyspath(self.path), filters=self.filters)
 
         return self._writer
 
@@ -220,7 +455,7 @@ class HDFPartition(object):
 
         rec = total = rate = 0
 
-        if self._process in ('load_rows', 'write') and self._writer:
+        if self._process in ('load_rows', 'append_rows', 'write') and self._writer:
             rec = self._writer.n_rows
             rate = round(float(rec) / float(time.time() - self._start_time), 2)
 
@@ -285,7 +520,20 @@ class HDFPartition(object):
 
 class HDFWriter(object):
 
-    def __init__(self, parent, filename):
+    # Children of the meta that are saved to tables of the same name in the h5 file.
+    META_CHILDREN = ('about', 'comments', 'excel', 'geo', 'row_spec', 'schema', 'source')
+
+    def __init__(self, parent, filename, filters=None, expectedrows=None):
+        """
+
+        Args:
+            parent (HDFPartition):
+            filename (str):
+            filters (tables.Filters, optional): compression filters for the rows table, if it is created.
+            expectedrows (int, optional): expected number of rows, which sets the chunk size of the rows
+                table, if it is created. If not given, load_rows() takes it from the source, when the source
+                has a length or an n_rows attribute.
+        """
 
         if not isinstance(filename, string_types):
             raise ValueError(
@@ -300,11 +548,23 @@ class HDFWriter(object):
 
         self.cache = []
 
+        self.filters = filters
+        self.expectedrows = expectedrows
+
+        # The meta children and the file header as they were last written to the file, to find the parts that
+        # have to be written again on close.
+        self._saved_meta = {}
+        self._saved_header = None
+
         if os.path.exists(filename):
             self._h5_file = open_file(filename, mode='a')
             self.meta = HDFReader._read_meta(self._h5_file)
             self.version, self.n_rows, self.n_cols = _get_file_header(
                 self._h5_file.root.partition.file_header)
+
+            self._saved_meta = {child: deepcopy(self.meta[child]) for child in self.META_CHILDREN
+                                if child in self._h5_file.root.partition.meta}
+            self._saved_header = self._file_header
         else:
             # No, doesn't exist
             self._h5_file = open_file(filename, mode='w')
@@ -395,6 +655,9 @@ class HDFWriter(object):
             columns (list of intuit.Column): schema (columns description) of the source.
 
         """
+        if self.expectedrows is None:
+            self.expectedrows = _source_length(source)
+
         spec = getattr(source, 'spec', None)
         for i, row in enumerate(iter(source)):
             if spec and i < (spec.start_line or 1):
@@ -417,16 +680,219 @@ class HDFWriter(object):
 
         self._write_rows()
 
+    def load_mpr(self, mpr, workers=None, queue_size=None):
+        """ Loads the rows of an MPR file, and copies its metadata and stats. The rows are converted in a
+        pipeline of stages joined by bounded queues: a reader thread decompresses the blocks of the file,
+        which has to be done in order, worker processes decode the blocks and convert them to structured
+        arrays, and a writer thread appends the arrays to the rows table.
+
+        Args:
+            mpr (MPRowsFile):
+            workers (int, optional): number of worker processes. If not given, or 1, the blocks are
+                converted in this process, while the other stages run in their threads.
+            queue_size (int, optional): most blocks in each queue, and converting in the workers at once.
+                Defaults to twice the number of workers, or 4.
+
+        """
+        import threading
+        from collections import deque
+        from multiprocessing import Pool
+        from six.moves.queue import Queue
+
+        workers = workers if workers and workers > 1 else None
+        queue_size = queue_size or (2 * workers if workers else 4)
+
+        with mpr.reader as r:
+            self._copy_mpr_meta(r.meta)
+
+            start_row, end_row = r.data_start_row, r.data_end_row
+            self.n_cols = max(self.n_cols, r.n_cols)
+
+            if self.expectedrows is None:
+                self.expectedrows = max(end_row - start_row + 1, 0)
+
+            rows_table = self._rows_table()
+            dtype, columns = rows_table.dtype, _column_specs(rows_table)
+
+            stop = threading.Event()
+            packed, arrays = Queue(queue_size), Queue(queue_size)
+            reader_errors, writer_errors = [], []
+
+            def read():
+                try:
+                    for data in r.iter_packed_blocks():
+                        if not _put(packed, data, stop):
+                            return
+                except Exception:
+                    reader_errors.append(sys.exc_info())
+                finally:
+                    _put(packed, _END, stop)
+
+            def write():
+                # Keeps taking the arrays after an error, so the conversion stage doesn't block.
+                for block, overflow in iter(arrays.get, _END):
+                    if not writer_errors:
+                        try:
+                            self._append_rows_array(rows_table, block, overflow)
+                            self.n_rows += len(block)
+                        except Exception:
+                            writer_errors.append(sys.exc_info())
+
+            def converted():
+                for data in iter(packed.get, _END):
+                    if pool is None:
+                        yield _convert_packed_block(data, dtype, columns)
+                        continue
+
+                    pending.append(pool.apply_async(_convert_packed_block, (data, dtype, columns)))
+
+                    if len(pending) >= queue_size:
+                        yield pending.popleft().get()
+
+                while pending:
+                    yield pending.popleft().get()
+
+            reader = threading.Thread(target=read, name='HDFLoadMPRReader')
+            writer = threading.Thread(target=write, name='HDFLoadMPRWriter')
+            reader.daemon = writer.daemon = True
+
+            pool = Pool(workers) if workers else None
+            pending = deque()
+
+            reader.start()
+            writer.start()
+
+            try:
+                start = 0  # Position of the first row of the block in the MPR file.
+
+                for block, overflow in converted():
+                    lo, hi = max(start_row - start, 0), min(end_row + 1 - start, len(block))
+                    start += len(block)
+
+                    if lo >= hi:
+                        if start > end_row:
+                            break
+                        continue
+
+                    if lo > 0 or hi < len(block):
+                        # Only the data rows of the block; the others are headers, comments or footers.
+                        block = block[lo:hi]
+                        overflow = [(col_pos, [(i - lo, v) for i, v in long_strings if lo <= i < hi])
+                                    for col_pos, long_strings in overflow]
+
+                    arrays.put((block, overflow))
+
+                    if writer_errors:
+                        break
+            finally:
+                arrays.put(_END)
+                writer.join()
+
+                stop.set()
+                reader.join()
+
+                if pool is not None:
+                    pool.terminate()
+                    pool.join()
+
+            for errors in (reader_errors, writer_errors):
+                if errors:
+                    six.reraise(*errors[0])
+
+    def _copy_mpr_meta(self, meta):
+        """ Copies the meta children of an MPR file, including the schema with the types and the stats. Only
+        the keys that the h5 file has tables columns for are copied. """
+
+        for child in self.META_CHILDREN:
+            if child == 'schema':
+                self.meta['schema'] = deepcopy(meta['schema'])
+            else:
+                for k in self.meta[child]:
+                    if k in meta.get(child, {}):
+                        self.meta[child][k] = deepcopy(meta[child][k])
+
+    def create_index(self, column, kind='full', optlevel=None):
+        """ Creates an index on a column of the rows table, replacing any index of a different kind. Indexes
+        are updated as more rows are written.
+
+        Args:
+            column (str): name of the column.
+            kind (str, optional): 'ultralight', 'light', 'medium' or 'full'. A full index with the default
+                optlevel is a completely sorted index (CSI).
+            optlevel (int, optional): optimization level, 0 to 9. Defaults to 9 for full indexes and 6
+                otherwise.
+
+        """
+        self._write_rows()
+
+        if 'partition' not in self._h5_file.root or 'rows' not in self._h5_file.root.partition:
+            raise HDFError("Can't index column '{}'; no rows have been written".format(column))
+
+        table = self._h5_file.root.partition.rows
+
+        if column not in table.colnames:
+            raise HDFError("Can't index column '{}'; not in columns {}".format(column, table.colnames))
+
+        if optlevel is None:
+            optlevel = 9 if kind == 'full' else 6
+
+        col = table.cols._f_col(column)
+
+        if col.is_indexed:
+            if col.index.kind == kind and col.index.optlevel == optlevel:
+                return
+            col.remove_index()
+
+        if kind == 'full' and optlevel == 9:
+            col.create_csindex()
+        else:
+            col.create_index(optlevel=optlevel, kind=kind)
+
     def close(self):
 
         if self._h5_file:
             self._write_rows()
+            self.flush_meta()
             self._h5_file.close()
             self._h5_file = None
 
             if self.parent:
                 self.parent._writer = None
 
+    @property
+    def _file_header(self):
+        return (self.version, self.n_rows, self.n_cols)
+
+    @property
+    def dirty(self):
+        """ Returns the names of the meta children, and 'file_header', that have changed since they were last
+        written to the file. """
+
+        dirty = [child for child in self.META_CHILDREN if self.meta[child] != self._saved_meta.get(child)]
+
+        if self._file_header != self._saved_header:
+            dirty.append('file_header')
+
+        return dirty
+
+    def flush_meta(self):
+        """ Writes the changed meta children and the file header to the h5 file. Called by close(), so it only
+        has to be called to make the meta readable while the writer is still open. """
+
+        dirty = self.dirty
+
+        if not dirty:
+            return
+
+        children = [child for child in dirty if child != 'file_header']
+
+        self._write_meta(children)
+
+        if 'file_header' in dirty:
+            self.write_file_header()
+
+        self._h5_file.flush()
+
     def write_file_header(self):
         """ Write the version, number of rows and number of cols to the h5 file. """
 
@@ -449,6 +915,8 @@ class HDFWriter(object):
         table.row.append()
         table.flush()
 
+        self._saved_header = self._file_header
+
     def set_types(self, ti):
         """ Set Types from a type intuiter object. """
 
@@ -464,10 +932,10 @@ class HDFWriter(object):
                 self.column(i + 1).type = results[i]['resolved_type']
 
     def set_stats(self, stats):
-        """ Copy stats into the schema.
+        """ Copy stats into the schema, and save the state of ColumnStats.
 
         Args:
-            stats (Stats):
+            stats (Stats or ColumnStats):
 
         """
 
@@ -478,6 +946,37 @@ class HDFWriter(object):
                 k = {'count': 'stat_count'}.get(k, k)
                 row[k] = v
 
+        if hasattr(stats, 'state'):
+            self.set_stats_state(stats.state)
+
+    def set_stats_state(self, state):
+        """ Saves the state of the stats, which run_stats() restores to update the stats with appended rows.
+
+        Args:
+            state (OrderedDict): column names to tuples of the dict of the state and the array of the quantile
+                sample, from ColumnStats.state.
+
+        """
+        self._validate_groups()
+
+        # always re-create the arrays on save, as the lengths of the rows change.
+        if 'stats' in self._h5_file.root.partition:
+            self._h5_file.remove_node('/partition', 'stats', recursive=True)
+
+        self._h5_file.create_group('/partition', 'stats', 'State of the stats of the columns.')
+        states = self._h5_file.create_vlarray(
+            '/partition/stats', 'states', VLStringAtom(), 'State of the stats of each column, as JSON.')
+        samples = self._h5_file.create_vlarray(
+            '/partition/stats', 'samples', Float64Atom(), 'Quantile sample of each column.',
+            filters=self.filters)
+
+        for name, (col_state, sample) in iteritems(state):
+            states.append(json.dumps(dict(col_state, name=name)).encode('utf-8'))
+            samples.append(sample)
+
+        states.flush()
+        samples.flush()
+
     def set_source_spec(self, spec):
         """Set the metadata coresponding to the SourceSpec, excluding the row spec parts. """
 
@@ -522,7 +1021,6 @@ class HDFWriter(object):
         self.data_end_row = row_spec['end_row']
         self.meta['row_spec'] = row_spec
         self.headers = [self.header_mangler(h) for h in headers]
-        self._write_meta()
 
     def __enter__(self):
         return self
@@ -540,36 +1038,52 @@ class HDFWriter(object):
         if 'meta' not in self._h5_file.root.partition:
             self._h5_file.create_group('/partition', 'meta', 'Meta information of the partition.')
 
-    def _write_rows(self, rows=None):
-        self._write_meta()
-        self.write_file_header()
-        rows, clear_cache = (self.cache, True) if not rows else (rows, False)
+    def _rows_table(self, n_rows=0):
+        """ Returns the rows table, creating it from the columns if it doesn't exist.
 
-        if not rows:
-            return
+        Args:
+            n_rows (int, optional): number of rows about to be written, for the chunk size of a new table.
 
-        # convert columns to descriptor
-        rows_descriptor = _get_rows_descriptor(self.columns)
+        Returns:
+            tables.Table:
+
+        """
+        self._validate_groups()
 
         if 'rows' not in self._h5_file.root.partition:
-            self._h5_file.create_table(
-                '/partition', 'rows', rows_descriptor, 'Rows (data) of the partition.')
+            # convert columns to descriptor
+            rows_descriptor = _get_rows_descriptor(self.columns)
+
+            # The chunk size is set from the expected number of rows, so it's worth setting for large tables.
+            expectedrows = max(self.expectedrows or 0, self.n_rows, n_rows, EXPECTED_ROWS_TABLE)
+
+            rows_table = self._h5_file.create_table(
+                '/partition', 'rows', rows_descriptor, 'Rows (data) of the partition.',
+                filters=self.filters, expectedrows=expectedrows)
+
+            rows_table.attrs.logical_types = json.dumps(
+                {c.name: c.type for c in self.columns if c.type in _DATETIME_UNITS})
 
         rows_table = self._h5_file.root.partition.rows
-        partition_row = rows_table.row
 
         # h5 colnames order has to match to columns order to provide proper iteration over rows.
         assert self.headers == rows_table.colnames
-        description = [
-            (col_name, getattr(rows_table.description, col_name)) for col_name in rows_table.colnames]
-        for row in rows:
-            for col_name, col_desc in description:
-                value = _serialize(col_desc.__class__, row[col_desc._v_pos])
-                if isinstance(value, text_type):
-                    value = value.encode('utf-8')
-                partition_row[col_name] = value
-            partition_row.append()
-        rows_table.flush()
+
+        return rows_table
+
+    def _write_rows(self, rows=None):
+        rows, clear_cache = (self.cache, True) if not rows else (rows, False)
+
+        if not rows:
+            return
+
+        rows_table = self._rows_table(len(rows))
+
+        t0 = time.time()
+
+        block, overflow = _rows_array(rows, rows_table.dtype, _column_specs(rows_table))
+
+        self._append_rows_array(rows_table, block, overflow, pack_time=time.time() - t0)
 
         # Hope that the max # of cols is found in the first 100 rows
         # FIXME! This won't work if rows is an interator.
@@ -578,17 +1092,71 @@ class HDFWriter(object):
         if clear_cache:
             self.cache = []
 
-    def _write_meta(self):
-        """ Writes meta to the h5 file. """
+    def _append_rows_array(self, rows_table, block, overflow, pack_time=0):
+        """ Appends a structured array of rows from _rows_array() to the rows table, and the strings too long
+        for their columns to the overflow store. """
+
+        t1 = time.time()
+
+        for col_pos, long_strings in overflow:
+            self._write_overflow(rows_table.nrows, col_pos, long_strings)
+
+        rows_table.append(block)
+        rows_table.flush()
+
+        metrics = getattr(self.parent, 'metrics', None)
+        phase = metrics.current if metrics else None
+
+        if phase is not None:
+            phase.pack_time += pack_time
+            phase.io_time += time.time() - t1
+            phase.rows += len(block)
+            metrics.emit('progress', phase)
+
+    def _write_overflow(self, start, col_pos, long_strings):
+        """ Writes strings that don't fit in their column to the overflow store, which is the overflow table of
+        row and column positions and the overflow_values array of utf-8 strings, in the same order.
+
+        Args:
+            start (int): row position of the first of the rows the strings are from.
+            col_pos (int): position of the column.
+            long_strings (list of tuples): (row index in the rows, utf-8 string) pairs.
+
+        """
+        if not long_strings:
+            return
+
+        partition = self._h5_file.root.partition
+
+        if 'overflow' not in partition:
+            self._h5_file.create_table(
+                '/partition', 'overflow', {'row': Int64Col(pos=0), 'col': Int32Col(pos=1)},
+                'Positions of the strings too long for their column.', filters=self.filters)
+            self._h5_file.create_vlarray(
+                '/partition', 'overflow_values', VLStringAtom(),
+                'Strings too long for their column.', filters=self.filters)
+
+        partition.overflow.append([(start + i, col_pos) for i, _ in long_strings])
+
+        for _, value in long_strings:
+            partition.overflow_values.append(value)
+
+        partition.overflow.flush()
+        partition.overflow_values.flush()
+
+    def _write_meta(self, children=None):
+        """ Writes meta to the h5 file.
+
+        Args:
+            children (list of str, optional): names of the meta children to write. Defaults to all of them.
+
+        """
         assert self.meta['schema'][0] == MPRowsFile.SCHEMA_TEMPLATE
         self._validate_groups()
-        self._save_about()
-        self._save_comments()
-        self._save_excel()
-        self._save_geo()
-        self._save_row_spec()
-        self._save_schema()
-        self._save_source()
+
+        for child in (self.META_CHILDREN if children is None else children):
+            getattr(self, '_save_{}'.format(child))()
+            self._saved_meta[child] = deepcopy(self.meta[child])
 
     def _save_meta_child(self, child, descriptor):
         """ Saves given child of the meta to the table with same name to the h5 file.
@@ -760,6 +1328,7 @@ class HDFReader(object):
 
         self._in_iteration = False
         self._meta = None
+        self._overflow = None
 
     @property
     def info(self):
@@ -776,6 +1345,26 @@ class HDFReader(object):
         """ Returns columns specifications in the ambry_source format. """
         return HDFPartition._columns(self)
 
+    @property
+    def filters(self):
+        """ Returns the compression filters of the rows table, or None if there is no rows table. """
+
+        if 'rows' not in self._h5_file.root.partition:
+            return None
+
+        return self._h5_file.root.partition.rows.filters
+
+    @property
+    def indexes(self):
+        """ Returns the names of the indexed columns. """
+
+        if 'rows' not in self._h5_file.root.partition:
+            return []
+
+        table = self._h5_file.root.partition.rows
+
+        return [name for name in table.colnames if table.cols._f_col(name).is_indexed]
+
     @property
     def headers(self):
         """ Returns header (column names).
@@ -786,32 +1375,140 @@ class HDFReader(object):
         """
         return [e.name for e in HDFPartition._columns(self)]
 
-    @property
-    def raw(self):
-        """ A raw iterator, which ignores the data start and stop rows and returns all rows, as rows. """
-        try:
-            if 'rows' not in self._h5_file.root.partition:
-                # table with rows was not created.
-                raise StopIteration
-            self._in_iteration = True
-            table = self._h5_file.root.partition.rows
-            for row in table.iterrows():
-                yield [row[c] for c in table.colnames]
-                self.pos += 1
-        finally:
-            self._in_iteration = False
-            self.close()
+    def _iter_blocks(self, size=None):
+        """ Generates the rows of the table in blocks, as lists of deserialized column values. Each block is
+        read with a single Table.read() call and converted a column at a time.
 
-    @property
-    def rows(self):
-        """ Iterator for reading rows. """
-        # For HDF it's exactly the same as raw iterator.
-        return self.raw
+        Args:
+            size (int, optional): number of rows in each block, except the last. Defaults to the
+                size of the pytables buffer for the table.
 
-    def __iter__(self):
-        """ Iterator for reading rows as RowProxy objects
+        Returns:
+            iterable of lists of lists: the columns of each block.
 
-        WARNING: This routine generates RowProxy objects. RowProxy objects
+        """
+        if 'rows' not in self._h5_file.root.partition:
+            # rows table was not created.
+            return
+
+        table = self._h5_file.root.partition.rows
+        size = size or table.nrowsinbuf
+        overflow = self.overflow
+        logical_types = _logical_types(table)
+
+        for start in range(0, table.nrows, size):
+            stop = min(start + size, table.nrows)
+            block = table.read(start, stop)
+            columns = [_deserialize_column(block[name], logical_types.get(name)) for name in table.colnames]
+
+            for name, values in zip(table.colnames, columns):
+                if name in overflow:
+                    _apply_overflow(values, np.arange(start, stop), overflow[name])
+
+            yield columns
+
+    @property
+    def logical_types(self):
+        """ Returns the dict of the names of the date, datetime and time columns to their types. """
+
+        if 'rows' not in self._h5_file.root.partition:
+            return {}
+
+        return _logical_types(self._h5_file.root.partition.rows)
+
+    def iter_column(self, name, size=None, start=0):
+        """ Generates the values of a column in chunks, as they are stored, like the fields of the arrays of
+        iter_numpy(). Only the column is read from the table.
+
+        Args:
+            name (str): name of the column.
+            size (int, optional): number of values in each chunk, except the last. Defaults to the size of
+                the pytables buffer for the table.
+            start (int, optional): position of the first row to read.
+
+        Returns:
+            iterable of tuples: the row position of the first value, and the numpy.ndarray of the values.
+
+        """
+        if 'rows' not in self._h5_file.root.partition:
+            # rows table was not created.
+            return
+
+        table = self._h5_file.root.partition.rows
+        size = size or table.nrowsinbuf
+
+        for start in range(start, table.nrows, size):
+            yield start, table.read(start, min(start + size, table.nrows), field=name)
+
+    @property
+    def stats_state(self):
+        """ Returns the state of the stats saved by HDFWriter.set_stats_state(), as an OrderedDict of the
+        column names to tuples of the dict of the state and the array of the quantile sample, or None if the
+        state was not saved. """
+
+        if 'stats' not in self._h5_file.root.partition:
+            return None
+
+        stats = self._h5_file.root.partition.stats
+        state = OrderedDict()
+
+        for col_state, sample in zip(stats.states.read(), stats.samples.read()):
+            col_state = json.loads(col_state.decode('utf-8'))
+            state[col_state.pop('name')] = (col_state, sample)
+
+        return state
+
+    @property
+    def overflow(self):
+        """ Returns the strings that are too long for their column, as a dict of column names to tuples of
+        the sorted array of row positions and the list of strings. """
+
+        if self._overflow is None:
+            self._overflow = {}
+
+            partition = self._h5_file.root.partition
+
+            if 'overflow' in partition:
+                positions = partition.overflow.read()
+                strings = [v.decode('utf-8') for v in partition.overflow_values.read()]
+                colnames = partition.rows.colnames
+
+                for col_pos in np.unique(positions['col']):
+                    selected = np.flatnonzero(positions['col'] == col_pos)
+                    rows = positions['row'][selected]
+                    order = np.argsort(rows, kind='mergesort')
+                    self._overflow[colnames[col_pos]] = (rows[order], [strings[selected[i]] for i in order])
+
+        return self._overflow
+
+    def _iter_rows(self):
+        """ Generates deserialized rows, as lists, from the blocks of _iter_blocks() """
+        for columns in self._iter_blocks():
+            for row in _columns_to_rows(columns):
+                yield row
+                self.pos += 1
+
+    @property
+    def raw(self):
+        """ A raw iterator, which ignores the data start and stop rows and returns all rows, as rows. """
+        try:
+            self._in_iteration = True
+            for row in self._iter_rows():
+                yield row
+        finally:
+            self._in_iteration = False
+            self.close()
+
+    @property
+    def rows(self):
+        """ Iterator for reading rows. """
+        # For HDF it's exactly the same as raw iterator.
+        return self.raw
+
+    def __iter__(self):
+        """ Iterator for reading rows as RowProxy objects
+
+        WARNING: This routine generates RowProxy objects. RowProxy objects
             are reused, so if you construct a list directly from the output from this method,
             the list will have multiple copies of a single RowProxy, which will
             have as an inner row the last result row. If you will be directly constructing
@@ -821,18 +1518,79 @@ class HDFReader(object):
         """
         rp = RowProxy(self.headers)
         try:
-            if 'rows' not in self._h5_file.root.partition:
-                # rows table was not created.
-                raise StopIteration
+            self._in_iteration = True
+            for row in self._iter_rows():
+                yield rp.set_row(row)
+        finally:
+            self._in_iteration = False
+
+    def iter_batches(self, size=None):
+        """ Iterator for reading rows in batches, as lists of row tuples.
+
+        The batches are read from the table with a single read() call each, rather than row by row.
+
+        Args:
+            size (int, optional): number of rows in each batch, except the last. Defaults to the
+                size of the pytables buffer for the table.
+
+        Returns:
+            iterable of lists of tuples:
+
+        """
+        try:
+            self._in_iteration = True
+            for columns in self._iter_blocks(size):
+                batch = list(zip(*columns))
+                self.pos += len(batch)
+                yield batch
+        finally:
+            self._in_iteration = False
+
+    def iter_numpy(self, batch_rows=None):
+        """ Iterator for reading rows in batches, as NumPy structured arrays with a field for each column.
+
+        The arrays hold the values as they are stored, so None values are MIN_INT32 or MIN_INT64 in int
+        columns, NaN in float columns and empty strings in string columns, and strings are utf-8 bytes. Strings
+        too long for their column are truncated; the whole strings are in the overflow property. Date,
+        datetime and time columns hold int64 values, which view as datetime64[D] for dates and
+        datetime64[us] for datetimes and times, on the day of the epoch.
+
+        Args:
+            batch_rows (int, optional): number of rows in each batch, except the last. Defaults to the
+                size of the pytables buffer for the table.
+
+        Returns:
+            iterable of numpy.ndarray:
+
+        """
+        if 'rows' not in self._h5_file.root.partition:
+            # rows table was not created.
+            return
+
+        try:
             self._in_iteration = True
             table = self._h5_file.root.partition.rows
-            for row in table.iterrows():
-                r = [_deserialize(row[c]) for c in table.colnames]
-                yield rp.set_row(r)
-                self.pos += 1
+            batch_rows = batch_rows or table.nrowsinbuf
+
+            for start in range(0, table.nrows, batch_rows):
+                batch = table.read(start, min(start + batch_rows, table.nrows))
+                self.pos += len(batch)
+                yield batch
         finally:
             self._in_iteration = False
 
+    def iter_records(self):
+        """ Iterator for reading rows as immutable records, with attribute, name and position access.
+
+        Unlike the RowProxy objects generated by __iter__, each record is a new object, so the records
+        can be collected into a list.
+
+        Returns:
+            iterable of RowRecord:
+
+        """
+        return six.moves.map(row_class(self.headers), self._deserialized_rows())
+
     def select(self, predicate=None, headers=None):
         """ Select rows from the reader using a predicate and itemgetter to return a subset of elements.
 
@@ -874,6 +1632,166 @@ class HDFReader(object):
         else:
             return iter(self)
 
+    def query(self, where=None, columns=None):
+        """ Selects rows with a where expression and returns a subset of columns, as tuples.
+
+        The expression and the projection are compiled once into a function over positional rows, so no
+        RowProxy or dict is built for each row.
+
+        Args:
+            where (str, optional): a Python expression that uses column names as variables, such as
+                "year >= 2010 and county == '06073'". Rows for which it is true are included in the output.
+            columns (list of str, optional): names of the columns to return from each row.
+
+        Returns:
+            iterable of tuples:
+
+        """
+        from ambry_sources.query import Query
+
+        return Query(self.headers, where=where, columns=columns).run(self._deserialized_rows())
+
+    def where(self, condition, columns=None):
+        """ Selects rows with a PyTables condition and returns a subset of columns, as tuples.
+
+        Unlike query(), the condition is evaluated by numexpr over blocks of the table, inside PyTables, so
+        only the matching rows are read and converted. Conditions on indexed columns use the indexes, rather
+        than scanning the table.
+
+        Args:
+            condition (str): a numexpr condition that uses column names as variables, such as
+                '(year >= 2010) & (county == b"06073")'. String columns hold utf-8 bytes, truncated to the
+                size of the column. Date columns hold days since the epoch, and datetime and time columns
+                hold microseconds since the epoch and since midnight. As in SQL, comparisons with None
+                values are neither true nor false, so they don't match either inside ~ or in the rows that
+                the other side of | matches. None is stored as an empty string in string columns, so empty
+                strings compare as None.
+            columns (list of str, optional): names of the columns to return from each row.
+
+        Returns:
+            iterable of tuples:
+
+        Raises:
+            QueryError: if the condition or the columns have a name that is not a column.
+
+        """
+        from ambry_sources.query import Query, QueryError
+
+        headers = self.headers
+
+        # Checks the columns.
+        columns = Query(headers, columns=columns).columns
+
+        names = _condition_names(condition)
+
+        for name in names:
+            if name not in headers:
+                raise QueryError("Column '{}' in condition not in headers {}".format(name, headers))
+
+        return self._where_rows(condition, names, columns)
+
+    def _where_rows(self, condition, names, columns):
+
+        if 'rows' not in self._h5_file.root.partition:
+            # rows table was not created.
+            return
+
+        table = self._h5_file.root.partition.rows
+
+        condition, condvars = _null_guarded_condition(table, condition, names)
+
+        try:
+            self._in_iteration = True
+
+            coords = table.get_where_list(condition, condvars)
+            overflow = self.overflow
+            logical_types = _logical_types(table)
+
+            for start in range(0, len(coords), table.nrowsinbuf):
+                block_coords = coords[start:start + table.nrowsinbuf]
+                block = table.read_coordinates(block_coords)
+                values = [_deserialize_column(block[name], logical_types.get(name)) for name in columns]
+
+                for name, column_values in zip(columns, values):
+                    if name in overflow:
+                        _apply_overflow(column_values, block_coords, overflow[name])
+
+                rows = list(zip(*values))
+                self.pos += len(rows)
+
+                for row in rows:
+                    yield row
+        finally:
+            self._in_iteration = False
+
+    def read(self, start=None, stop=None, step=None, columns=None):
+        """ Reads a slice of the rows, with a subset of columns, as tuples.
+
+        The start, stop and step are those of a Python slice, and are passed to Table.read(), one column at a
+        time when a subset of columns is requested, so only the requested rows and columns are read and
+        converted.
+
+        Args:
+            start (int, optional): position of the first row.
+            stop (int, optional): position after the last row.
+            step (int, optional): distance between the rows. Negative steps read the rows backwards.
+            columns (list of str, optional): names of the columns to return from each row.
+
+        Returns:
+            list of tuples:
+
+        Raises:
+            QueryError: if the columns have a name that is not a column.
+
+        """
+        from ambry_sources.query import Query
+
+        columns = Query(self.headers, columns=columns).columns
+
+        if 'rows' not in self._h5_file.root.partition:
+            # rows table was not created.
+            return []
+
+        table = self._h5_file.root.partition.rows
+        coords = six.moves.range(*slice(start, stop, step).indices(table.nrows))
+
+        if not coords:
+            return []
+
+        # Tables are read forwards, so negative steps read the same rows and reverse them.
+        first, last = min(coords[0], coords[-1]), max(coords[0], coords[-1])
+        step = abs(coords[1] - coords[0]) if len(coords) > 1 else 1
+
+        if columns == table.colnames:
+            block = table.read(first, last + 1, step)
+            arrays = [block[name] for name in columns]
+        else:
+            arrays = [table.read(first, last + 1, step, field=name) for name in columns]
+
+        overflow = self.overflow
+        logical_types = _logical_types(table)
+        values = [_deserialize_column(a, logical_types.get(name)) for name, a in zip(columns, arrays)]
+
+        for name, column_values in zip(columns, values):
+            if name in overflow:
+                _apply_overflow(column_values, np.arange(first, last + 1, step), overflow[name])
+
+        rows = list(zip(*values))
+
+        if coords[0] > coords[-1]:
+            rows.reverse()
+
+        return rows
+
+    def _deserialized_rows(self):
+        """ Generates rows with the None replacements converted back to None. """
+        try:
+            self._in_iteration = True
+            for row in self._iter_rows():
+                yield row
+        finally:
+            self._in_iteration = False
+
     def close(self):
         if self._h5_file:
             self.meta  # In case caller wants to read meta after close.
@@ -903,6 +1821,9 @@ class HDFReader(object):
                         col.append(_deserialize(col_descr.get(e)))
                     new_schema.append(col)
                 meta['schema'] = new_schema
+            elif not isinstance(group, dict):
+                # meta.warnings is a list, which is not saved to the h5 file; keep the default.
+                continue
             else:
                 # This is the common case when child of the meta constructs from exactly one row.
                 try:
@@ -951,12 +1872,15 @@ def _get_rows_descriptor(columns):
         dict: valid pytables descriptor.
     """
     TYPE_MAP = {
-        'int': lambda pos: Int32Col(pos=pos),
-        'long': lambda pos: Int64Col(pos=pos),
-        'str': lambda pos: StringCol(itemsize=255, pos=pos),
-        'bytes': lambda pos: StringCol(itemsize=255, pos=pos),
-        'float': lambda pos: Float64Col(pos=pos),
-        'unknown': lambda pos: StringCol(itemsize=255, pos=pos),
+        'int': lambda pos, column: Int32Col(pos=pos),
+        'long': lambda pos, column: Int64Col(pos=pos),
+        'str': lambda pos, column: StringCol(itemsize=_string_itemsize(column), pos=pos),
+        'bytes': lambda pos, column: StringCol(itemsize=_string_itemsize(column), pos=pos),
+        'float': lambda pos, column: Float64Col(pos=pos),
+        'unknown': lambda pos, column: StringCol(itemsize=_string_itemsize(column), pos=pos),
+        'date': lambda pos, column: Int64Col(pos=pos),
+        'datetime': lambda pos, column: Int64Col(pos=pos),
+        'time': lambda pos, column: Int64Col(pos=pos),
     }
     descriptor = {}
 
@@ -965,10 +1889,44 @@ def _get_rows_descriptor(columns):
         if not pytables_type:
             raise Exception(
                 'Failed to convert `{}` ambry_sources type to pytables type.'.format(column['type']))
-        descriptor[column['name']] = pytables_type(column['pos'])
+        descriptor[column['name']] = pytables_type(column['pos'], column)
     return descriptor
 
 
+def _string_itemsize(column):
+    """ Returns the size of a string column, from the length found by the TypeIntuiter or the width from the
+    Stats or the source spec, whichever is larger. Columns with no known size get DEFAULT_STRING_SIZE, and
+    sizes are limited to MAX_STRING_SIZE; longer values are written to the overflow store.
+    """
+    sizes = [size for size in (column['length'], column['width']) if size is not None]
+
+    if not sizes:
+        return DEFAULT_STRING_SIZE
+
+    return min(max(max(sizes), 1), MAX_STRING_SIZE)
+
+
+# The NumPy types that date, datetime and time values are converted with. They are stored in int64 columns, as
+# the number of days or microseconds since the epoch, or microseconds since midnight for times, with
+# MIN_INT64, which is NumPy's NaT, for None. The logical_types attribute of the rows table has the types.
+_DATETIME_UNITS = {
+    'date': 'datetime64[D]',
+    'datetime': 'datetime64[us]',
+    'time': 'datetime64[us]',
+}
+
+_EPOCH = datetime.date(1970, 1, 1)
+
+
+# The values stored for None, by column type.
+_NULLS = {
+    Int64Col: MIN_INT64,
+    Int32Col: MIN_INT32,
+    Float64Col: float('nan'),
+    StringCol: '',
+}
+
+
 def _serialize(col_type, value):
     """ Converts value to format ready to save to h5 file. """
     if col_type == Float64Col:
@@ -985,12 +1943,6 @@ def _serialize(col_type, value):
             # it is not a valid int.
             value = None
 
-    TYPE_MAP = {
-        Int64Col: MIN_INT64,
-        Int32Col: MIN_INT32,
-        Float64Col: float('nan'),
-        StringCol: '',
-    }
     force = False
 
     if value is None:
@@ -999,12 +1951,208 @@ def _serialize(col_type, value):
     elif isinstance(value, string_types) and value == 'NA':
         force = True
 
-    if force and col_type in TYPE_MAP:
-        return TYPE_MAP[col_type]
+    if force and col_type in _NULLS:
+        return _NULLS[col_type]
+
+    return value
+
+
+def _column_array(col_type, dtype, values, logical_type=None):
+    """ Converts the values of a column to an array of the column dtype, with the same None replacements as
+    _serialize(). Invalid values are only checked one at a time if the whole column fails to convert. The
+    values of date, datetime and time columns, which have a logical_type, are converted by _datetime_array(). """
+
+    if logical_type in _DATETIME_UNITS:
+        return _datetime_array(logical_type, values)
+
+    a = np.array(values, dtype=object)
+
+    null = _NULLS.get(col_type)
+
+    if null is not None:
+        a[_null_mask(a, 'NA')] = null
+
+    try:
+        return a.astype(dtype)
+    except (TypeError, ValueError, UnicodeEncodeError):
+        pass
+
+    values = [_serialize(col_type, v) for v in values]
+
+    if col_type == StringCol:
+        values = [v.encode('utf-8') if isinstance(v, text_type) else v for v in values]
+
+    return np.array(values, dtype=object).astype(dtype)
+
+
+def _null_mask(a, *nulls):
+    """ Returns the boolean mask of the values of an object array that are None or equal to one of nulls. The
+    values are compared one at a time, since older NumPy versions don't compare object arrays with None
+    elementwise. """
+
+    return np.frompyfunc(lambda v: v is None or v in nulls, 1, 1)(a).astype(bool)
+
+
+def _column_specs(table):
+    """ Returns the (name, column class, position, itemsize, logical type) tuples of the columns of the rows
+    table, which _rows_array() converts the rows with. """
+
+    logical_types = _logical_types(table)
+    specs = []
+
+    for name in table.colnames:
+        col_desc = getattr(table.description, name)
+        specs.append((name, col_desc.__class__, col_desc._v_pos, col_desc.itemsize, logical_types.get(name)))
+
+    return specs
+
+
+def _rows_array(rows, dtype, columns):
+    """ Converts rows to a structured array of the rows table dtype, a column at a time.
+
+    Args:
+        rows (list of lists or tuples):
+        dtype (numpy.dtype): dtype of the rows table.
+        columns (list of tuples): column specs from _column_specs().
+
+    Returns:
+        tuple: the array, and a list of (column position, long strings) pairs, with the long strings from
+            _long_strings(), for the columns that have strings too long for them.
+
+    """
+    block = np.empty(len(rows), dtype=dtype)
+    overflow = []
+
+    for name, col_type, pos, itemsize, logical_type in columns:
+        values = list(six.moves.map(itemgetter(pos), rows))
+        block[name] = _column_array(col_type, dtype[name], values, logical_type)
+
+        if col_type == StringCol:
+            long_strings = _long_strings(values, itemsize)
+
+            # The column holds the longest prefix of whole characters of the strings that are too long for it.
+            for i, value in long_strings:
+                block[name][i] = value[:itemsize].decode('utf-8', 'ignore').encode('utf-8')
+
+            if long_strings:
+                overflow.append((pos, long_strings))
+
+    return block, overflow
+
+
+def _convert_packed_block(data, dtype, columns):
+    """ Decodes a block of rows packed in an MPR file and converts it with _rows_array(). Runs in the worker
+    processes of HDFWriter.load_mpr(). """
+
+    return _rows_array(MPRowsFile.unpack_block(data), dtype, columns)
+
+
+def _long_strings(values, itemsize):
+    """ Returns the (index, utf-8 string) pairs of the string values that are longer than itemsize bytes. """
+
+    # A character is at most 4 bytes in utf-8, so only the strings of more than itemsize / 4 characters
+    # have to be encoded to check them.
+    min_len = itemsize // 4
+
+    ret = []
+
+    for i, v in enumerate(values):
+        if isinstance(v, (text_type, binary_type)) and len(v) > min_len:
+            if isinstance(v, text_type):
+                v = v.encode('utf-8')
+            if len(v) > itemsize:
+                ret.append((i, v))
+
+    return ret
+
+
+def _apply_overflow(values, coords, overflow):
+    """ Replaces the truncated strings of a column with their whole values from the overflow store.
+
+    Args:
+        values (list): deserialized values of the column, changed in place.
+        coords (numpy.ndarray): row positions of the values.
+        overflow (tuple): sorted numpy.ndarray of row positions, and the list of their strings.
+
+    """
+    rows, strings = overflow
+
+    if not len(coords):
+        return
+
+    lo, hi = np.searchsorted(rows, [coords.min(), coords.max() + 1])
+
+    if lo == hi:
+        return
+
+    rows, strings = rows[lo:hi], strings[lo:hi]
+
+    # The rows are sorted, so the position of each coordinate in them finds the coordinates that overflowed.
+    idx = np.searchsorted(rows, coords)
+    hit = (idx < len(rows)) & (rows[np.minimum(idx, len(rows) - 1)] == coords)
+
+    for i in np.flatnonzero(hit):
+        values[i] = strings[idx[i]]
+
+
+def _datetime_array(logical_type, values):
+    """ Converts the date, datetime or time values of a column to an int64 array. ISO 8601 strings are converted
+    by NumPy with the other values; other strings are only parsed one at a time if the whole column fails to
+    convert, and the ones that don't parse are stored as None. """
+
+    a = np.array(values, dtype=object)
+    a[_null_mask(a, 'NA', '')] = None
+
+    if logical_type == 'time':
+        # NumPy has no time type, so times are converted as datetimes on the day of the epoch.
+        a = np.array([_time_to_datetime(v) for v in a], dtype=object)
+
+    try:
+        return a.astype(_DATETIME_UNITS[logical_type]).astype(np.int64)
+    except (TypeError, ValueError):
+        pass
+
+    return np.array([_parse_datetime(logical_type, v) for v in a], dtype=object)\
+        .astype(_DATETIME_UNITS[logical_type]).astype(np.int64)
+
+
+def _time_to_datetime(value):
+    """ Returns the datetime of a time, or the ISO 8601 string of a time string, on the day of the epoch. """
+
+    if isinstance(value, datetime.time):
+        return datetime.datetime.combine(_EPOCH, value)
+    elif isinstance(value, datetime.datetime):
+        return datetime.datetime.combine(_EPOCH, value.time())
+    elif isinstance(value, string_types):
+        return '1970-01-01T' + value
 
     return value
 
 
+def _parse_datetime(logical_type, value):
+    """ Converts a value of a date, datetime or time column to a date or a datetime, or None if it is not
+    valid. """
+    from dateutil import parser
+
+    if isinstance(value, string_types):
+        if logical_type == 'time' and value.startswith('1970-01-01T'):
+            value = value[len('1970-01-01T'):]
+
+        try:
+            value = parser.parse(value, default=datetime.datetime.combine(_EPOCH, datetime.time()))
+        except (TypeError, ValueError, OverflowError):
+            return None
+
+    if logical_type == 'time' and isinstance(value, datetime.datetime):
+        return datetime.datetime.combine(_EPOCH, value.time())
+    elif logical_type == 'date' and isinstance(value, datetime.datetime):
+        return value.date()
+    elif isinstance(value, (datetime.date, datetime.datetime)):
+        return value
+
+    return None
+
+
 def _deserialize(value):
     """ Converts None replacements stored in the pytables to None. """
     if isinstance(value, six.integer_types) and value in (MIN_INT32, MIN_INT64):
@@ -1016,6 +2164,212 @@ def _deserialize(value):
     return value
 
 
+def _deserialize_column(values, logical_type=None):
+    """ Converts an array of the values of a column to a list, with the same conversions as _deserialize(),
+    done for the whole column at once. The int64 values of date, datetime and time columns, which have a
+    logical_type, are converted back to date, datetime and time objects. """
+
+    if logical_type in _DATETIME_UNITS:
+        # NaT, which is MIN_INT64, converts to None.
+        values = values.astype(_DATETIME_UNITS[logical_type]).astype(object)
+
+        if logical_type == 'time':
+            return [None if v is None else v.time() for v in values]
+
+        return values.tolist()
+
+    kind = values.dtype.kind
+
+    if kind == 'i':
+        nulls = values == MIN_INT32
+        if values.dtype.itemsize > 4:
+            nulls |= values == MIN_INT64
+
+    elif kind == 'f':
+        nulls = np.isnan(values)
+
+    elif kind == 'S':
+        return np.char.decode(values, 'utf-8').tolist()
+
+    else:
+        return values.tolist()
+
+    if not nulls.any():
+        return values.tolist()
+
+    values = values.astype(object)
+    values[nulls] = None
+    return values.tolist()
+
+
+def _columns_to_rows(columns):
+    """ Converts a list of column lists to a list of row lists. """
+
+    if not columns:
+        return []
+
+    a = np.empty((len(columns[0]), len(columns)), dtype=object)
+
+    for i, column in enumerate(columns):
+        a[:, i] = column
+
+    return a.tolist()
+
+
+def _null_guarded_condition(table, condition, names):
+    """ Rewrites a condition so that comparisons with the None replacements of the named columns are neither
+    true nor false, as comparisons with NULL are in SQL. Each comparison is and-ed with the guards of its own
+    columns, and ~ swaps the conditions for a comparison being true and being false, so the guards hold inside
+    | and ~ too. Conditions that are and-ed comparisons stay indexable.
+
+    Args:
+        table (tables.Table): the rows table.
+        condition (str): a numexpr condition.
+        names (set of str): names of the columns in the condition.
+
+    Returns:
+        tuple: the condition, and the dict of condition variables for the None replacements.
+
+    Raises:
+        QueryError: if the condition can't be parsed.
+
+    """
+    import ast
+    from ambry_sources.query import QueryError
+
+    try:
+        tree = ast.parse(condition.strip(), mode='eval').body
+    except SyntaxError as e:
+        raise QueryError("Can't parse condition '{}': {}".format(condition, e))
+
+    guards = {}
+    condvars = {}
+
+    for name in sorted(names):
+        dtype = table.coldtypes[name]
+
+        if dtype.kind == 'i':
+            null_name = '_null_{}'.format(len(condvars))
+            condvars[null_name] = dtype.type(MIN_INT32 if dtype.itemsize == 4 else MIN_INT64)
+            guards[name] = '({} != {})'.format(name, null_name)
+        elif dtype.kind == 'f':
+            guards[name] = '({0} == {0})'.format(name)  # False for NaN
+        elif dtype.kind == 'S':
+            guards[name] = '({} != b"")'.format(name)  # None is stored as an empty string.
+
+    def guarded(node, true):
+        """ Returns the condition for the node being true, or being false, with none of its columns None. """
+
+        if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.BitAnd, ast.BitOr)):
+            # a & b is false if either is false, and a | b is false if both are.
+            op = '&' if isinstance(node.op, ast.BitAnd) == true else '|'
+            return '({} {} {})'.format(guarded(node.left, true), op, guarded(node.right, true))
+        elif isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Invert):
+            return guarded(node.operand, not true)
+
+        source = _unparse_condition(node)
+        node_names = sorted({n.id for n in ast.walk(node) if isinstance(n, ast.Name) and n.id in guards})
+        terms = [source if true else '~{}'.format(source)] + [guards[name] for name in node_names]
+
+        return terms[0] if len(terms) == 1 else '({})'.format(' & '.join(terms))
+
+    return guarded(tree, True), condvars
+
+
+def _unparse_condition(node):
+    """ Returns the numexpr source of a node of a parsed condition, with each operation in parentheses. """
+    import ast
+    from ambry_sources.query import QueryError
+
+    if isinstance(node, ast.Name):
+        return node.id
+    elif isinstance(node, ast.Compare):
+        parts = [_unparse_condition(node.left)]
+
+        for op, comparator in zip(node.ops, node.comparators):
+            parts += [_condition_op(op), _unparse_condition(comparator)]
+
+        return '({})'.format(' '.join(parts))
+    elif isinstance(node, ast.BinOp):
+        return '({} {} {})'.format(
+            _unparse_condition(node.left), _condition_op(node.op), _unparse_condition(node.right))
+    elif isinstance(node, ast.UnaryOp):
+        return '({}{})'.format(_condition_op(node.op), _unparse_condition(node.operand))
+    elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+        return '{}({})'.format(node.func.id, ', '.join(_unparse_condition(arg) for arg in node.args))
+    elif type(node).__name__ in ('Constant', 'Num', 'Str', 'Bytes', 'NameConstant'):
+        value = node.value if hasattr(node, 'value') else node.n if type(node).__name__ == 'Num' else node.s
+        # repr() of a Python 2 long has a trailing L.
+        return str(value) if isinstance(value, six.integer_types) and not isinstance(value, bool) else repr(value)
+
+    raise QueryError("Unsupported expression '{}' in condition".format(type(node).__name__))
+
+
+def _condition_op(op):
+    """ Returns the numexpr operator of an ast operator node of a condition. """
+    from ambry_sources.query import QueryError
+
+    try:
+        return _CONDITION_OPS[type(op).__name__]
+    except KeyError:
+        raise QueryError("Unsupported operator '{}' in condition".format(type(op).__name__))
+
+
+def _condition_names(condition):
+    """ Returns the set of variable names in a numexpr condition, excluding the names of functions. """
+    import tokenize
+
+    tokens = [tok[:2] for tok in tokenize.generate_tokens(six.StringIO(condition).readline)]
+
+    return {tok_string for (tok_type, tok_string), next_tok in zip(tokens, tokens[1:] + [(None, None)])
+            if tok_type == tokenize.NAME and next_tok[1] != '(' and tok_string not in ('True', 'False')}
+
+
+def _logical_types(table):
+    """ Returns the dict of the names of the date, datetime and time columns of the rows table to their types. """
+
+    if 'logical_types' not in table.attrs._v_attrnames:
+        return {}
+
+    return json.loads(table.attrs.logical_types)
+
+
+def _source_length(source):
+    """ Returns the number of rows of a source, if it has a length or an n_rows attribute, or None. """
+
+    try:
+        return len(source)
+    except TypeError:
+        pass
+
+    n_rows = getattr(source, 'n_rows', None)
+
+    return n_rows if isinstance(n_rows, six.integer_types) else None
+
+
+# Marks the end of the items in the queues of HDFWriter.load_mpr().
+_END = object()
+
+
+def _put(queue, item, stop):
+    """ Puts an item in a bounded queue, unless the stop event is set while waiting for room.
+
+    Returns:
+        boolean: True if the item was put.
+
+    """
+    from six.moves.queue import Full
+
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=0.1)
+            return True
+        except Full:
+            pass
+
+    return False
+
+
 def _get_file_header(table):
     """ Returns tuple with file headers - (version, rows_number, cols_number). """
     for row in table.iterrows():
@@ -0,0 +1,472 @@
+# -*- coding: utf-8 -*-
+"""
+Computing the stats of the columns of an HDF partition with NumPy, a column at a time.
+"""
+
+from collections import Counter, OrderedDict
+from math import sqrt
+
+import numpy as np
+
+from six import iteritems, u
+
+from ambry_sources.stats import StatSet
+
+from .core import MIN_INT32, MIN_INT64, _deserialize_column
+
+
+class ColumnStatSet(StatSet):
+    """ A StatSet that is updated with arrays of the values of a column, rather than one value at a time. It
+    has the same dict as StatSet, from the same rules: the unique values and the histogram bins of numbers are
+    found from the first bin_primer_count rows, and numbers with less than 1% unique values in them are
+    ordinal. The moments are exact, and the quantiles are exact for a sample of about QUANTILE_SAMPLE
+    values, taken at even intervals.
+
+    The state property and restore() save and restore what the stats are computed from, so the stats can be
+    updated with appended rows without reading the rows before them again. """
+
+    QUANTILE_SAMPLE = 100000
+
+    def __init__(self, parent, name, typ, n_rows=None):
+        super(ColumnStatSet, self).__init__(parent, name, typ, n_rows)
+
+        self.n_values = 0  # Values that are not None, which the moments are of.
+        self._mean = 0.0
+        self._m2 = self._m3 = self._m4 = 0.0
+        self._min = self._max = None
+
+        self._primer = []  # Numbers of the first bin_primer_count rows, until the hist bins are built.
+        self._pending_primer = None  # The primer, if finish() built the bins from fewer rows.
+        self._sample = []
+        self._sample_size = 0
+        self._sample_step = max(1, (n_rows or 0) // self.QUANTILE_SAMPLE)
+        self._quantiles = [None] * 3
+
+    def add_numbers(self, values, nulls):
+        """ Adds an array of the values of a numeric column.
+
+        Args:
+            values (numpy.ndarray): int or float values.
+            nulls (numpy.ndarray): boolean mask of the values that are None.
+
+        """
+        start = self.n
+        self.n += len(values)
+
+        if not self.is_numeric:
+            # Became ordinal, so count all of the values.
+            self._count(values, nulls)
+            return
+
+        if start < self.bin_primer_count:
+            n_head = self.bin_primer_count - start
+            head_values, head_nulls = values[:n_head], nulls[:n_head]
+
+            self._count(head_values, head_nulls)
+            self._primer.append(head_values[~head_nulls].astype(np.float64))
+
+            if self.n >= self.bin_primer_count:
+                self._build_hist_bins()
+
+                if not self.is_numeric:
+                    self._count(values[n_head:], nulls[n_head:])
+                    return
+
+                if self.bin_width:
+                    self._fill_bins(values[n_head:][~nulls[n_head:]].astype(np.float64))
+
+        elif self.bin_width:
+            self._fill_bins(values[~nulls].astype(np.float64))
+
+        x = values[~nulls]
+
+        if len(x):
+            if x.dtype.kind == 'i':
+                # The longest int is the smallest or the largest one.
+                width = max(len(str(x.min())), len(str(x.max())))
+            else:
+                width = int(np.char.str_len(x.astype('U')).max())
+
+            self.size = max(self.size or 0, width)
+            self._add_moments(x.astype(np.float64))
+
+        self._add_sample(values, nulls, start)
+
+    def add_uniques(self, uniques, counts):
+        """ Adds the counts of the unique values of a column that is not numeric.
+
+        Args:
+            uniques (list): the values, as text, or None.
+            counts (list of int): the number of times each value appears.
+
+        """
+        for v, count in zip(uniques, counts):
+            if not count:
+                continue
+
+            self.n += count
+
+            if v is None:
+                v = u('') if self.is_time or self.is_date else 'NULL'
+            else:
+                self.size = max(self.size or 0, len(v.encode('utf-8')))
+
+                if len(v) > 100 and not (self.is_time or self.is_date):
+                    v = v[:100]
+
+            self.counts[v] += count
+
+    def _count(self, values, nulls):
+        """ Counts the unique values of an array of numbers, as StatSet does for the first rows. """
+
+        n_nulls = int(nulls.sum())
+
+        if n_nulls:
+            self.counts['NULL'] += n_nulls
+
+        uniques, counts = np.unique(values[~nulls], return_counts=True)
+
+        for v, count in zip(uniques.tolist(), counts.tolist()):
+            v = u('{}').format(v)
+            self.size = max(self.size or 0, len(v))
+            self.counts[v] += count
+
+    def _add_moments(self, x):
+        """ Merges the count, mean, min, max and central moments of an array of numbers into the running
+        ones. """
+
+        n_a, n_b = self.n_values, len(x)
+        n = n_a + n_b
+
+        mean_b = float(x.mean())
+        d = x - mean_b
+        m2_b, m3_b, m4_b = float((d ** 2).sum()), float((d ** 3).sum()), float((d ** 4).sum())
+
+        delta = mean_b - self._mean
+        m2_a, m3_a, m4_a = self._m2, self._m3, self._m4
+
+        self._m4 = (m4_a + m4_b + delta ** 4 * n_a * n_b * (n_a ** 2 - n_a * n_b + n_b ** 2) / float(n) ** 3 +
+                    6 * delta ** 2 * (n_a ** 2 * m2_b + n_b ** 2 * m2_a) / float(n) ** 2 +
+                    4 * delta * (n_a * m3_b - n_b * m3_a) / float(n))
+        self._m3 = (m3_a + m3_b + delta ** 3 * n_a * n_b * (n_a - n_b) / float(n) ** 2 +
+                    3 * delta * (n_a * m2_b - n_b * m2_a) / float(n))
+        self._m2 = m2_a + m2_b + delta ** 2 * n_a * n_b / float(n)
+        self._mean += delta * n_b / float(n)
+
+        self._min = float(x.min()) if self._min is None else min(self._min, float(x.min()))
+        self._max = float(x.max()) if self._max is None else max(self._max, float(x.max()))
+        self.n_values = n
+
+    def _add_sample(self, values, nulls, start):
+        """ Adds the numbers at every sample step of the rows to the quantile sample. """
+
+        offset = (-start) % self._sample_step
+        sample = values[offset::self._sample_step][~nulls[offset::self._sample_step]]
+        self._sample.append(sample.astype(np.float64))
+        self._sample_size += len(sample)
+
+        if self._sample_size > 2 * self.QUANTILE_SAMPLE:
+            # More rows were appended than the step was set for, so keep every other number until it fits.
+            sample = np.concatenate(self._sample)
+
+            while len(sample) > 2 * self.QUANTILE_SAMPLE:
+                sample = sample[::2]
+                self._sample_step *= 2
+
+            self._sample, self._sample_size = [sample], len(sample)
+
+    def _build_hist_bins(self):
+        """ Builds the hist bins from the numbers of the first rows, and fills them with those numbers. """
+
+        if self._hist_built or not self.is_numeric:
+            return
+
+        self._hist_built = True
+
+        primer = np.concatenate(self._primer) if self._primer else np.empty(0)
+        self._primer = []
+
+        # If less than 1% are unique, assume that this number is actually an ordinal
+        if self.nuniques < (min(self.n, self.bin_primer_count) / 100.0):
+            self.lom = self.LOM.ORDINAL
+            return
+
+        if len(primer) < 2:
+            return
+
+        mean, std = primer.mean(), primer.std(ddof=1)
+
+        self.bin_min, self.bin_max = mean - std * 2, mean + std * 2
+        self.bin_width = (self.bin_max - self.bin_min) / self.num_bins
+
+        if self.bin_width == 0:
+            # I guess we just aren't getting a histogram.
+            return
+
+        # Strip off the leftmost bins that have no value, as StatSet does.
+        self._fill_bins(primer)
+        first_non_zero = next((i for i, v in enumerate(self.bins) if v != 0), None)
+
+        if first_non_zero:
+            self.bin_min = self.bin_min + self.bin_width * first_non_zero
+            self.bin_width = (self.bin_max - self.bin_min) / self.num_bins
+
+        self.bins = [0] * self.num_bins
+        self._fill_bins(primer)
+
+    def _fill_bins(self, x):
+        """ Adds the numbers that are in the range of the bins to the hist bins. """
+
+        x = x[(x >= self.bin_min) & (x <= self.bin_max)]
+        bins = ((x - self.bin_min) / self.bin_width).astype(np.int64)
+        counts = np.bincount(bins[bins < self.num_bins], minlength=self.num_bins)
+
+        self.bins = [a + int(b) for a, b in zip(self.bins, counts)]
+
+    def finish(self):
+        """ Builds the hist bins, if there were fewer rows than bin_primer_count, and the quantiles. """
+
+        self._pending_primer = None
+
+        if self.is_numeric and not self._hist_built:
+            # Kept for the state, so that the bins of appended rows are built from bin_primer_count rows.
+            self._pending_primer = np.concatenate(self._primer) if self._primer else np.empty(0)
+
+        self._build_hist_bins()
+
+        sample = np.concatenate(self._sample) if self._sample else np.empty(0)
+        self._sample = [sample]
+
+        self._quantiles = np.percentile(sample, [25, 50, 75]).tolist() if len(sample) else [None] * 3
+
+    @property
+    def state(self):
+        """ Returns the state of the stat set, after finish(), for restore().
+
+        Returns:
+            tuple: a dict of JSON values, and the numpy.ndarray of the quantile sample.
+
+        """
+        state = dict(
+            n=self.n, n_values=self.n_values, mean=self._mean, m2=self._m2, m3=self._m3, m4=self._m4,
+            min=self._min, max=self._max, size=self.size, counts=dict(self.counts), sample_step=self._sample_step)
+
+        if self._pending_primer is not None:
+            # The bins and the level of measurement are built again when there are enough rows.
+            state['primer'] = self._pending_primer.tolist()
+        else:
+            state.update(
+                lom=self.lom, hist_built=self._hist_built, bin_min=self.bin_min, bin_max=self.bin_max,
+                bin_width=self.bin_width, bins=self.bins)
+
+        sample = np.concatenate(self._sample) if self._sample else np.empty(0)
+
+        return state, sample
+
+    def restore(self, state, sample):
+        """ Restores the state from the state property, so that more values can be added.
+
+        Args:
+            state (dict):
+            sample (numpy.ndarray):
+
+        """
+        self.n, self.n_values = state['n'], state['n_values']
+        self._mean, self._m2, self._m3, self._m4 = state['mean'], state['m2'], state['m3'], state['m4']
+        self._min, self._max = state['min'], state['max']
+        self.size = state['size']
+        self.counts = Counter(state['counts'])
+        self._sample_step = state['sample_step']
+        self._sample, self._sample_size = [sample], len(sample)
+
+        if 'primer' in state:
+            self._primer = [np.array(state['primer'], dtype=np.float64)]
+        else:
+            self.lom, self._hist_built = state['lom'], state['hist_built']
+            self.bin_min, self.bin_max, self.bin_width = state['bin_min'], state['bin_max'], state['bin_width']
+            self.bins = list(state['bins'])
+
+    @property
+    def _numeric(self):
+        return self.is_numeric and self.n_values > 0
+
+    @property
+    def mean(self):
+        return self._mean if self._numeric else None
+
+    @property
+    def stddev(self):
+        return sqrt(self._variance) if self._numeric else None
+
+    @property
+    def _variance(self):
+        return self._m2 / (self.n_values - 1) if self.n_values > 1 else float('nan')
+
+    @property
+    def min(self):
+        return self._min if self._numeric else None
+
+    @property
+    def max(self):
+        return self._max if self._numeric else None
+
+    @property
+    def p25(self):
+        return self._quantiles[0] if self.is_numeric else None
+
+    @property
+    def p50(self):
+        return self._quantiles[1] if self.is_numeric else None
+
+    @property
+    def median(self):
+        return self.p50
+
+    @property
+    def p75(self):
+        return self._quantiles[2] if self.is_numeric else None
+
+    @property
+    def skewness(self):
+        if not self._numeric:
+            return None
+        elif self.n_values < 2:
+            return float('nan')
+
+        return self._m3 / (self.n_values * self._variance ** 1.5)
+
+    @property
+    def kurtosis(self):
+        if not self._numeric:
+            return None
+        elif self.n_values < 2:
+            return float('nan')
+
+        return self._m4 / (self.n_values * self._variance ** 2.0) - 3.0
+
+
+class ColumnStats(object):
+    """ Computes the stats of the columns of an HDF partition from the stored arrays, a column at a time.
+    Like Stats, the dict property maps the column names to the stat sets, so HDFWriter.set_stats() takes
+    either. """
+
+    CHUNK_ROWS = 100000
+
+    def __init__(self, schema, n_rows=None):
+        """
+
+        Args:
+            schema (tuple of col_name, col_type):
+            n_rows (int, optional): number of rows, which sets the sampling of the quantiles.
+
+        """
+        self._stats = OrderedDict(
+            (col_name, ColumnStatSet(self, col_name, col_type, n_rows)) for col_name, col_type in schema)
+
+    @property
+    def dict(self):
+        return self._stats
+
+    def __getitem__(self, item):
+        return self._stats[item]
+
+    def __contains__(self, item):
+        return item in self._stats
+
+    @property
+    def state(self):
+        """ Returns the states of the stat sets, which HDFWriter.set_stats_state() saves.
+
+        Returns:
+            OrderedDict: the column names to the state properties of their stat sets.
+
+        """
+        return OrderedDict((name, stat_set.state) for name, stat_set in iteritems(self._stats))
+
+    def restore(self, state):
+        """ Restores the stat sets from the state property, so that run() adds the rows after them.
+
+        Args:
+            state (OrderedDict): as from the state property, or HDFReader.stats_state.
+
+        Returns:
+            ColumnStats: self
+
+        """
+        for name, (col_state, sample) in iteritems(state):
+            self._stats[name].restore(col_state, sample)
+
+        return self
+
+    def run(self, reader, chunk_rows=None, start=0):
+        """ Computes the stats from the rows table of an HDF reader.
+
+        Args:
+            reader (HDFReader):
+            chunk_rows (int, optional): number of rows of a column read at a time. Defaults to CHUNK_ROWS.
+            start (int, optional): position of the first row to add, when the stats of the rows before it
+                were restored.
+
+        Returns:
+            ColumnStats: self
+
+        """
+        logical_types = reader.logical_types
+        overflow = reader.overflow
+
+        for name, stat_set in iteritems(self._stats):
+            for chunk_start, values in reader.iter_column(name, chunk_rows or self.CHUNK_ROWS, start=start):
+                _add_chunk(stat_set, values, chunk_start, logical_types.get(name), overflow.get(name))
+
+            stat_set.finish()
+
+        return self
+
+
+def _add_chunk(stat_set, values, start, logical_type, overflow):
+    """ Adds a chunk of the stored values of a column to a ColumnStatSet, converting the None replacements,
+    the utf-8 strings and the date, datetime and time values.
+
+    Args:
+        stat_set (ColumnStatSet):
+        values (numpy.ndarray): values of the column, as they are stored.
+        start (int): row position of the first value.
+        logical_type (str): 'date', 'datetime' or 'time' for those columns, otherwise None.
+        overflow (tuple): the overflow strings of the column, from HDFReader.overflow, or None.
+
+    """
+    kind = values.dtype.kind
+
+    if stat_set.is_numeric and kind in 'if' and not logical_type:
+        if kind == 'f':
+            nulls = np.isnan(values)
+        else:
+            nulls = values == MIN_INT32
+            if values.dtype.itemsize > 4:
+                nulls |= values == MIN_INT64
+
+        stat_set.add_numbers(values, nulls)
+        return
+
+    uniques, counts = np.unique(values, return_counts=True)
+    counts = counts.tolist()
+
+    if kind == 'S':
+        uniques = np.char.decode(uniques, 'utf-8').tolist()
+    else:
+        uniques = [None if v is None else u('{}').format(v) for v in _deserialize_column(uniques, logical_type)]
+
+    if overflow is not None and kind == 'S':
+        # The table has prefixes of the strings too long for the column, so count the whole strings instead.
+        rows, strings = overflow
+        lo, hi = np.searchsorted(rows, [start, start + len(values)])
+
+        if lo < hi:
+            positions = {v: i for i, v in enumerate(uniques)}
+
+            for row, string in zip(rows[lo:hi].tolist(), strings[lo:hi]):
+                counts[positions[values[row - start].decode('utf-8')]] -= 1
+                uniques.append(string)
+                counts.append(1)
+
+    stat_set.add_uniques(uniques, counts)
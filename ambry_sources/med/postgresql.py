@@ -12,6 +12,7 @@ from multicorn import ForeignDataWrapper
 from multicorn.utils import log_to_postgres, ERROR, WARNING, DEBUG
 
 from ambry_sources.mpf import MPRowsFile
+from ambry_sources.pool import default_pool
 
 POSTGRES_PARTITION_SCHEMA_NAME = 'partitions'
 FOREIGN_SERVER_NAME = 'partition_server'
@@ -180,7 +181,8 @@ class MPRForeignDataWrapper(ForeignDataWrapper):
                 'Initializing Foreign Data Wrapper: user: {}, filesystem: {}, path: {}'
                 .format(current_user, options['filesystem'], options['path']),
                 DEBUG)
-        self._mp_rows = MPRowsFile(self.filesystem, self.path)
+        # The pool keeps the metadata and file handles, so each query doesn't re-open the file.
+        self._mp_rows = MPRowsFile(self.filesystem, self.path, pool=default_pool)
 
     def _matches(self, quals, row):
         """ Returns True if row matches to all quals. Otherwise returns False.
@@ -214,32 +216,35 @@ class MPRForeignDataWrapper(ForeignDataWrapper):
                 .format(syspath, quals, columns),
                 DEBUG)
             with self._mp_rows.reader as reader:
-                for row in reader.rows:
-                    assert isinstance(row, (tuple, list)), row
+                for batch in reader.iter_batches():
+                    for row in batch:
+                        assert isinstance(row, (tuple, list)), row
+
+                        if not self._matches(quals, row):
+                            log_to_postgres(
+                                'No match, continue with another: mpr: {}, row: {}, quals: {}'
+                                .format(syspath, row, quals),
+                                DEBUG)
+                            continue
 
-                    if not self._matches(quals, row):
                         log_to_postgres(
-                            'No match, continue with another: mpr: {}, row: {}, quals: {}'
+                            'Match found, yielding row {}: mpr: {}, quals: {}'
                             .format(syspath, row, quals),
                             DEBUG)
-                        continue
 
-                    log_to_postgres(
-                        'Match found, yielding row {}: mpr: {}, quals: {}'
-                        .format(syspath, row, quals),
-                        DEBUG)
-
-                    yield row
+                        yield row
         else:
             # it is the same, except debug logging.
             with self._mp_rows.reader as reader:
-                for row in reader.rows:
-                    assert isinstance(row, (tuple, list)), row
-
-                    if not self._matches(quals, row):
+                for batch in reader.iter_batches():
+                    if not quals:
+                        for row in batch:
+                            yield row
                         continue
 
-                    yield row
+                    for row in batch:
+                        if self._matches(quals, row):
+                            yield row
 
 
 def _postgres_shares_group():
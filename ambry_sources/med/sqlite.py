@@ -6,6 +6,7 @@ from fs.opener import fsopendir
 from six import binary_type, text_type
 
 from ambry_sources.mpf import MPRowsFile
+from ambry_sources.pool import default_pool
 
 from ambry.util import get_logger
 import logging
@@ -59,9 +60,12 @@ class Cursor:
     def __init__(self, table):
         self.table = table
         self._reader = table.mprows.reader
-        self._rows_iter = iter(self._reader.rows)
-        self._current_row = next(self._rows_iter)
-        self._row_id = 1
+        self._batches = iter(self._reader.iter_batches())
+        self._batch = []
+        self._batch_pos = 0
+        self._current_row = None
+        self._row_id = 0
+        self.Next()
 
     def Filter(self, *args):
         pass
@@ -81,7 +85,12 @@ class Cursor:
 
     def Next(self):
         try:
-            self._current_row = next(self._rows_iter)
+            while self._batch_pos >= len(self._batch):
+                self._batch = next(self._batches)
+                self._batch_pos = 0
+
+            self._current_row = self._batch[self._batch_pos]
+            self._batch_pos += 1
             self._row_id += 1
             assert isinstance(self._current_row, (tuple, list)), self._current_row
         except StopIteration:
@@ -176,7 +185,8 @@ def _get_module_instance():
         def Create(self, db, modulename, dbname, tablename, # These argare are required by APSW
                    mpr_url, *args): # These are our args.
 
-            mprows = MPRowsFile(mpr_url)
+            # The pool keeps the metadata and file handles, so each query doesn't re-open the file.
+            mprows = MPRowsFile(mpr_url, pool=default_pool)
 
             columns_types = []
             column_names = []
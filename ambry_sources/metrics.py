@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+
+Performance metrics for the phases of loading and analyzing MPR and HDF files. Each phase, such as writing the
+rows, running the intuiters or computing stats, records the number of rows, the bytes in and out, and the time
+spent packing, compressing and doing I/O. Listeners get events as the phases run, so they don't have to poll
+report_progress() from a signal handler.
+
+>>> def listener(event, phase):
+>>>     print event, phase.name, phase.rows, phase.rows_per_second
+>>>
+>>> f = MPRowsFile(fs, 'foobar', metrics=MetricsCollector(listener))
+>>> f.load_rows(source)
+>>> print f.metrics.summary()
+
+Copyright (c) 2015 Civic Knowledge. This file is licensed under the terms of the
+Revised BSD License, included in this distribution as LICENSE.txt
+"""
+
+from collections import deque
+from contextlib import contextmanager
+import time
+
+
+class Phase(object):
+    """The counters for one phase of processing. Writers add to the counters of the current phase."""
+
+    def __init__(self, name, parent=None, **info):
+        self.name = name
+        self.parent = parent  # Name of the enclosing phase
+        self.info = info
+        self.start_time = time.time()
+        self.end_time = None
+
+        self.rows = 0
+        self.bytes_in = 0  # Bytes of packed rows, before compression, or of the file read
+        self.bytes_out = 0  # Bytes written to the file
+        self.pack_time = 0.0
+        self.compress_time = 0.0
+        self.io_time = 0.0
+
+    @property
+    def elapsed(self):
+        return (self.end_time or time.time()) - self.start_time
+
+    @property
+    def rows_per_second(self):
+        elapsed = self.elapsed
+        return round(float(self.rows) / elapsed, 2) if elapsed else None
+
+    @property
+    def compression_ratio(self):
+        return round(float(self.bytes_in) / self.bytes_out, 3) if self.bytes_out and self.bytes_in else None
+
+    @property
+    def dict(self):
+        d = dict(
+            name=self.name, parent=self.parent, start_time=self.start_time, end_time=self.end_time,
+            elapsed=self.elapsed, rows=self.rows, bytes_in=self.bytes_in, bytes_out=self.bytes_out,
+            compression_ratio=self.compression_ratio, rows_per_second=self.rows_per_second,
+            pack_time=self.pack_time, compress_time=self.compress_time, io_time=self.io_time)
+        d.update(self.info)
+        return d
+
+    def __repr__(self):
+        return '<Phase {} rows={} elapsed={:0.3f}>'.format(self.name, self.rows, self.elapsed)
+
+
+class MetricsCollector(object):
+    """ Runs phases, sends their events to listeners and keeps the most recent finished phases in memory.
+
+    Listeners are called with the event name and the Phase. The events are 'start' and 'end' for each phase,
+    and 'progress' after each block of rows is written.
+
+    """
+
+    MAX_PHASES = 1000  # Number of finished phases to keep
+
+    def __init__(self, *listeners):
+        self.listeners = list(listeners)
+        self.phases = deque(maxlen=self.MAX_PHASES)
+        self._stack = []
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    @property
+    def current(self):
+        """The innermost running phase, or None"""
+        return self._stack[-1] if self._stack else None
+
+    @contextmanager
+    def phase(self, name, **info):
+        """Run a phase, as a context manager that yields the Phase. """
+
+        phase = Phase(name, parent=self.current.name if self._stack else None, **info)
+
+        self._stack.append(phase)
+        self.emit('start', phase)
+
+        try:
+            yield phase
+        finally:
+            phase.end_time = time.time()
+            self._stack.pop()
+            self.phases.append(phase)
+            self.emit('end', phase)
+
+    def emit(self, event, phase):
+        for listener in self.listeners:
+            listener(event, phase)
+
+    def summary(self):
+        """Return a dict of the last finished phase of each name, as dicts"""
+        return {p.name: p.dict for p in self.phases}
+
+    def clear(self):
+        self.phases.clear()
+
+
+class MeteredFile(object):
+    """Wraps a file handle to add the time and bytes of writes to the current phase of a collector. """
+
+    def __init__(self, fh, metrics):
+        self._fh = fh
+        self._metrics = metrics
+
+    def write(self, data):
+        phase = self._metrics.current
+
+        if phase is None:
+            return self._fh.write(data)
+
+        t = time.time()
+        r = self._fh.write(data)
+        phase.io_time += time.time() - t
+        phase.bytes_out += len(data)
+
+        return r
+
+    def __getattr__(self, item):
+        return getattr(self._fh, item)
@@ -21,6 +21,7 @@ from six import iteritems, text_type
 
 import msgpack
 
+from ambry_sources.metrics import MeteredFile
 from ambry_sources.util import get_perm, is_group_readable
 
 
@@ -81,6 +82,8 @@ class MPRowsFile(object):
 
     FILE_HEADER_FORMAT_SIZE = FILE_HEADER_FORMAT.size
 
+    SORT_MEMORY_LIMIT = 256 * 1024 * 1024  # Default bytes of rows to hold in memory for sort()
+
     # These are all of the keys for the  schema. The schema is a collection of rows, with these
     # keys being the first, followed by one row per column.
     SCHEMA_TEMPLATE = [
@@ -167,25 +170,41 @@ class MPRowsFile(object):
         'warnings': []
     }
 
-    def __init__(self, url_or_fs, path=None):
+    def __init__(self, url_or_fs, path=None, read_ahead=None, pool=None, metrics=None):
         """
 
-        :param url_or_fs:
+        :param url_or_fs: A pyfilesystem, or a filesystem URL. HTTP and HTTPS URLs are read with range requests,
+        so the header, metadata and first rows are read without downloading the whole file.
         :param path:
+        :param read_ahead: If true, read the file on a background thread, ahead of the reader, which is
+        faster for remote filesystems like S3. If an integer, the number of bytes to read at a time.
+        :param pool: An MPRPool, such as ambry_sources.pool.default_pool, to reuse the metadata and file handles
+        of previous readers.
+        :param metrics: A MetricsCollector for the phases of loading and analyzing the file. If not given, the
+        file gets its own collector, in the metrics property.
         :return:
         """
 
         from fs.opener import opener
+        from .metrics import MetricsCollector
 
         if path:
             self._fs, self._path = url_or_fs, path
+        elif url_or_fs.startswith(('http://', 'https://')):
+            from .remote import HTTPRangeFS
+            base_url, self._path = url_or_fs.rsplit('/', 1)
+            self._fs = HTTPRangeFS(base_url)
         else:
             self._fs, self._path = opener.parse(url_or_fs)
 
         self._writer = None
+        self._meta_writer = None
         self._reader = None
 
         self._compress = True
+        self._read_ahead = read_ahead
+        self._pool = pool
+        self.metrics = metrics or MetricsCollector()
 
         self._process = None  # Process name for report_progress
         self._start_time = 0
@@ -255,6 +274,13 @@ class MPRowsFile(object):
 
         return obj
 
+    @staticmethod
+    def unpack_block(data):
+        """Decode a block of rows from the msgpack bytes generated by MPRReader.iter_packed_blocks(). This
+        is a static method, so blocks can be decoded in other processes."""
+
+        return msgpack.unpackb(data, object_hook=MPRowsFile.decode_obj, use_list=False, encoding='utf-8')
+
     @classmethod
     def read_file_header(cls, o, fh):
         try:
@@ -393,6 +419,9 @@ class MPRowsFile(object):
         if self._writer:
             self._reader.close()
 
+        if self._meta_writer:
+            self._meta_writer.close()
+
     @property
     def meta(self):
 
@@ -437,11 +466,13 @@ class MPRowsFile(object):
             self._process = 'intuit_type'
             self._start_time = time.time()
 
-            with self.reader as r:
-                ti = TypeIntuiter().process_header(r.headers).run(r.rows, r.n_rows)
+            with self.metrics.phase('intuit_type') as phase:
+                with self.reader as r:
+                    ti = TypeIntuiter().process_header(r.headers).run(r.rows, r.n_rows)
+                    phase.rows, phase.bytes_in = r.n_rows, r.meta_start - r.data_start
 
-            with self.writer as w:
-                w.set_types(ti)
+                with self.meta_writer as w:
+                    w.set_types(ti)
         finally:
             self._process = 'none'
 
@@ -454,24 +485,27 @@ class MPRowsFile(object):
             self._process = 'intuit_rows'
             self._start_time = time.time()
 
-            with self.reader as r:
-                if r.n_rows == 0:
-                    return
+            with self.metrics.phase('intuit_rows') as phase:
+                with self.reader as r:
+                    if r.n_rows == 0:
+                        return
 
-                head = list(islice(r.raw, RowIntuiter.N_TEST_ROWS))
-                n_rows = r.n_rows
+                    head = list(islice(r.raw, RowIntuiter.N_TEST_ROWS))
+                    n_rows = r.n_rows
 
-            with self.reader as r:
-                # Reset the iterator to get the tail
-                if RowIntuiter.N_TEST_ROWS < r.n_rows:
-                    tail = list(islice(r.raw, r.n_rows - RowIntuiter.N_TEST_ROWS, r.n_rows))
-                else:
-                    tail = list(islice(r.raw, 0, r.n_rows))
+                with self.reader as r:
+                    # Reset the iterator to get the tail
+                    if RowIntuiter.N_TEST_ROWS < r.n_rows:
+                        tail = list(islice(r.raw, r.n_rows - RowIntuiter.N_TEST_ROWS, r.n_rows))
+                    else:
+                        tail = list(islice(r.raw, 0, r.n_rows))
 
-            ri = RowIntuiter().run(head, tail, n_rows)
+                    phase.rows, phase.bytes_in = len(head) + len(tail), r.meta_start - r.data_start
 
-            with self.writer as w:
-                w.set_row_spec(ri)
+                ri = RowIntuiter().run(head, tail, n_rows)
+
+                with self.meta_writer as w:
+                    w.set_row_spec(ri)
 
         finally:
             self._process = 'none'
@@ -484,14 +518,16 @@ class MPRowsFile(object):
             self._process = 'run_stats'
             self._start_time = time.time()
 
-            with self.reader as r:
-                if r.n_rows == 0:
-                    return
-                columns = [(c.name, c.type) for c in r.columns]
-                stats = Stats(columns, r.n_rows).run(r, sample_from=r.n_rows)
+            with self.metrics.phase('run_stats') as phase:
+                with self.reader as r:
+                    if r.n_rows == 0:
+                        return
+                    columns = [(c.name, c.type) for c in r.columns]
+                    stats = Stats(columns, r.n_rows).run(r.iter_records(), sample_from=r.n_rows)
+                    phase.rows, phase.bytes_in = r.n_rows, r.meta_start - r.data_start
 
-            with self.writer as w:
-                w.set_stats(stats)
+                with self.meta_writer as w:
+                    w.set_stats(stats)
 
         finally:
             self._process = 'none'
@@ -543,52 +579,60 @@ class MPRowsFile(object):
             self._process = 'load_rows'
             self._start_time = time.time()
 
-            with self.writer as w:
+            with self.metrics.phase('load_rows') as load_phase:
 
-                w.load_rows(source, callback=callback, limit=limit)
+                with self.metrics.phase('write_rows') as write_phase:
+                    with self.writer as w:
 
-                if spec:
-                    w.set_source_spec(spec)
+                        w.load_rows(source, callback=callback, limit=limit)
 
-            if intuit_rows:
-                try:
-                    self.run_row_intuiter()
-                except RowIntuitError:
-                    with self.writer as w:
-                        w.meta['warnings'].append('Failed to intuit rows. Should set row classifications manually. ')
+                        if spec:
+                            w.set_source_spec(spec)
 
-                    pass
+                if intuit_rows:
+                    try:
+                        self.run_row_intuiter()
+                    except RowIntuitError:
+                        with self.meta_writer as w:
+                            w.meta['warnings'].append(
+                                'Failed to intuit rows. Should set row classifications manually. ')
 
-            elif spec:
+                        pass
 
-                with self.writer as w:
-                    w.set_row_spec(spec)
-                    assert w.meta['schema'][0] == MPRowsFile.SCHEMA_TEMPLATE
+                elif spec:
 
-            if source.meta:
-                with self.writer as w:
-                    for c, m in zip(w.columns, source.meta['columns']):
-                        assert c.pos == m['position']
+                    with self.meta_writer as w:
+                        w.set_row_spec(spec)
+                        assert w.meta['schema'][0] == MPRowsFile.SCHEMA_TEMPLATE
 
-                        #assert c.name == m['name'] # True for SocrataSource, maybe not if there are others in the future
+                if source.meta:
+                    with self.meta_writer as w:
+                        for c, m in zip(w.columns, source.meta['columns']):
+                            assert c.pos == m['position']
 
-                        col = w.column(c.name)
+                            # assert c.name == m['name']
+                            # True for SocrataSource, maybe not if there are others in the future
 
-                        col.description = m['description']
+                            col = w.column(c.name)
 
+                            col.description = m['description']
 
-            if intuit_type:
-                self.run_type_intuiter()
 
-            if run_stats:
-                self.run_stats()
+                if intuit_type:
+                    self.run_type_intuiter()
 
-            with self.writer as w:
+                if run_stats:
+                    self.run_stats()
 
-                if not w.data_end_row:
-                    w.data_end_row = w.n_rows
+                with self.meta_writer as w:
 
-                w.finalize()
+                    if not w.data_end_row:
+                        w.data_end_row = w.n_rows
+
+                    w.finalize()
+
+                load_phase.rows = write_phase.rows
+                load_phase.bytes_in, load_phase.bytes_out = write_phase.bytes_in, write_phase.bytes_out
 
         finally:
             self._process = None
@@ -603,10 +647,24 @@ class MPRowsFile(object):
         """Pass-though to the PySilesystem setcontents function"""
         return self._fs.setcontents(self.path,  data,  errors=errors, chunk_size=chunk_size)
 
+    def _reader_file(self, fh):
+        """Wrap a file handle opened for reading, if the file is configured to read ahead"""
+
+        if self._read_ahead:
+            from .util import ReadAheadFile
+            window = self._read_ahead if self._read_ahead is not True else None
+            fh = ReadAheadFile(fh, window=window)
+
+        return fh
+
     @property
     def reader(self):
         if not self._reader:
-            self._reader = MPRReader(self, self._fs.open(self.path, mode='rb'), compress=self._compress)
+            if self._pool is not None:
+                self._reader = self._pool.reader(self)
+            else:
+                fh = self._reader_file(self._fs.open(self.path, mode='rb'))
+                self._reader = MPRReader(self, fh, compress=self._compress)
         return self._reader
 
     def __iter__(self):
@@ -618,6 +676,31 @@ class MPRowsFile(object):
             for row in r:
                 yield row
 
+    def iter_batches(self, size=None):
+        """Iterate the batches of rows from the reader's iter_batches() method"""
+
+        with self.reader as r:
+            for batch in r.iter_batches(size):
+                yield batch
+
+    def aiter_batches(self, size=None, prefetch=None, loop=None, executor=None):
+        """Return an asyncio asynchronous iterator over batches of rows, which are read, decompressed and
+        decoded in an executor. See ambry_sources.aio for the arguments. Requires Python 3.5 or later.
+
+            async for batch in f.aiter_batches():
+                ...
+        """
+        from .aio import aiter_batches
+
+        return aiter_batches(lambda: self.iter_batches(size), prefetch=prefetch, loop=loop, executor=executor)
+
+    def aiter_rows(self, size=None, prefetch=None, loop=None, executor=None):
+        """Return an asyncio asynchronous iterator over the data rows, which are read in batches in an
+        executor, like aiter_batches(). """
+        from .aio import aiter_rows
+
+        return aiter_rows(lambda: self.iter_batches(size), prefetch=prefetch, loop=loop, executor=executor)
+
     def select(self, predicate=None, headers=None):
         """Iterate the results from the reader's select() method"""
 
@@ -625,6 +708,142 @@ class MPRowsFile(object):
             for row in r.select(predicate, headers):
                 yield row
 
+    def sort(self, by, dest, memory_limit=None):
+        """Write the data rows of this file to another MPR file, sorted on one or more columns.
+
+        The rows are read in runs that fit into memory_limit bytes. If there is more than one run, each
+        sorted run is spilled to a temporary MPR file, and the runs are k-way merged into the destination.
+        None values sort after all other values.
+
+        :param by: A column name, or a list of column names, to sort on.
+        :param dest: An MPRowsFile, or a path in the filesystem of this file, to write the sorted rows to.
+        :param memory_limit: Approximate number of bytes of rows to hold in memory. Defaults to
+            SORT_MEMORY_LIMIT
+        :return: the destination MPRowsFile
+        """
+        from copy import deepcopy
+        from heapq import merge
+        from itertools import islice
+
+        if not isinstance(dest, MPRowsFile):
+            dest = MPRowsFile(self._fs, dest)
+
+        if dest.n_rows:
+            raise MPRError(
+                "Can't sort into {}; rows already loaded. n_rows = {}".format(dest.path, dest.n_rows))
+
+        memory_limit = memory_limit or self.SORT_MEMORY_LIMIT
+
+        with self.reader as r:
+            meta = deepcopy(r.meta)
+            headers = r.headers
+
+        by = [by] if isinstance(by, six.string_types) else list(by)
+
+        try:
+            positions = [headers.index(c) for c in by]
+        except ValueError:
+            raise MPRError("Can't sort {}; sort columns {} are not all in headers {}"
+                           .format(self.path, by, headers))
+
+        def key(row):
+            return tuple((row[p] is None, row[p]) for p in positions)
+
+        runs = []
+        tmp_fs = None
+
+        try:
+            with self.reader as r:
+                rows_iter = iter(r.rows)
+
+                sample = list(islice(rows_iter, 100))
+                run_size = max(len(sample), int(memory_limit / _estimate_row_size(sample)), 1)
+                run = sample + list(islice(rows_iter, run_size - len(sample)))
+
+                while run:
+                    run.sort(key=key)
+
+                    # Only one row is read ahead, so no more than one run is held in memory.
+                    next_row = next(rows_iter, None)
+
+                    if not runs and next_row is None:
+                        # Everything fit in memory, so there is no need to spill
+                        sorted_rows = run
+                        break
+
+                    if tmp_fs is None:
+                        from fs.opener import fsopendir
+                        tmp_fs = fsopendir('temp://')
+
+                    run_file = MPRowsFile(tmp_fs, 'run{}'.format(len(runs)))
+                    with run_file.writer as w:
+                        for i in range(0, len(run), MPRWriter.BLOCK_SIZE):
+                            w.insert_rows(run[i:i + MPRWriter.BLOCK_SIZE])
+                    runs.append(run_file)
+
+                    # The right side of the next assignment is evaluated before the name is rebound, so without
+                    # this the spilled run would stay in memory while the next one is read.
+                    run = None
+                    run = [] if next_row is None else [next_row] + list(islice(rows_iter, run_size - 1))
+
+                else:
+                    sorted_rows = []
+
+            if runs:
+                # The counters break ties between equal keys, so rows themselves are never compared.
+                def decorated(run_file, i):
+                    with run_file.reader as r:
+                        for j, row in enumerate(r.raw):
+                            yield key(row), i, j, row
+
+                sorted_rows = (e[3] for e in merge(*[decorated(rf, i) for i, rf in enumerate(runs)]))
+
+            sorted_rows = iter(sorted_rows)
+
+            with dest.writer as w:
+                w.meta = meta
+                w.meta['about']['create_time'] = time.time()
+
+                w.insert_row(list(headers))
+
+                while True:
+                    block = list(islice(sorted_rows, MPRWriter.BLOCK_SIZE))
+                    if not block:
+                        break
+                    w.insert_rows(block)
+
+                w.data_start_row = 1
+                w.data_end_row = w.n_rows
+
+                w.meta['row_spec']['header_rows'] = [0]
+                w.meta['row_spec']['comment_rows'] = None
+                w.meta['row_spec']['start_row'] = 1
+                w.meta['row_spec']['end_row'] = w.n_rows
+                w.meta['comments']['header'] = None
+                w.meta['comments']['footer'] = None
+
+        finally:
+            for run_file in runs:
+                run_file.close()
+
+            if tmp_fs is not None:
+                tmp_fs.close()
+
+        return dest
+
+    def query(self, where=None, columns=None):
+        """Iterate the results from the reader's query() method"""
+
+        with self.reader as r:
+            for row in r.query(where, columns):
+                yield row
+
+    def aggregate(self, group_by, aggs, max_groups=None, processes=None):
+        """Aggregate the data rows with the reader's aggregate() method"""
+
+        with self.reader as r:
+            return r.aggregate(group_by, aggs, max_groups=max_groups, processes=processes)
+
     @property
     def writer(self):
         from os.path import dirname
@@ -642,6 +861,19 @@ class MPRowsFile(object):
 
         return self._writer
 
+    @property
+    def meta_writer(self):
+        """Return a writer that updates only the file header and metadata of an existing file. Unlike the
+        writer, it doesn't start a new gzip member for rows, so updates don't grow the file or touch the row data.
+        """
+        if not self._meta_writer:
+            if not self.exists:
+                raise MPRError("Can't update metadata of '{}'; the file doesn't exist".format(self.path))
+
+            self._meta_writer = MPRMetaWriter(self, self._fs.open(self.path, mode='r+b'))
+
+        return self._meta_writer
+
     def report_progress(self):
         """
         This function can be called from a higher level to report progress. It is usually called from an alarm
@@ -689,7 +921,6 @@ class MPRWriter(object):
     def __init__(self, parent, fh, compress=True):
 
         from copy import deepcopy
-        import re
 
         assert fh
 
@@ -732,13 +963,16 @@ class MPRWriter(object):
 
             self.write_file_header()  # Get moved to the start of row data.
 
+        # Writes of compressed rows are timed and counted in the current phase of the parent's metrics
+        metrics = getattr(parent, 'metrics', None)
+        fh = MeteredFile(self._fh, metrics) if metrics else self._fh
+
         # Creating the GzipFile object will also write the Gzip header, about 21 bytes of data.
         if self._compress:
-            self._zfh = GzipFile(fileobj=self._fh, compresslevel=9)  # Compressor for writing rows
+            self._zfh = GzipFile(fileobj=fh, compresslevel=9)  # Compressor for writing rows
         else:
-            self._zfh = self._fh
+            self._zfh = fh
 
-        self.header_mangler = lambda name: re.sub('_+', '_', re.sub('[^\w_]', '_', name.strip()).lower()).rstrip('_')
 
         if self.n_rows == 0:
             self.meta['about']['create_time'] = time.time()
@@ -758,6 +992,12 @@ class MPRWriter(object):
     def set_col_val(name_or_pos, **kwargs):
         pass
 
+    @staticmethod
+    def header_mangler(name):
+        """Convert a header to a lowercase identifier"""
+        import re
+        return re.sub('_+', '_', re.sub('[^\w_]', '_', name.strip()).lower()).rstrip('_')
+
     @property
     def headers(self):
         """Return the headers rows
@@ -818,8 +1058,26 @@ class MPRWriter(object):
         if not rows:
             return
 
+        metrics = getattr(self.parent, 'metrics', None)
+        phase = metrics.current if metrics else None
+
         try:
-            self._zfh.write(msgpack.packb(rows, default=MPRowsFile.encode_obj, encoding='utf-8'))
+            if phase is None:
+                self._zfh.write(msgpack.packb(rows, default=MPRowsFile.encode_obj, encoding='utf-8'))
+            else:
+                t0 = time.time()
+                packed = msgpack.packb(rows, default=MPRowsFile.encode_obj, encoding='utf-8')
+                t1 = time.time()
+                io_time = phase.io_time
+                self._zfh.write(packed)
+
+                phase.pack_time += t1 - t0
+                phase.compress_time += (time.time() - t1) - (phase.io_time - io_time)
+                phase.bytes_in += len(packed)
+                phase.rows += len(rows)
+
+                metrics.emit('progress', phase)
+
         except IOError as e:
             raise IOError("Can't write row to file '{}': {}".format(self.syspath, e))
 
@@ -870,13 +1128,32 @@ class MPRWriter(object):
         self._write_rows(rows)
 
     def load_rows(self, source, callback=None, limit=None):
-        """Load rows from an iterator"""
+        """Load rows from an iterator, or from the batches of a source that has an iter_batches() method.
+
+        :param source: An iterator of rows, or a source with an iter_batches() method
+        :param callback: If given, called after each row is loaded, with the number of rows loaded so far
+        :param limit: If given, stop after loading one more than this many rows
+        :return:
+        """
+        from ambry_sources.util import iter_batches
+
+        n = 0
+
+        for batch in iter_batches(source, self.BLOCK_SIZE):
+
+            if limit and n + len(batch) > limit + 1:
+                batch = batch[:limit + 1 - n]
+
+            n += len(batch)
+
+            self.insert_rows(batch)
 
-        for i, row in enumerate(iter(source), 1):
-            self.insert_row(row)
             if callback:
-                callback(i)
-            if limit and i > limit:
+                # Called once per row, with the number of rows loaded so far, as when rows were inserted singly
+                for i in range(n - len(batch) + 1, n + 1):
+                    callback(i)
+
+            if limit and n > limit:
                 break
 
         self._write_rows()
@@ -998,20 +1275,18 @@ class MPRWriter(object):
         if isinstance(ri_or_ss, RowIntuiter):
             ri = ri_or_ss
 
-            with self.parent.writer as w:
+            self.data_start_row = ri.start_line
+            self.data_end_row = ri.end_line if ri.end_line else None
 
-                w.data_start_row = ri.start_line
-                w.data_end_row = ri.end_line if ri.end_line else None
+            self.meta['row_spec']['header_rows'] = ri.header_lines
+            self.meta['row_spec']['comment_rows'] = ri.comment_lines
+            self.meta['row_spec']['start_row'] = ri.start_line
+            self.meta['row_spec']['end_row'] = ri.end_line
+            self.meta['row_spec']['data_pattern'] = ri.data_pattern_source
 
-                w.meta['row_spec']['header_rows'] = ri.header_lines
-                w.meta['row_spec']['comment_rows'] = ri.comment_lines
-                w.meta['row_spec']['start_row'] = ri.start_line
-                w.meta['row_spec']['end_row'] = ri.end_line
-                w.meta['row_spec']['data_pattern'] = ri.data_pattern_source
+            set_descriptions(self, [h for h in ri.headers])
 
-                set_descriptions(w, [h for h in ri.headers])
-
-                w.headers = [self.header_mangler(h) for h in ri.headers]
+            self.headers = [self.header_mangler(h) for h in ri.headers]
 
         else:
             ss = ri_or_ss
@@ -1032,20 +1307,18 @@ class MPRWriter(object):
                 else:
                     header_lines = None
 
-            with self.parent.writer as w:
-
-                w.data_start_row = ss.start_line
-                w.data_end_row = ss.end_line if ss.end_line else None
+            self.data_start_row = ss.start_line
+            self.data_end_row = ss.end_line if ss.end_line else None
 
-                w.meta['row_spec']['header_rows'] = ss.header_lines
-                w.meta['row_spec']['comment_rows'] = None
-                w.meta['row_spec']['start_row'] = ss.start_line
-                w.meta['row_spec']['end_row'] = ss.end_line
-                w.meta['row_spec']['data_pattern'] = None
+            self.meta['row_spec']['header_rows'] = ss.header_lines
+            self.meta['row_spec']['comment_rows'] = None
+            self.meta['row_spec']['start_row'] = ss.start_line
+            self.meta['row_spec']['end_row'] = ss.end_line
+            self.meta['row_spec']['data_pattern'] = None
 
-                if header_lines:
-                    set_descriptions(w, [h for h in RowIntuiter.coalesce_headers(header_lines)])
-                    w.headers = [self.header_mangler(h) for h in RowIntuiter.coalesce_headers(header_lines)]
+            if header_lines:
+                set_descriptions(self, [h for h in RowIntuiter.coalesce_headers(header_lines)])
+                self.headers = [self.header_mangler(h) for h in RowIntuiter.coalesce_headers(header_lines)]
 
         # Now, look for the end line.
         if False:
@@ -1069,6 +1342,65 @@ class MPRWriter(object):
             return False
 
 
+class MPRMetaWriter(MPRWriter):
+    """
+    Update the file header and metadata of an existing MPR file, without writing rows. The row data segment is
+    never read or written, so the cost of an update is proportional to the size of the metadata: close() rewrites
+    the header, writes the metadata at the same meta_start and truncates the file after it.
+
+    >>> with MPRowsFile(fs, 'foobar').meta_writer as w:
+    >>>     w.set_types(ti)
+
+    """
+
+    def __init__(self, parent, fh):
+
+        assert fh
+
+        self.parent = parent
+        self._fh = fh
+        self._compress = False
+        self._zfh = None
+
+        self.version = self.VERSION
+        self.magic = self.MAGIC
+        self.data_start = self.FILE_HEADER_FORMAT_SIZE
+        self.cache = []
+
+        try:
+            MPRowsFile.read_file_header(self, self._fh)
+            self.meta = MPRowsFile.read_meta(self, self._fh)
+        except (IOError, zlib.error) as e:
+            self._fh.close()
+            raise MPRError("Can't update metadata of '{}'; not an MPR file with rows: {}".format(self.path, e))
+
+        if not self.meta:
+            self._fh.close()
+            raise MPRError("Can't update metadata of '{}'; the file has no metadata".format(self.path))
+
+    def _write_rows(self, rows=None):
+        if rows or self.cache:
+            raise MPRError("Can't write rows with a metadata writer; use MPRowsFile.writer")
+
+    def load_rows(self, source, callback=None, limit=None):
+        raise MPRError("Can't load rows with a metadata writer; use MPRowsFile.writer")
+
+    def close(self):
+
+        if self._fh:
+
+            self.write_file_header()
+            self.write_meta()
+
+            self._fh.truncate()  # In case the metadata shrank
+
+            self._fh.close()
+            self._fh = None
+
+            if self.parent:
+                self.parent._meta_writer = None
+
+
 class MPRReader(object):
     """
     Read an MPR file
@@ -1115,9 +1447,14 @@ class MPRReader(object):
         else:
             self._zfh = self._fh
 
+        # Remote files, like HTTPRangeFile, set a smaller read size, so reading the first rows doesn't
+        # fetch the default megabyte of row data.
+        read_size = getattr(self._fh, 'block_size', 0)
+
         self.unpacker = msgpack.Unpacker(self._zfh, object_hook=MPRowsFile.decode_obj,
                                          use_list=False,
-                                         encoding='utf-8')
+                                         encoding='utf-8',
+                                         read_size=read_size)
 
         self._meta = None
 
@@ -1224,6 +1561,95 @@ class MPRReader(object):
         finally:
             self._in_iteration = False
 
+    def iter_batches(self, size=None):
+        """Iterator for reading data rows in batches, as lists of row tuples.
+
+        With no size, each batch is one of the decoded blocks of the file, trimmed to the data rows, so there is
+        no per-row generator overhead.
+
+        :param size: If defined, the number of rows in each batch, except the last.
+        :return: iterator of lists of row tuples
+        """
+
+        self._fh.seek(self.data_start)
+
+        _ = self.headers  # Get the header, but don't return it.
+
+        batch = []
+
+        try:
+            self._in_iteration = True
+
+            for block in self.unpacker:
+                start = self.pos
+                self.pos += len(block)
+
+                if start > self.data_end_row:
+                    continue  # Keep reading, so pos ends at the end of the rows, as for rows()
+
+                lo = max(self.data_start_row - start, 0)
+                hi = min(self.data_end_row + 1 - start, len(block))
+
+                if lo >= hi:
+                    continue
+
+                block = list(block[lo:hi] if lo > 0 or hi < len(block) else block)
+
+                if size is None:
+                    yield block
+                    continue
+
+                batch.extend(block)
+
+                while len(batch) >= size:
+                    yield batch[:size]
+                    batch = batch[size:]
+
+            if batch:
+                yield batch
+
+        finally:
+            self._in_iteration = False
+
+    def iter_packed_blocks(self):
+        """Iterator for the blocks of rows as they are packed in the file, as msgpack bytes. The blocks are
+        decompressed, which has to be done in order, but not decoded, so they can be decoded in other
+        processes with MPRowsFile.unpack_block(). All of the rows are included, so the caller has to skip the
+        rows before data_start_row and after data_end_row.
+
+        :return: iterator of bytes
+        """
+
+        self._fh.seek(self.data_start)
+
+        try:
+            self._in_iteration = True
+
+            while True:
+                parts = []
+
+                try:
+                    self.unpacker.skip(write_bytes=parts.append)
+                except msgpack.OutOfData:
+                    break
+
+                yield b''.join(parts)
+
+        finally:
+            self._in_iteration = False
+
+    def iter_records(self):
+        """Iterator for reading rows as immutable records, with attribute, name and position access.
+
+        The record class is generated for the headers by row_class(), so attribute access is a property lookup
+        rather than a RowProxy __getattr__ call. Unlike the RowProxy objects from __iter__, each record is a new
+        object, so the records can be collected into a list.
+
+        """
+        from ambry_sources.sources.util import row_class
+
+        return six.moves.map(row_class(self.headers), self.rows)
+
     def _get_row_proxy(self):
         from ambry_sources.sources import RowProxy, GeoRowProxy
         if 'geometry' in self.headers:
@@ -1307,12 +1733,51 @@ class MPRReader(object):
         else:
             return iter(self)
 
+    def query(self, where=None, columns=None):
+        """
+        Select data rows with a where expression and return a subset of columns, as tuples. Unlike select(),
+        the expression and the projection are compiled once into a function over the positional rows, so no
+        RowProxy or dict is built for each row.
+
+        :param where: If defined, a Python expression that uses column names as variables, such as
+        "year >= 2010 and county == '06073'". Rows for which it is true are included in the output.
+        :param columns: If defined, a list of the names of the columns to return from each row
+        :return: iterable of tuples
+        """
+        from .query import Query
+
+        return Query(self.headers, where=where, columns=columns).run(self.rows)
+
+    def aggregate(self, group_by, aggs, max_groups=None, processes=None):
+        """
+        Compute aggregates of columns of the data rows, grouped by the values of other columns. The rows
+        are processed as positional tuples, not RowProxy objects.
+
+        :param group_by: A list of column names to group on
+        :param aggs: A dict with column names for keys, and for values an aggregate function name, or a list of
+        them. The functions are count, sum, min, max, mean and count_distinct
+        :param max_groups: If defined, the number of groups to hold in memory before spilling partial
+        aggregates to disk.
+        :param processes: If greater than 1, aggregate in a pool of worker processes.
+        :return: A HashAggregator, which has a headers property and can be iterated for result rows.
+
+            agg = r.aggregate(['county'], {'x': ['count', 'sum']})
+            print agg.headers  # ['county', 'x_count', 'x_sum']
+            rows = list(agg)
+
+        """
+        from .aggregate import HashAggregator
+
+        agg = HashAggregator(self.headers, group_by, aggs, max_groups=max_groups)
+
+        return agg.run(self.rows, processes=processes)
+
     def close(self):
         if self._fh:
             self.meta  # In case caller wants to read mea after close.
             self._fh.close()
             self._fh = None
-            if self.parent:
+            if self.parent and self.parent._reader is self:
                 self.parent._reader = None
 
     def __enter__(self):
@@ -1323,3 +1788,15 @@ class MPRReader(object):
 
         if exc_val:
             return False
+
+
+def _estimate_row_size(rows):
+    """Return a rough estimate of the number of bytes of memory used by each of the rows in a list"""
+    import sys
+
+    if not rows:
+        return 1
+
+    size = sum(sys.getsizeof(row) + sum(sys.getsizeof(v) for v in row) for row in rows)
+
+    return max(int(size / len(rows)), 1)
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+
+A process-wide pool of the parsed metadata and open file handles of MPR files, so code that opens readers on the
+same files over and over, like the SQLite virtual tables and the Postgres foreign data wrapper, doesn't pay to
+open the file and decompress and unpack the metadata for every query.
+
+>>> f = MPRowsFile(fs, 'foobar', pool=default_pool)
+>>> with f.reader as r:  # Reuses the metadata and an idle file handle from the last reader
+>>>     print r.headers
+
+Copyright (c) 2015 Civic Knowledge. This file is licensed under the terms of the
+Revised BSD License, included in this distribution as LICENSE.txt
+"""
+
+from collections import OrderedDict
+import threading
+
+
+def _read_only(*args, **kwargs):
+    raise TypeError('The metadata of a pooled reader is shared and read-only; copy it with copy.deepcopy() to '
+                    'change it')
+
+
+class _ReadOnlyDict(dict):
+    """A dict that can't be changed. Copies are plain dicts."""
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce_ex__(self, protocol):
+        return dict, (_thaw(self),)
+
+
+class _ReadOnlyList(list):
+    """A list that can't be changed. Copies are plain lists."""
+
+    __setitem__ = __delitem__ = __setslice__ = __delslice__ = __iadd__ = __imul__ = _read_only
+    append = extend = insert = pop = remove = reverse = sort = _read_only
+
+    def __reduce_ex__(self, protocol):
+        return list, (_thaw(self),)
+
+
+def _freeze(o):
+    """Return a read-only copy of unpacked metadata"""
+
+    if isinstance(o, dict):
+        return _ReadOnlyDict((k, _freeze(v)) for k, v in o.items())
+    elif isinstance(o, list):
+        return _ReadOnlyList(_freeze(v) for v in o)
+    elif isinstance(o, tuple):
+        return tuple(_freeze(v) for v in o)
+
+    return o
+
+
+def _thaw(o):
+    """Return a plain, mutable copy of read-only metadata"""
+
+    if isinstance(o, dict):
+        return dict((k, _thaw(v)) for k, v in o.items())
+    elif isinstance(o, list):
+        return [_thaw(v) for v in o]
+    elif isinstance(o, tuple):
+        return tuple(_thaw(v) for v in o)
+
+    return o
+
+
+class _Entry(object):
+    """The cached metadata and idle file handles for one file"""
+
+    __slots__ = ('stamp', 'meta', 'handles')
+
+    def __init__(self, stamp):
+        self.stamp = stamp
+        self.meta = None
+        self.handles = []
+
+
+class _PooledFile(object):
+    """Wraps a file handle from the pool. Closing the file returns the handle to the pool, rather than
+    closing it."""
+
+    def __init__(self, pool, key, stamp, fh):
+        self._pool = pool
+        self._key = key
+        self._stamp = stamp
+        self._fh = fh
+
+    def close(self):
+        if self._fh:
+            self._pool._release(self._key, self._stamp, self._fh)
+            self._fh = None
+
+    def __getattr__(self, item):
+        return getattr(self._fh, item)
+
+
+class MPRPool(object):
+    """ A thread-safe, least recently used cache of the metadata and idle file handles of MPR files.
+
+    Entries are keyed by the file's system path or URL, so readers through other filesystem objects for the same
+    location share them, and are discarded when the file's modification time or size changes, so a rewritten file
+    is read again. Files on a filesystem that has neither, like a MemoryFS, are keyed by the filesystem object,
+    so callers must reuse the filesystem to hit the cache.
+
+    The readers of a file share one read-only copy of its metadata, so opening a reader doesn't copy or unpack it.
+    Changing it raises TypeError; a caller that needs to change it should change a copy from copy.deepcopy(),
+    which is made of plain dicts and lists.
+
+    """
+
+    SIZE = 256  # Maximum number of files with cached metadata
+    HANDLES = 32  # Maximum number of idle file handles, across all files
+
+    def __init__(self, size=None, handles=None):
+        """
+
+        :param size: Maximum number of files with cached metadata
+        :param handles: Maximum number of idle file handles to keep open
+        """
+
+        self.size = size or self.SIZE
+        self.handles = handles if handles is not None else self.HANDLES
+
+        self._entries = OrderedDict()  # From least to most recently used
+        self._n_handles = 0
+        self._lock = threading.RLock()
+
+        self.hits = 0  # Readers that used cached metadata
+        self.misses = 0  # Readers that had to read the metadata
+        self.handle_hits = 0  # Readers that reused an idle file handle
+        self.evictions = 0  # Entries discarded because the pool was full or the file changed
+
+    @staticmethod
+    def _key(mprows):
+        """Return the key and the modification stamp for a file"""
+
+        fs, path = mprows._fs, mprows.path
+
+        if fs.hassyspath(path):
+            key = ('sys', fs.getsyspath(path))
+        elif fs.haspathurl(path):
+            key = ('url', fs.getpathurl(path))
+        else:
+            key = (fs, path)
+
+        info = fs.getinfo(path)
+
+        return key, (info.get('modified_time'), info.get('size'))
+
+    def reader(self, mprows):
+        """Return an MPRReader for an MPRowsFile, using the cached metadata and an idle file handle if the
+        file hasn't changed since they were cached. Closing the reader returns its file handle to the pool. """
+        from .mpf import MPRReader
+
+        key, stamp = self._key(mprows)
+
+        with self._lock:
+            entry = self._entries.pop(key, None)
+
+            if entry is not None and entry.stamp != stamp:
+                self._discard(entry)
+                entry = None
+
+            if entry is None or entry.meta is None:
+                self.misses += 1
+                entry = entry or _Entry(stamp)
+            else:
+                self.hits += 1
+
+            self._entries[key] = entry  # Now the most recently used
+
+            fh = None
+            if entry.handles:
+                fh = entry.handles.pop()
+                self._n_handles -= 1
+                self.handle_hits += 1
+
+            self._evict()
+
+        if fh is None:
+            fh = mprows._fs.open(mprows.path, mode='rb')
+        else:
+            fh.seek(0)
+
+        r = MPRReader(mprows, mprows._reader_file(_PooledFile(self, key, stamp, fh)), compress=mprows._compress)
+
+        if entry.meta is None:
+            list(r.columns)  # Extends the schema to all of the columns, which the readers can't do once it's shared
+            entry.meta = _freeze(r.meta)
+
+        r._meta = entry.meta
+
+        return r
+
+    def meta(self, mprows):
+        """Return the metadata of a file, from the cache if possible """
+
+        with self.reader(mprows) as r:
+            return r.meta
+
+    def _release(self, key, stamp, fh):
+        """Return an idle file handle to the pool, or close it if its file changed or the pool is full"""
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None and entry.stamp == stamp and self._n_handles < self.handles:
+                entry.handles.append(fh)
+                self._n_handles += 1
+                return
+
+        fh.close()
+
+    def _discard(self, entry):
+        for fh in entry.handles:
+            fh.close()
+
+        self._n_handles -= len(entry.handles)
+        entry.handles = []
+        self.evictions += 1
+
+    def _evict(self):
+        while len(self._entries) > self.size:
+            _, entry = self._entries.popitem(last=False)
+            self._discard(entry)
+
+    def clear(self):
+        """Close all of the idle file handles and discard all of the entries """
+
+        with self._lock:
+            for entry in self._entries.values():
+                self._discard(entry)
+
+            self._entries.clear()
+
+    @property
+    def stats(self):
+        """Return a dict of the hit, miss and eviction counts and the size of the pool"""
+
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses, handle_hits=self.handle_hits,
+                        evictions=self.evictions, entries=len(self._entries), idle_handles=self._n_handles)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+default_pool = MPRPool()  # The pool shared by the warehouse modules
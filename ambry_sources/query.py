@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+
+Compiled queries over positional rows. A query's predicate expression and projection are compiled once into a
+function that works directly on row tuples, rather than building a RowProxy or dict for each row.
+
+Copyright (c) 2015 Civic Knowledge. This file is licensed under the terms of the
+Revised BSD License, included in this distribution as LICENSE.txt
+"""
+
+import keyword
+import tokenize
+
+from six import StringIO, string_types
+from six.moves import builtins
+
+
+class QueryError(Exception):
+    pass
+
+
+# Builtins that may be used in a where expression, in addition to the column names.
+ALLOWED_BUILTINS = ('abs', 'bool', 'float', 'int', 'len', 'max', 'min', 'round', 'str', 'tuple',
+                    'True', 'False', 'None')
+
+
+class Query(object):
+    """A compiled query, with a where expression and a list of columns to return.
+
+    The where expression is a Python expression, in which the column names are variables:
+
+    >>> q = Query(['county', 'year', 'x'], where="year >= 2010 and county == '06073'", columns=['x'])
+    >>> for row in q.run(rows):
+    >>>     print row  # (x,)
+
+    """
+
+    def __init__(self, headers, where=None, columns=None):
+        """
+
+        Args:
+            headers (list of str): names of the columns of the rows that will be queried.
+            where (str, optional): a Python expression using column names. Rows for which it
+                evaluates to true are returned.
+            columns (list of str, optional): names of the columns to return, in order. All columns are returned
+                if not defined.
+
+        """
+        self.headers = list(headers)
+
+        if isinstance(columns, string_types):
+            columns = [columns]
+
+        self.columns = list(columns) if columns else list(self.headers)
+        self.where = where
+
+        self._pos = {name: i for i, name in enumerate(self.headers)}
+
+        for name in self.columns:
+            if name not in self._pos:
+                raise QueryError("Column '{}' not in headers {}".format(name, self.headers))
+
+        self._func, self.code = self.build()
+
+    def compile_expression(self, expr):
+        """Convert an expression that uses column names to one that uses positions in the row tuple. """
+
+        tokens = []
+        prev = None
+
+        try:
+            for tok in tokenize.generate_tokens(StringIO(expr).readline):
+                tok_type, tok_string = tok[0], tok[1]
+
+                if tok_type == tokenize.NAME and prev == '.':
+                    # Private and special attributes lead out of the restricted builtins, to any object.
+                    if tok_string.startswith('_'):
+                        raise QueryError("Attribute '{}' in where expression '{}' is not allowed; attributes "
+                                         "can't start with '_'".format(tok_string, expr))
+                    tokens.append((tok_type, tok_string))
+
+                elif tok_type == tokenize.NAME and not keyword.iskeyword(tok_string):
+                    if tok_string in self._pos:
+                        tokens.extend([(tokenize.NAME, 'row'), (tokenize.OP, '['),
+                                       (tokenize.NUMBER, str(self._pos[tok_string])), (tokenize.OP, ']')])
+                    elif tok_string in ALLOWED_BUILTINS:
+                        tokens.append((tok_type, tok_string))
+                    else:
+                        raise QueryError("Unknown name '{}' in where expression '{}'; must be one of the "
+                                         "columns {}".format(tok_string, expr, self.headers))
+                else:
+                    tokens.append((tok_type, tok_string))
+
+                prev = tok_string
+
+        except tokenize.TokenError as e:
+            raise QueryError("Failed to parse where expression '{}': {}".format(expr, e))
+
+        return tokenize.untokenize(tokens).strip()
+
+    def build(self):
+        """Generate a function that selects and projects rows from an iterator of rows """
+
+        if self.columns == self.headers:
+            projection = 'tuple(row)'
+        else:
+            projection = '({},)'.format(', '.join('row[{}]'.format(self._pos[name]) for name in self.columns))
+
+        if self.where:
+            code = 'def _query(rows):\n' \
+                   '    for row in rows:\n' \
+                   '        if {}:\n' \
+                   '            yield {}\n'.format(self.compile_expression(self.where), projection)
+        else:
+            code = 'def _query(rows):\n' \
+                   '    for row in rows:\n' \
+                   '        yield {}\n'.format(projection)
+
+        namespace = {'__builtins__': {name: getattr(builtins, name) for name in ALLOWED_BUILTINS
+                                      if hasattr(builtins, name)}}
+
+        try:
+            exec(code, namespace)
+        except SyntaxError as e:
+            raise QueryError("Failed to compile where expression '{}': {}".format(self.where, e))
+
+        return namespace['_query'], code
+
+    def run(self, rows):
+        """Generate the selected and projected rows, as tuples, from an iterator of positional rows"""
+
+        return self._func(rows)
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+
+Read files on web servers with HTTP range requests, so that the header and metadata of a remote MPR file, or
+its first rows, can be read without downloading the whole file.
+
+>>> f = MPRowsFile('http://library.example.com/partitions/foobar.mpr')
+>>> print f.reader.meta['about']
+>>> print head(f.reader.rows, 10)
+
+Copyright (c) 2015 Civic Knowledge. This file is licensed under the terms of the
+Revised BSD License, included in this distribution as LICENSE.txt
+"""
+
+import re
+
+from fs.base import FS
+from fs.errors import ResourceNotFoundError, UnsupportedError
+from six.moves.urllib.parse import urljoin
+
+_CONTENT_RANGE = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+|\*)')
+
+
+class HTTPRangeFile(object):
+    """ A read-only, seekable file object for a URL, which reads with HTTP range requests.
+
+    Each request fetches at least block_size bytes from the current position, and the last block is cached, so
+    the many small reads of the unpacker and gzip turn into a few requests. If the server ignores the Range
+    header and returns the whole file, the whole file is cached.
+    """
+
+    BLOCK_SIZE = 256 * 1024  # Minimum number of bytes to request at a time
+
+    def __init__(self, url, block_size=None, session=None):
+        """
+
+        :param url: URL of the file
+        :param block_size: Minimum number of bytes to request at a time
+        :param session: A requests Session, to reuse connections across files
+        """
+        import requests
+
+        self.url = url
+        self.block_size = block_size or self.BLOCK_SIZE
+        self._session = session or requests.Session()
+        self._own_session = session is None
+
+        self._pos = 0
+        self._block = b''
+        self._block_start = 0
+        self._size = None
+
+        self.n_requests = 0  # Number of requests and bytes received, for monitoring
+        self.n_bytes = 0
+
+    @property
+    def size(self):
+        """Length of the file, from the Content-Range of a previous request, or a HEAD request"""
+
+        if self._size is None:
+            r = self._session.head(self.url, allow_redirects=True)
+            self.n_requests += 1
+            self._check(r)
+            self._size = int(r.headers['Content-Length'])
+
+        return self._size
+
+    def _check(self, r):
+        if r.status_code == 404:
+            raise ResourceNotFoundError(self.url)
+        r.raise_for_status()
+
+    def _fetch(self, start, end=None):
+        """Fetch the bytes from start to end, inclusive, or to the end of the file, into the block cache"""
+
+        byte_range = 'bytes={}-{}'.format(start, end if end is not None else '')
+
+        r = self._session.get(self.url, headers={'Range': byte_range})
+        self.n_requests += 1
+
+        if r.status_code == 416:  # Requested Range Not Satisfiable; past the end of the file
+            self._block_start, self._block = start, b''
+            return
+
+        self._check(r)
+
+        self.n_bytes += len(r.content)
+
+        if r.status_code == 206:
+            m = _CONTENT_RANGE.match(r.headers.get('Content-Range', ''))
+            if m and m.group(3) != '*':
+                self._size = int(m.group(3))
+
+            self._block_start, self._block = start, r.content
+
+        else:
+            # The server doesn't support ranges, and returned the whole file.
+            self._size = len(r.content)
+            self._block_start, self._block = 0, r.content
+
+    def read(self, size=-1):
+
+        parts = []
+
+        while size is None or size < 0 or size > 0:
+
+            offset = self._pos - self._block_start
+
+            if 0 <= offset < len(self._block):
+                end = len(self._block) if size is None or size < 0 else offset + size
+                part = self._block[offset:end]
+                parts.append(part)
+                self._pos += len(part)
+
+                if size is not None and size >= 0:
+                    size -= len(part)
+
+                continue
+
+            if self._size is not None and self._pos >= self._size:
+                break
+
+            if size is None or size < 0:
+                self._fetch(self._pos)
+            else:
+                self._fetch(self._pos, self._pos + max(size, self.block_size) - 1)
+
+            if not (0 <= self._pos - self._block_start < len(self._block)):
+                break  # Nothing more was returned
+
+        return b''.join(parts)
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset = self._pos + offset
+        elif whence == 2:
+            offset = self.size + offset
+
+        self._pos = offset
+
+    def close(self):
+        self._block = b''
+
+        if self._own_session:
+            self._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class HTTPRangeFS(FS):
+    """ A minimal, read-only pyfilesystem for the files below a base URL, which are opened as HTTPRangeFile
+    objects. It doesn't support listing directories. """
+
+    def __init__(self, base_url, block_size=None):
+        import requests
+
+        super(HTTPRangeFS, self).__init__(thread_synchronize=False)
+
+        self.base_url = base_url if base_url.endswith('/') else base_url + '/'
+        self.block_size = block_size
+        self._session = requests.Session()
+
+    def __str__(self):
+        return '<HTTPRangeFS: {}>'.format(self.base_url)
+
+    def getpathurl(self, path, allow_none=False):
+        return urljoin(self.base_url, path.lstrip('/'))
+
+    def open(self, path, mode='r', **kwargs):
+        if set(mode) - set('rbt'):
+            raise UnsupportedError('write to an HTTP file', path)
+
+        return HTTPRangeFile(self.getpathurl(path), block_size=self.block_size, session=self._session)
+
+    def getinfo(self, path):
+        r = self._session.head(self.getpathurl(path), allow_redirects=True)
+
+        if r.status_code == 404:
+            raise ResourceNotFoundError(path)
+        r.raise_for_status()
+
+        return {'size': int(r.headers.get('Content-Length', 0))}
+
+    def exists(self, path):
+        try:
+            self.getinfo(path)
+            return True
+        except ResourceNotFoundError:
+            return False
+
+    def isfile(self, path):
+        return self.exists(path)
+
+    def isdir(self, path):
+        return False
+
+    def listdir(self, *args, **kwargs):
+        raise UnsupportedError('list an HTTP directory')
+
+    def close(self):
+        self._session.close()
+        super(HTTPRangeFS, self).close()
@@ -5,13 +5,14 @@ from .accessors import CsvSource, TsvSource, FixedSource, PartitionSource, Excel
     SocrataSource
 from .exceptions import SourceError
 from .spec import ColumnSpec, SourceSpec
-from .util import DelayedOpen, DelayedDownload, RowProxy, GeoRowProxy
+from .util import DelayedOpen, DelayedDownload, RowProxy, GeoRowProxy, RowRecord, GeoRowRecord, row_class
 
 __all__ = [
     SourceError, ColumnSpec, SourceSpec,
     CsvSource, TsvSource, FixedSource, PartitionSource,
     ExcelSource, GoogleSource, AspwCursorSource, SocrataSource,
-    DelayedOpen, DelayedDownload, RowProxy, GeoRowProxy, GeneratorSource]
+    DelayedOpen, DelayedDownload, RowProxy, GeoRowProxy, RowRecord, GeoRowRecord, row_class,
+    GeneratorSource]
 
 try:
     # Only if the underlying fiona and shapely libraries are installed with the [geo] extra
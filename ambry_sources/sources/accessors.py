@@ -7,7 +7,7 @@ import petl
 
 import six
 
-from ambry_sources.util import copy_file_or_flo
+from ambry_sources.util import copy_file_or_flo, iter_batches
 
 from .exceptions import SourceError
 
@@ -65,6 +65,10 @@ class Source(object):
 
         self.finish()
 
+    def iter_batches(self, size=1000):
+        """Iterate over the rows of the source in lists of up to size rows"""
+        return iter_batches(iter(self), size)
+
     def _get_row_gen(self):
         """ Returns generator over all rows of the source. """
         raise NotImplementedError('Subclasses of SourceFile must provide a _get_row_gen() method')
@@ -354,6 +358,29 @@ class MPRSource(Source):
 
         self.finish()
 
+    def iter_batches(self, size=1000):
+        """Iterate over the lines in the file in lists of rows. Without a predicate or headers, the batches
+        come directly from the datafile reader. """
+
+        if self.predicate is not None or self.return_headers is not None:
+            for batch in super(MPRSource, self).iter_batches(size):
+                yield batch
+            return
+
+        self.start()
+
+        with self.datafile.reader as r:
+            headers = list(r.headers)
+
+            for batch in r.iter_batches(size):
+                if headers:
+                    batch = [headers] + batch
+                    headers = None
+
+                yield batch
+
+        self.finish()
+
 
 class CsvSource(SourceFile):
     """Generate rows from a CSV source"""
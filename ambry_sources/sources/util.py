@@ -4,6 +4,11 @@ Copyright (c) 2015 Civic Knowledge. This file is licensed under the terms of the
 Revised BSD License, included in this distribution as LICENSE.txt
 """
 
+from collections import OrderedDict
+import threading
+
+from six import string_types
+
 
 class DelayedOpen(object):
     """A Lightweight wrapper to delay opening a PyFilesystem object until is it used. It is needed because
@@ -187,11 +192,20 @@ class RowProxy(object):
 
 class GeoRowProxy(RowProxy):
 
+    def __init__(self, keys):
+        self.__shape = (None, None)  # (WKT, parsed geometry) of the last row, so each row is parsed once
+        super(GeoRowProxy, self).__init__(keys)
+
     @property
     def __geo_interface__(self):
         from shapely.wkt import loads
 
-        g = loads(self.geometry)
+        wkt, g = object.__getattribute__(self, '_GeoRowProxy__shape')
+
+        if wkt is not self.geometry:
+            g = loads(self.geometry)
+            object.__setattr__(self, '_GeoRowProxy__shape', (self.geometry, g))
+
         gi = g.__geo_interface__
 
         d = dict(self)
@@ -200,3 +214,205 @@ class GeoRowProxy(RowProxy):
         gi['properties'] = d
 
         return gi
+
+
+class RowRecord(object):
+    """
+    Base class for the row types generated by row_class(). Each column is stored in a slot, so attribute access is
+    a slot lookup, rather than the dict lookups of RowProxy.__getattr__. Values can also be accessed by position
+    or by column name. Unlike RowProxy, records are not reused, so they can be collected into a list, and iterating
+    a record generates its values, not its keys.
+
+    >>> Row = row_class(['a', 'b', 'c'])
+    >>> r = Row([1, 2, 3])
+    >>> print r.b, r['b'], r[1], r.dict
+
+    """
+
+    __slots__ = ()
+
+    headers = ()
+    _slot_names = ()  # Slot name for each position
+    _pos = {}  # Map from column name to slot name
+    _getters = {}  # Map from column name and position to an attrgetter for the slot
+
+    def _slot(self, key):
+        if isinstance(key, string_types):
+            try:
+                return self._pos[key]
+            except KeyError:
+                raise KeyError("Failed to find key '{}'; has {}".format(key, self.headers))
+        else:
+            return self._slot_names[key]
+
+    @property
+    def row(self):
+        """The values, as a tuple. Generated by row_class() """
+        return ()
+
+    def __getitem__(self, key):
+        try:
+            return self._getters[key](self)
+        except KeyError:
+            if isinstance(key, string_types):
+                raise KeyError("Failed to find key '{}'; has {}".format(key, self.headers))
+            raise IndexError("Failed to get value for integer key '{}' ".format(key))
+        except TypeError:  # Slices aren't hashable
+            return self.row[key]
+
+    def __setitem__(self, key, value):
+        setattr(self, self._slot(key), value)
+
+    def __iter__(self):
+        return iter(self.row)
+
+    def __len__(self):
+        return len(self.headers)
+
+    def __eq__(self, other):
+        return isinstance(other, RowRecord) and self.headers == other.headers and self.row == other.row
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    @property
+    def dict(self):
+        return dict(zip(self.headers, self.row))
+
+    def copy(self):
+        return type(self)(self.row)
+
+    def keys(self):
+        return list(self.headers)
+
+    def values(self):
+        return list(self.row)
+
+    def items(self):
+        return list(zip(self.headers, self.row))
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, self.dict)
+
+
+class GeoRowRecord(RowRecord):
+    """A RowRecord for rows with a WKT geometry column, which holds the parsed geometry after the first access. """
+
+    __slots__ = ('_shape',)
+
+    @property
+    def __geo_interface__(self):
+        from shapely.wkt import loads
+
+        wkt, g = getattr(self, '_shape', (None, None))
+
+        if wkt is not self['geometry']:
+            g = loads(self['geometry'])
+            self._shape = (self['geometry'], g)
+
+        gi = g.__geo_interface__
+
+        d = self.dict
+        del d['geometry']
+
+        gi['properties'] = d
+
+        return gi
+
+
+ROW_CLASSES = 128  # Maximum number of cached row classes
+_row_classes = OrderedDict()  # From least to most recently used
+_row_classes_lock = threading.Lock()
+
+# Names that are valid identifiers, but can't be assigned as attributes in Python 2 or 3
+_RESERVED_NAMES = ('None', 'True', 'False', 'print', 'exec', 'nonlocal', 'async', 'await')
+
+
+def _fit_row(row, n):
+    """Pad or truncate a row to n values """
+    row = list(row)[:n]
+    return row + [None] * (n - len(row))
+
+
+def row_class(headers):
+    """
+    Return a RowRecord subclass for a set of headers, with a slot for each column. The slot has the column name,
+    so it is an attribute of the record, unless the name is not a valid identifier or conflicts with a
+    RowRecord attribute, in which case it is only available by column name or position. The classes of the
+    ROW_CLASSES most recently used sets of headers are cached, so readers with the same headers share one class.
+    If the headers include 'geometry', the class is a GeoRowRecord.
+
+    :param headers: list of column names
+    :return: a RowRecord subclass, which is constructed from a list or tuple of row values.
+    """
+    import keyword
+    from operator import attrgetter
+    import re
+
+    headers = tuple(headers)
+
+    with _row_classes_lock:
+        cls = _row_classes.pop(headers, None)
+        if cls is not None:
+            _row_classes[headers] = cls  # Now the most recently used
+            return cls
+
+    if not headers:
+        raise ValueError("Can't create a row class without headers")
+
+    base = GeoRowRecord if 'geometry' in headers else RowRecord
+
+    slot_names = []
+    pos = {}
+
+    for i, name in enumerate(headers):
+        try:
+            slot_name = str(name)
+        except UnicodeEncodeError:
+            slot_name = ''  # Python 2 attribute names must be ASCII
+
+        if (not re.match(r'^[A-Za-z][A-Za-z0-9_]*$', slot_name) or keyword.iskeyword(slot_name) or
+                slot_name in _RESERVED_NAMES or hasattr(base, slot_name) or slot_name in slot_names):
+            slot_name = '_{}'.format(i)
+
+        slot_names.append(slot_name)
+        pos[name] = slot_name
+
+    fields = ', '.join('self.{}'.format(e) for e in slot_names)
+
+    code = 'def __init__(self, row):\n' \
+           '    try:\n' \
+           '        {fields}, = row\n' \
+           '    except ValueError:\n' \
+           '        {fields}, = _fit_row(row, {n})\n' \
+           'row = property(lambda self: ({fields},))\n'.format(fields=fields, n=len(slot_names))
+
+    namespace = {'_fit_row': _fit_row}
+    exec(code, namespace)
+
+    attrs = {
+        '__slots__': tuple(slot_names),
+        'headers': headers,
+        '_slot_names': tuple(slot_names),
+        '_pos': pos,
+        '__init__': namespace['__init__'],
+        'row': namespace['row']
+    }
+
+    getters = {name: attrgetter(slot_name) for name, slot_name in pos.items()}
+    for i, slot_name in enumerate(slot_names):
+        getters[i] = getters[i - len(slot_names)] = attrgetter(slot_name)
+
+    attrs['_getters'] = getters
+
+    cls = type(str('Row'), (base,), attrs)
+
+    with _row_classes_lock:
+        _row_classes[headers] = cls
+
+        while len(_row_classes) > ROW_CLASSES:
+            _row_classes.popitem(last=False)
+
+    return cls
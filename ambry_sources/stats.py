@@ -370,7 +370,7 @@ class Stats(object):
         return [(name, self._stats[name]) for name, stat in iteritems(self._stats)]
 
     def run(self, source, sample_from=None):
-        """ Run the stats. The source must yield Row proxies.
+        """ Run the stats. The source must yield RowProxy or RowRecord objects.
 
         :param source:
         :param sample_from: If not None, an integer giving the total number of rows. The
@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+"""
+
+Deterministic generators of synthetic source files, for tests and performance work that need realistic inputs
+larger than the fixtures: CSV files with comment and header preambles and footers, fixed width files, Excel
+sheets, mixed types, dates in several formats and columns with skewed cardinalities.
+
+Files are written to any pyfilesystem a row at a time, so they can be as large as the filesystem allows. The same
+spec, number of rows and seed always produce the same file.
+
+>>> spec = generate('preamble', 1000000, seed=1, fs=fs, path='preamble.csv')
+>>> s = open_source(spec, fs, 'preamble.csv')
+>>> f = MPRowsFile(fs, 'preamble').load_rows(s)
+
+The returned SourceSpec has the header lines, data start line and end line of the generated file, so tests can
+compare them to what the RowIntuiter finds, and the spec's ``types`` dict has the name of the type the
+TypeIntuiter should find for each column, as in the columns' ``resolved_type``. write() writes other rows, such
+as the benchmark datasets, in the same layouts.
+
+Copyright (c) 2015 Civic Knowledge. This file is licensed under the terms of the
+Revised BSD License, included in this distribution as LICENSE.txt
+"""
+
+import datetime
+import random
+
+import six
+
+from .sources.spec import ColumnSpec, SourceSpec
+
+EXCEL_MAX_ROWS = 1048576  # Rows in an xlsx sheet
+
+WORDS = ('alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel', 'india', 'juliet', 'kilo',
+         'lima', 'mike', 'november', 'oscar', 'papa', 'quebec', 'romeo', 'sierra', 'tango', 'uniform', 'victor',
+         'whiskey', 'xray', 'yankee', 'zulu')
+
+EPOCH = datetime.datetime(1990, 1, 1)
+SPAN = 30 * 365 * 86400  # Seconds in the range of generated dates
+
+# Default options for each kind of column. The width is the width of the column in fixed width files, and the
+# type is the name of the type the TypeIntuiter finds for the column.
+KINDS = {
+    'id': dict(width=12, type='int'),  # Sequential integers; unique
+    'int': dict(width=12, type='int', low=-1000000, high=1000000),
+    'float': dict(width=16, type='float', sigma=1000.0),
+    'code': dict(width=8, type='str', cardinality=1000, alpha=1.2),  # Skewed categorical
+    'str': dict(width=40, type='str', max_words=4),  # Free text
+    'mixed': dict(width=12, type='int', rate=0.01),  # Mostly ints, with a few string codes
+    'date': dict(width=20, type='date', format='%Y-%m-%d'),
+    'datetime': dict(width=20, type='datetime', format='%Y-%m-%dT%H:%M:%S'),
+    'time': dict(width=10, type='time', format='%H:%M:%S'),
+}
+
+DEFAULT_COLUMNS = (
+    ('id', 'id'),
+    ('count', 'int'),
+    ('amount', 'float'),
+    ('code', 'code'),
+    ('name', 'str'),
+    ('iso_date', 'date'),
+    ('us_date', 'date', dict(format='%m/%d/%Y')),
+    ('timestamp', 'datetime'),
+)
+
+# Named specs, which can be passed to generate() by name, or used as the base of a dict spec with a 'layout' key
+LAYOUTS = {
+    'csv': dict(format='csv'),
+    'preamble': dict(format='csv', comment_rows=3, header_rows=2, footer_rows=2),
+    'tsv': dict(format='tsv', comment_rows=1),
+    'fixed': dict(format='fixed', header_rows=0),
+    'xlsx': dict(format='xlsx', comment_rows=2, footer_rows=1),
+    'mixed': dict(format='csv', columns=(
+        ('id', 'id'),
+        ('value', 'mixed'),
+        ('state', 'code', dict(cardinality=50, alpha=1.5)),
+        ('zip', 'code', dict(cardinality=40000, alpha=1.05)),
+        ('slash_date', 'date', dict(format='%Y/%m/%d')),
+        ('dt', 'datetime', dict(format='%Y-%m-%d %H:%M:%S')),
+        ('tm', 'time'),
+        ('note', 'str', dict(max_words=12)))),
+}
+
+DEFAULTS = dict(
+    format='csv',
+    columns=DEFAULT_COLUMNS,
+    comment_rows=0,  # Single-cell lines before the headers
+    header_rows=1,  # Header lines. With more than one, the first lines have labels for groups of columns.
+    footer_rows=0,  # Single-cell lines after the data
+    null_rate=0.0,  # Fraction of values that are empty
+    encoding='utf8',
+)
+
+
+def _resolve(spec):
+    """Return a complete spec dict from a layout name or a dict"""
+
+    spec = dict(layout=spec) if isinstance(spec, six.string_types) else dict(spec)
+
+    d = dict(DEFAULTS)
+
+    if 'layout' in spec:
+        try:
+            d.update(LAYOUTS[spec.pop('layout')])
+        except KeyError as e:
+            raise ValueError('Unknown layout {}'.format(e))
+
+    d.update(spec)
+
+    if d['format'] not in ('csv', 'tsv', 'fixed', 'xlsx'):
+        raise ValueError("Unknown format '{}'".format(d['format']))
+
+    if d['format'] == 'fixed' and (d['comment_rows'] or d['header_rows'] or d['footer_rows']):
+        raise ValueError('Fixed width files have no preamble, headers or footer')
+
+    columns = []
+    for c in d['columns']:
+        name, kind = c[0], c[1]
+
+        if kind not in KINDS:
+            raise ValueError("Unknown column kind '{}' for column '{}'".format(kind, name))
+
+        opts = dict(KINDS[kind])
+        if len(c) > 2:
+            opts.update(c[2])
+
+        columns.append((name, kind, opts))
+
+    d['columns'] = columns
+
+    return d
+
+
+def _value_gen(rand, kind, opts):
+    """Return a function that generates the values of a column, as Python types """
+
+    if kind == 'id':
+        return lambda row_num: row_num + 1
+
+    elif kind == 'int':
+        low, high = opts['low'], opts['high']
+        return lambda row_num: rand.randint(low, high)
+
+    elif kind == 'float':
+        sigma = opts['sigma']
+        return lambda row_num: round(rand.gauss(0, sigma), 3)
+
+    elif kind == 'code':
+        # A Zipf-like distribution: a few codes are very common and most are rare
+        cardinality, alpha = opts['cardinality'], opts['alpha']
+        return lambda row_num: 'C{:05d}'.format(min(int(rand.paretovariate(alpha)), cardinality) - 1)
+
+    elif kind == 'str':
+        max_words = opts['max_words']
+        return lambda row_num: ' '.join(rand.choice(WORDS) for _ in range(rand.randint(1, max_words))).title()
+
+    elif kind == 'mixed':
+        rate = opts['rate']
+        return lambda row_num: rand.choice(('n/a', 'pending', '-')) if rand.random() < rate \
+            else str(rand.randint(0, 1000))
+
+    elif kind == 'date':
+        return lambda row_num: (EPOCH + datetime.timedelta(seconds=rand.randint(0, SPAN))).date()
+
+    elif kind == 'datetime':
+        return lambda row_num: EPOCH + datetime.timedelta(seconds=rand.randint(0, SPAN))
+
+    elif kind == 'time':
+        # Avoid midnight, which the intuiter can't tell from a date
+        return lambda row_num: datetime.time(rand.randint(1, 23), rand.randint(0, 59), rand.randint(0, 59))
+
+
+def rows(spec, n_rows, seed=0):
+    """Generate the data rows for a spec, as lists of Python values, with None for empty values.
+
+    :param spec: A layout name, or a spec dict
+    :param n_rows: Number of rows to generate
+    :param seed: Seed for the random number generator
+    :return: A generator of rows
+    """
+
+    spec = _resolve(spec)
+
+    rand = random.Random(seed)
+
+    gens = [_value_gen(rand, kind, opts) for name, kind, opts in spec['columns']]
+
+    null_rate = spec['null_rate']
+
+    for row_num in six.moves.range(n_rows):
+        if null_rate:
+            yield [g(row_num) if rand.random() >= null_rate else None for g in gens]
+        else:
+            yield [g(row_num) for g in gens]
+
+
+def _formatters(spec):
+    """Return a function to convert a row of values to the strings of the file"""
+
+    def fmt(kind, opts):
+        if kind in ('date', 'datetime', 'time'):
+            f = opts['format']
+            return lambda v: v.strftime(f) if v is not None else ''
+        elif kind == 'float':
+            return lambda v: repr(v) if v is not None else ''
+        else:
+            return lambda v: six.text_type(v) if v is not None else ''
+
+    fmts = [fmt(kind, opts) for name, kind, opts in spec['columns']]
+
+    return lambda row: [f(v) for f, v in zip(fmts, row)]
+
+
+def _preamble(spec, n_rows, seed):
+    """Return the comment, header and footer rows"""
+
+    names = [name for name, kind, opts in spec['columns']]
+    n_cols = len(names)
+
+    def pad(text):
+        # Comments fill the first cell of a full width row, the way spreadsheets export them
+        return [text] + [''] * (n_cols - 1)
+
+    comments = [pad('Synthetic dataset, generated by ambry_sources.testing'),
+                pad('Seed {}, {} rows'.format(seed, n_rows))]
+    comments += [pad('Comment line {}'.format(i)) for i in range(len(comments), spec['comment_rows'])]
+
+    headers = []
+    for i in range(spec['header_rows'] - 1):
+        # Labels for pairs of columns, which the RowIntuiter will coalesce with the column names
+        headers.append(['Level {} group {}'.format(i, j // 2) if j % 2 == 0 else '' for j in range(n_cols)])
+
+    if spec['header_rows']:
+        headers.append(names)
+
+    footers = [pad('Total rows: {}'.format(n_rows)), pad('Notes: values are random')]
+    footers += [pad('Footnote {}'.format(i)) for i in range(len(footers), spec['footer_rows'])]
+
+    return comments[:spec['comment_rows']], headers, footers[:spec['footer_rows']]
+
+
+def generate(spec, n_rows, seed=0, fs=None, path=None):
+    """Write a synthetic source file, and return a SourceSpec that describes it
+
+    :param spec: A layout name from LAYOUTS, or a dict with any of the keys of DEFAULTS, and an optional 'layout'
+    key with the name of a layout to start from. Columns are tuples of (name, kind) or (name, kind, options dict),
+    where the kinds and default options are in KINDS.
+    :param n_rows: Number of data rows
+    :param seed: Seed for the random number generator
+    :param fs: A pyfilesystem to write the file to. Defaults to a memory filesystem
+    :param path: The path of the file in the filesystem. Defaults to 'synthetic.<format>'
+    :return: A SourceSpec, with the header, start and end lines of the file, the column positions for fixed
+    width files, and an extra ``types`` attribute with the name of the expected type of each column.
+    """
+
+    return write(spec, rows(spec, n_rows, seed), n_rows, seed=seed, fs=fs, path=path)
+
+
+def write(spec, data, n_rows, seed=0, fs=None, path=None):
+    """Write rows of values to a source file with the layout of a spec, and return a SourceSpec that describes it.
+    generate() writes random rows with this; it can also write other rows, like the benchmark datasets.
+
+    :param spec: A layout name or spec dict, as for generate(). In fixed width files, a column width of None
+    fits the longest value of the column.
+    :param data: An iterable of n_rows rows, with a value for each of the spec's columns, as Python types
+    :param n_rows: Number of rows in data
+    :param seed: The seed of the data, which is noted in the comment rows
+    :param fs: A pyfilesystem to write the file to. Defaults to a memory filesystem
+    :param path: The path of the file in the filesystem. Defaults to 'synthetic.<format>'
+    :return: A SourceSpec, as for generate()
+    """
+
+    spec = _resolve(spec)
+
+    fmt = spec['format']
+
+    if fs is None:
+        from fs.memoryfs import MemoryFS
+        fs = MemoryFS()
+
+    path = path or 'synthetic.{}'.format('txt' if fmt == 'fixed' else fmt)
+
+    comments, headers, footers = _preamble(spec, n_rows, seed)
+
+    if fmt == 'fixed' and any(opts['width'] is None for name, kind, opts in spec['columns']):
+        # Wide enough for the longest value, with a space between columns
+        data = list(data)
+        fmt_row = _formatters(spec)
+
+        for (name, kind, opts), values in zip(spec['columns'], zip(*[fmt_row(row) for row in data])):
+            if opts['width'] is None:
+                opts['width'] = max(len(v) for v in values) + 1
+
+    if fmt == 'xlsx':
+        if len(comments) + len(headers) + n_rows + len(footers) > EXCEL_MAX_ROWS:
+            raise ValueError('Excel sheets can have at most {} rows'.format(EXCEL_MAX_ROWS))
+
+        _write_xlsx(fs, path, spec, comments + headers, data, footers)
+    elif fmt == 'fixed':
+        columns = _write_fixed(fs, path, spec, data)
+    else:
+        _write_csv(fs, path, spec, comments + headers, data, footers)
+
+    n_head = len(comments) + len(headers)
+
+    source_spec = SourceSpec(
+        url='file://{}'.format(fs.getsyspath(path) if fs.hassyspath(path) else path),
+        name=path.replace('/', '_'),
+        filetype=fmt,
+        encoding=spec['encoding'] if fmt != 'xlsx' else None,
+        header_lines=list(range(len(comments), n_head)) if headers else None,
+        start_line=n_head,
+        end_line=n_head + n_rows - 1 if n_rows else None,
+        columns=columns if fmt == 'fixed' else None)
+
+    source_spec.types = {name: opts['type'] for name, kind, opts in spec['columns']}
+
+    return source_spec
+
+
+def open_source(source_spec, fs, path):
+    """Return a source accessor for a file from generate()"""
+    from .sources import CsvSource, TsvSource, FixedSource, ExcelSource
+    from .sources.util import DelayedOpen
+
+    cls = {'csv': CsvSource, 'tsv': TsvSource, 'fixed': FixedSource, 'xlsx': ExcelSource}[source_spec.filetype]
+
+    return cls(source_spec, DelayedOpen(fs, path, 'rb'))
+
+
+def _write_csv(fs, path, spec, head, data, footers):
+
+    delimiter = '\t' if spec['format'] == 'tsv' else ','
+    fmt = _formatters(spec)
+
+    if six.PY3:
+        import csv
+        f = fs.open(path, 'w', encoding=spec['encoding'], newline='')
+        writer = csv.writer(f, delimiter=delimiter)
+    else:
+        import unicodecsv as csv
+        f = fs.open(path, 'wb')
+        writer = csv.writer(f, encoding=spec['encoding'], delimiter=delimiter)
+
+    try:
+        writer.writerows(head)
+
+        for row in data:
+            writer.writerow(fmt(row))
+
+        writer.writerows(footers)
+    finally:
+        f.close()
+
+
+def _write_fixed(fs, path, spec, data):
+    """Write a fixed width file, and return the ColumnSpecs for its columns"""
+
+    fmt = _formatters(spec)
+
+    columns = []
+    start = 1
+    for i, (name, kind, opts) in enumerate(spec['columns']):
+        columns.append(ColumnSpec(name, position=i, start=start, width=opts['width']))
+        start += opts['width']
+
+    widths = [c.width for c in columns]
+
+    # Values are truncated to leave at least one space between columns
+    line_fmt = ''.join('{{:<{w}.{t}}}'.format(w=w, t=w - 1) for w in widths) + '\n'
+
+    with fs.open(path, 'wb') as f:
+        for row in data:
+            f.write(line_fmt.format(*fmt(row)).encode(spec['encoding']))
+
+    return columns
+
+
+def _write_xlsx(fs, path, spec, head, data, footers):
+    """Write an Excel sheet with a streaming writer. Dates and times are written as formatted strings, to
+    keep the formats of the spec. """
+    from openpyxl import Workbook
+
+    fmt = _formatters(spec)
+    kinds = [kind for name, kind, opts in spec['columns']]
+
+    def cells(row):
+        # Numbers stay numbers; everything else is written the way the text formats write it
+        strings = fmt(row)
+        return [v if (v is not None and k in ('id', 'int', 'float')) else (s or None)
+                for v, s, k in zip(row, strings, kinds)]
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+
+    for row in head:
+        ws.append(row)
+
+    for row in data:
+        ws.append(cells(row))
+
+    for row in footers:
+        ws.append(row)
+
+    with fs.open(path, 'wb') as f:
+        wb.save(f)
@@ -2,6 +2,7 @@
 
 import os
 import stat
+import threading
 
 from six import string_types
 from six.moves.urllib.parse import urlparse
@@ -56,6 +57,27 @@ def copy_file_or_flo(input_, output, buffer_size=64 * 1024, cb=None):
             output.close()
 
 
+def iter_batches(source, size):
+    """ Generate lists of rows from a source. Uses the source's iter_batches() method if it has one,
+    otherwise collects the rows from iterating the source into lists of up to size rows. """
+    from itertools import islice
+
+    if hasattr(source, 'iter_batches'):
+        for batch in source.iter_batches(size):
+            yield batch
+        return
+
+    it = iter(source)
+
+    while True:
+        batch = list(islice(it, size))
+
+        if not batch:
+            break
+
+        yield batch
+
+
 def parse_url_to_dict(url):
     """Parse a url and return a dict with keys for all of the parts.
 
@@ -92,3 +114,166 @@ def is_group_readable(filepath):
 
 def get_perm(filepath):
     return stat.S_IMODE(os.lstat(filepath)[stat.ST_MODE])
+
+
+class ReadAheadFile(object):
+    """ A read-only file-like wrapper that reads a file sequentially ahead of the caller on a background thread.
+
+    The thread reads chunks of window bytes into a queue of at most buffers chunks, so a slow or remote file,
+    such as a file on S3, is read with a few large requests rather than many small ones, and the reads overlap
+    with the caller's processing. Seeks within or just ahead of the buffered data are served from the buffers;
+    other seeks restart the thread at the new position.
+    """
+
+    WINDOW = 1024 * 1024  # Size of each read from the underlying file
+    BUFFERS = 4  # Number of chunks to hold ahead of the caller
+
+    def __init__(self, fh, window=None, buffers=None):
+        """
+
+        :param fh: The underlying file object, which must support read(), seek() and tell()
+        :param window: Number of bytes to read from the underlying file at a time
+        :param buffers: Number of chunks to read ahead
+        """
+        self._fh = fh
+        self.window = window or self.WINDOW
+        self.buffers = buffers or self.BUFFERS
+
+        self._pos = fh.tell()
+        self._buf = b''
+        self._buf_start = self._pos
+        self._size = None
+
+        self._thread = None
+        self._queue = None
+        self._stop = None
+        self._eof = False
+
+    def _start(self):
+        from six.moves.queue import Queue
+
+        self._queue = Queue(self.buffers)
+        self._stop = threading.Event()
+        self._buf = b''
+        self._buf_start = self._pos
+        self._eof = False
+
+        self._fh.seek(self._pos)
+
+        self._thread = threading.Thread(target=self._read_ahead, args=(self._queue, self._stop),
+                                        name='ReadAheadFile')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _read_ahead(self, queue, stop):
+        from six.moves.queue import Full
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    queue.put(item, timeout=0.1)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        try:
+            while not stop.is_set():
+                data = self._fh.read(self.window)
+
+                if not put(data) or not data:
+                    break
+
+        except Exception as e:
+            put(e)
+
+    def _halt(self):
+        """Stop the thread, so the underlying file can be used directly"""
+
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            self._queue = None
+
+    def _next_chunk(self):
+        """Replace the buffer with the next chunk from the thread. Returns False at the end of the file. """
+
+        if self._eof:
+            return False
+
+        if self._thread is None:
+            self._start()
+
+        chunk = self._queue.get()
+
+        if isinstance(chunk, Exception):
+            self._halt()
+            raise chunk
+
+        self._buf_start += len(self._buf)
+        self._buf = chunk
+
+        if not chunk:
+            self._eof = True
+            return False
+
+        return True
+
+    def read(self, size=-1):
+
+        parts = []
+
+        if self._thread is None:
+            self._start()
+
+        while size is None or size < 0 or size > 0:
+            offset = self._pos - self._buf_start
+
+            if offset < len(self._buf):
+                end = len(self._buf) if size is None or size < 0 else offset + size
+                part = self._buf[offset:end]
+                parts.append(part)
+                self._pos += len(part)
+
+                if size is not None and size >= 0:
+                    size -= len(part)
+
+            elif not self._next_chunk():
+                break
+
+        return b''.join(parts)
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=0):
+
+        if whence == 1:
+            offset = self._pos + offset
+        elif whence == 2:
+            if self._size is None:
+                self._halt()
+                self._fh.seek(0, 2)
+                self._size = self._fh.tell()
+            offset = self._size + offset
+
+        if self._thread is not None and not \
+                (self._buf_start <= offset <= self._buf_start + len(self._buf) + self.window * self.buffers):
+            # Outside of the buffer and the chunks that are already queued.
+            self._halt()
+
+        self._pos = offset
+
+    def close(self):
+        self._halt()
+        self._fh.close()
+
+    def __getattr__(self, item):
+        return getattr(self._fh, item)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -677,3 +677,387 @@ class BasicTestSuite(TestBase):
         self.assertEqual(
             [u('a_b'), u('b_c'), u('c_d'), u('d_e'), u('e_f'), u('f_g')],
             d['headers'])
+
+    def test_sort(self):
+        """Check that sort() produces the same rows as an in-memory sort, with and without spilling runs"""
+        from ambry_sources.sources import GeneratorSource, SourceSpec
+
+        cache_fs = fsopendir(self.setup_temp_dir())
+
+        N = 2000
+
+        def gen():
+            yield ['id', 'group', 'value']
+
+            for i in range(N):
+                yield [i, (i * 7) % 13, None if i % 11 == 0 else (i * 31) % 97]
+
+        f = MPRowsFile(cache_fs, 'unsorted').load_rows(GeneratorSource(SourceSpec('unsorted'), gen()))
+
+        with f.reader as r:
+            rows = [list(row) for row in r.rows]
+
+        expected = sorted(rows, key=lambda row: (row[1], row[2] is None, row[2], row[0]))
+
+        for dest, memory_limit in (('sorted_in_memory', None), ('sorted_spilled', 10000)):
+            sf = f.sort(['group', 'value', 'id'], dest, memory_limit=memory_limit)
+
+            self.assertEqual(f.headers, sf.headers)
+            self.assertEqual(f.info['data_start_row'], sf.info['data_start_row'])
+            self.assertEqual(f.info['data_end_row'], sf.info['data_end_row'])
+
+            with sf.reader as r:
+                self.assertEqual(expected, [list(row) for row in r.rows])
+
+            self.assertEqual(
+                [c.mean for c in f.reader.columns],
+                [c.mean for c in sf.reader.columns])
+
+    def test_aggregate(self):
+        """Check group-by aggregation in memory, with spilled partial aggregates and in worker processes"""
+        from collections import defaultdict
+        import sys
+        from ambry_sources.aggregate import AggregateError, HashAggregator
+        from ambry_sources.sources import GeneratorSource, SourceSpec
+
+        cache_fs = fsopendir(self.setup_temp_dir())
+
+        N = 3000
+
+        def gen():
+            yield ['county', 'year', 'x']
+
+            for i in range(N):
+                yield ['c{}'.format(i % 37), 2000 + i % 5, None if i % 10 == 0 else i % 101]
+
+        f = MPRowsFile(cache_fs, 'agg').load_rows(GeneratorSource(SourceSpec('agg'), gen()))
+
+        groups = defaultdict(list)
+        with f.reader as r:
+            for county, year, x in r.rows:
+                groups[(county, year)].append(x)
+
+        expected = []
+        for k, values in groups.items():
+            values = [v for v in values if v is not None]
+            expected.append(k + (len(values), max(values), float(sum(values)) / len(values),
+                                 min(values), sum(values), len(set(values))))
+
+        expected = sorted(expected)
+
+        aggs = {'x': ['count', 'max', 'mean', 'min', 'sum', 'count_distinct']}
+
+        for kwargs in ({}, {'max_groups': 20}, {'processes': 2}):
+            agg = f.aggregate(['county', 'year'], aggs, **kwargs)
+
+            self.assertEqual(
+                ['county', 'year', 'x_count', 'x_max', 'x_mean', 'x_min', 'x_sum', 'x_count_distinct'],
+                agg.headers)
+            self.assertEqual(N, agg.n_rows)
+            self.assertEqual(expected, sorted(agg), kwargs)
+
+        # The spill files are removed after the results are generated, so they can't be generated again.
+        agg = f.aggregate(['county', 'year'], aggs, max_groups=20)
+        self.assertEqual(expected, sorted(agg))
+
+        with self.assertRaises(AggregateError):
+            list(agg)
+
+        # More batches than the pool holds in flight.
+        with f.reader as r:
+            agg = HashAggregator(r.headers, ['county', 'year'], aggs)
+            agg.BATCH_SIZE = 100
+            agg.run(r.rows, processes=2)
+
+        self.assertEqual(N, agg.n_rows)
+        self.assertEqual(expected, sorted(agg))
+
+        # Errors name the aggregate, and keep the traceback of the generated code.
+        agg = HashAggregator(['county', 'x', 'y'], ['county'], {'x': ['count', 'max'], 'y': ['min', 'sum']})
+
+        try:
+            agg.run([('c1', 1, 2), ('c1', 2, 'a')])
+        except TypeError as e:
+            self.assertIn("sum of column 'y'", str(e))
+            tb = sys.exc_info()[2]
+            while tb.tb_next:
+                tb = tb.tb_next
+            self.assertEqual('<aggregate>', tb.tb_frame.f_code.co_filename)
+        else:
+            self.fail('TypeError not raised')
+
+        with self.assertRaises(TypeError) as cm:
+            HashAggregator(['county', 'x'], ['county'], {'x': ['count']}).run([([1], 1)])
+
+        self.assertIn("Failed to group on columns ['county']", str(cm.exception))
+
+    def test_query(self):
+        """Check that query() selects the same rows as select(), and projects columns by position"""
+        from ambry_sources.query import QueryError
+        from ambry_sources.sources import GeneratorSource, SourceSpec
+
+        cache_fs = fsopendir(self.setup_temp_dir())
+
+        def gen():
+            yield ['county', 'year', 'x']
+
+            for i in range(500):
+                yield ['c{}'.format(i % 7), 2000 + i % 15, None if i % 10 == 0 else i % 101]
+
+        f = MPRowsFile(cache_fs, 'query').load_rows(GeneratorSource(SourceSpec('query'), gen()))
+
+        expected = [(row.x, row.county) for row in
+                    f.select(lambda row: row.year >= 2010 and row.county == 'c3' and row.x is not None)]
+
+        self.assertTrue(expected)
+        self.assertEqual(
+            expected,
+            list(f.query("year >= 2010 and county == 'c3' and x is not None", ['x', 'county'])))
+
+        with f.reader as r:
+            rows = [tuple(row) for row in r.rows]
+
+        self.assertEqual(rows, list(f.query()))
+
+        with self.assertRaises(QueryError):
+            list(f.query('foo > 1'))
+
+        self.assertEqual([('c3',)] * 5, list(f.query("county.upper() == 'C3' and year == 2003", ['county'])))
+
+        with self.assertRaises(QueryError):
+            list(f.query('x.__class__.__mro__[-1].__subclasses__()'))
+
+        with self.assertRaises(QueryError):
+            list(f.query('county . _x == 1'))
+
+        with self.assertRaises(QueryError):
+            list(f.query(columns=['county', 'foo']))
+
+    def test_iter_batches(self):
+        """Check that iter_batches() generates the same rows as the rows iterator, in whole blocks or by size"""
+        from ambry_sources.sources import GeneratorSource, SourceSpec, MPRSource
+
+        cache_fs = fsopendir(self.setup_temp_dir())
+
+        def gen():
+            yield ['id', 'name', 'value']
+
+            for i in range(2500):
+                yield [i, 'n{}'.format(i), i * 2.5]
+
+        s = GeneratorSource(SourceSpec('batches'), gen())
+        batches = list(s.iter_batches(1000))
+        self.assertEqual([1000, 1000, 501], [len(b) for b in batches])
+
+        counts = []
+        f = MPRowsFile(cache_fs, 'batches').load_rows(GeneratorSource(SourceSpec('batches'), gen()),
+                                                      callback=counts.append)
+
+        with f.reader as r:
+            rows = list(r.rows)
+
+        self.assertEqual(2500, len(rows))
+
+        # The callback gets the count of each row loaded, including the header row
+        self.assertEqual(list(range(1, 2502)), counts)
+
+        for size in (None, 1, 7, 1000, 5000):
+            batches = list(f.iter_batches(size))
+
+            self.assertTrue(all(isinstance(b, list) for b in batches))
+            self.assertEqual(rows, [row for batch in batches for row in batch])
+
+            if size:
+                self.assertTrue(all(len(b) == size for b in batches[:-1]))
+
+        # Loading from an MPR source copies the file in batches, and limit still loads limit + 1 rows
+        f2 = MPRowsFile(cache_fs, 'batches_copy')
+        del counts[:]
+        f2.load_rows(MPRSource(SourceSpec('batches_copy'), f), limit=1500, callback=counts.append)
+
+        self.assertEqual(list(range(1, 1502)), counts)
+
+        with f2.reader as r:
+            self.assertEqual(['id', 'name', 'value'], r.headers)
+            self.assertEqual(rows[:1500], list(r.rows))
+
+    @unittest.skipIf(six.PY2, 'asyncio requires Python 3.5 or later')
+    def test_aiter_batches(self):
+        """Check that the asynchronous iterators generate the same rows as iter_batches()"""
+        import asyncio
+        import time
+        from ambry_sources.sources import GeneratorSource, SourceSpec
+
+        cache_fs = fsopendir(self.setup_temp_dir())
+
+        def gen():
+            yield ['id', 'name']
+
+            for i in range(2500):
+                yield [i, 'n{}'.format(i)]
+
+        f = MPRowsFile(cache_fs, 'abatches').load_rows(GeneratorSource(SourceSpec('abatches'), gen()))
+
+        rows = [row for batch in f.iter_batches() for row in batch]
+
+        loop = asyncio.new_event_loop()
+
+        def collect(ait):
+            # Drives the iterator without the async syntax, which doesn't compile in Python 2
+            out = []
+            while True:
+                try:
+                    out.append(loop.run_until_complete(ait.__anext__()))
+                except StopAsyncIteration:
+                    return out
+
+        try:
+            batches = collect(f.aiter_batches(size=100, prefetch=3, loop=loop))
+            self.assertEqual(25, len(batches))
+            self.assertEqual(rows, [row for batch in batches for row in batch])
+
+            self.assertEqual(rows, collect(f.aiter_rows(loop=loop)))
+
+            ait = f.aiter_batches(size=10, loop=loop)
+            self.assertEqual(rows[:10], loop.run_until_complete(ait.__anext__()))
+            loop.run_until_complete(ait.aclose())
+            self.assertEqual([], collect(ait))
+
+            # A cancelled read doesn't lose its batch, whether or not the batch had been read.
+            for wait in (0, 0.2):
+                ait = f.aiter_batches(size=10, loop=loop)
+                ait.__anext__().cancel()
+                time.sleep(wait)
+                self.assertEqual(rows[:10], loop.run_until_complete(ait.__anext__()))
+                loop.run_until_complete(ait.aclose())
+
+                ait = f.aiter_rows(loop=loop)
+                ait.__anext__().cancel()
+                time.sleep(wait)
+                self.assertEqual(rows, collect(ait))
+        finally:
+            loop.close()
+
+    def test_iter_records(self):
+        """Check that iter_records() generates distinct records with the same values as the RowProxy iterator"""
+        from ambry_sources.sources import GeneratorSource, SourceSpec, RowRecord
+
+        cache_fs = fsopendir(self.setup_temp_dir())
+
+        def gen():
+            yield ['id', 'name', 'value']
+
+            for i in range(100):
+                yield [i, 'n{}'.format(i), i * 2.5]
+
+        f = MPRowsFile(cache_fs, 'records').load_rows(GeneratorSource(SourceSpec('records'), gen()))
+
+        with f.reader as r:
+            expected = [row.dict for row in r]
+
+        with f.reader as r:
+            records = list(r.iter_records())
+
+        self.assertEqual(100, len(records))
+        self.assertIsInstance(records[0], RowRecord)
+        self.assertEqual(expected, [record.dict for record in records])
+        self.assertEqual((99, 'n99', 247.5), (records[-1].id, records[-1]['name'], records[-1][2]))
+
+    def test_meta_writer(self):
+        """Check that metadata updates don't change the row data or grow the file"""
+        from ambry_sources.mpf import MPRError
+        from ambry_sources.sources import GeneratorSource, SourceSpec
+
+        cache_fs = fsopendir(self.setup_temp_dir())
+
+        def gen():
+            yield ['id', 'name', 'value']
+
+            for i in range(1000):
+                yield [i, 'n{}'.format(i), i * 2.5]
+
+        f = MPRowsFile(cache_fs, 'meta').load_rows(GeneratorSource(SourceSpec('meta'), gen()))
+
+        def data_segment():
+            with f.reader as r:
+                meta_start = r.meta_start
+            with f.open() as fh:
+                return fh.read()[:meta_start]
+
+        def update(i):
+            with f.meta_writer as w:
+                w.column('name').description = 'Name'
+                w.meta['about']['title'] = 'Title {}'.format(i)
+
+        rows = list(f.reader.rows)
+        data = data_segment()
+
+        update(0)
+        size = cache_fs.getsize(f.path)
+
+        for i in range(1, 5):  # The same size of metadata each time
+            update(i)
+
+        self.assertEqual(size, cache_fs.getsize(f.path))
+        self.assertEqual(data, data_segment())
+        self.assertEqual(rows, list(f.reader.rows))
+        self.assertEqual('Title 4', f.meta['about']['title'])
+        with f.reader as r:
+            self.assertEqual('Name', [c for c in r.columns if c.name == 'name'][0].description)
+
+        # Smaller metadata truncates the file
+        with f.meta_writer as w:
+            for c in w.columns:
+                c.description = None
+            w.meta['about']['title'] = None
+
+        self.assertLess(cache_fs.getsize(f.path), size)
+        self.assertEqual(rows, list(f.reader.rows))
+
+        with self.assertRaises(MPRError):
+            with f.meta_writer as w:
+                w.insert_row([1, 'a', 1.0])
+
+        with self.assertRaises(MPRError):
+            MPRowsFile(cache_fs, 'missing').meta_writer
+
+    def test_metrics(self):
+        from ambry_sources.metrics import MetricsCollector
+        from ambry_sources.sources import GeneratorSource, SourceSpec
+
+        cache_fs = fsopendir(self.setup_temp_dir())
+
+        def gen():
+            yield ['id', 'name', 'value']
+
+            for i in range(5000):
+                yield [i, 'name {}'.format(i % 10), i * 2.5]
+
+        events = []
+        metrics = MetricsCollector(lambda e, p: events.append((e, p.name)))
+        f = MPRowsFile(cache_fs, 'metrics', metrics=metrics)
+        f.load_rows(GeneratorSource(SourceSpec('metrics'), gen()), intuit_rows=True)
+
+        phases = [e for e in events if e[0] != 'progress']
+        self.assertEqual(
+            [('start', 'load_rows'), ('start', 'write_rows'), ('end', 'write_rows'),
+             ('start', 'intuit_rows'), ('end', 'intuit_rows'), ('start', 'intuit_type'), ('end', 'intuit_type'),
+             ('start', 'run_stats'), ('end', 'run_stats'), ('end', 'load_rows')],
+            phases)
+
+        # One progress event for each block of rows
+        self.assertEqual(6, events.count(('progress', 'write_rows')))
+
+        summary = metrics.summary()
+        write = summary['write_rows']
+
+        self.assertEqual(5001, write['rows'])
+        with f.reader as r:  # The gzip stream of rows
+            self.assertEqual(r.meta_start - r.data_start, write['bytes_out'])
+        self.assertGreater(write['compression_ratio'], 1)
+        self.assertGreater(write['pack_time'], 0)
+        self.assertGreater(write['rows_per_second'], 0)
+
+        self.assertEqual('load_rows', summary['run_stats']['parent'])
+        self.assertEqual(5001, summary['run_stats']['rows'])
+        self.assertEqual(5001, summary['load_rows']['rows'])
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import sys
+
+from fs.opener import fsopendir
+
+from ambry_sources import bench
+
+from tests import TestBase
+
+
+class BenchTest(TestBase):
+
+    def test_datasets_are_deterministic(self):
+
+        for name in bench.DATASETS:
+            headers, rows = bench.dataset(name, 50, seed=3)
+            self.assertEqual(50, len(rows))
+            self.assertTrue(all(len(row) == len(headers) for row in rows))
+            self.assertEqual(rows, bench.dataset(name, 50, seed=3)[1])
+
+        self.assertNotEqual(bench.dataset('narrow', 50, seed=3)[1], bench.dataset('narrow', 50, seed=4)[1])
+
+    def test_run(self):
+        fs = fsopendir(self.setup_temp_dir())
+
+        seen = []
+
+        results = bench.run(
+            n_rows=300, datasets=['narrow', 'nulls'], repeat=2, fs=fs, callback=seen.append,
+            benchmarks=['mpr_write_block', 'mpr_read_rows', 'mpr_select', 'mpr_query', 'mpr_accessors', 'csv_source',
+                        'fixed_source', 'excel_source', 'type_intuiter', 'stats'])
+
+        results = json.loads(json.dumps(results))
+
+        self.assertEqual(300, results['n_rows'])
+        self.assertEqual(20, len(results['results']))
+        self.assertEqual(seen, results['results'])
+
+        for result in results['results']:
+            self.assertNotIn('skipped', result)
+            self.assertGreater(result['seconds'], 0)
+            self.assertLessEqual(result['seconds'], result['mean_seconds'])
+
+            if result['benchmark'] == 'mpr_accessors':
+                self.assertIn('calls_per_second', result)
+            else:
+                self.assertGreater(result['rows_per_second'], 0)
+
+        with self.assertRaises(ValueError):
+            bench.run(n_rows=10, datasets=['foo'], fs=fs)
+
+    def test_skips_only_unsupported_datasets(self):
+        from ambry_sources import testing
+        fs = fsopendir(self.setup_temp_dir())
+
+        max_rows = testing.EXCEL_MAX_ROWS
+        try:
+            testing.EXCEL_MAX_ROWS = 50
+            results = bench.run(n_rows=100, datasets=['narrow'], benchmarks=['excel_source'], repeat=1, fs=fs)
+        finally:
+            testing.EXCEL_MAX_ROWS = max_rows
+
+        self.assertIn('at most 50 rows', results['results'][0]['skipped'])
+
+        def failing(ctx):
+            """Fails"""
+            def bench_():
+                raise RuntimeError('regression')
+            return bench_
+
+        benchmarks = bench.BENCHMARKS
+        try:
+            bench.BENCHMARKS = benchmarks + [failing]
+            with self.assertRaises(RuntimeError):
+                bench.run(n_rows=10, datasets=['narrow'], benchmarks=['failing'], repeat=1, fs=fs)
+        finally:
+            bench.BENCHMARKS = benchmarks
+
+    def test_ampr_bench(self):
+        from ambry_sources.cli import main
+
+        out = os.path.join(self.setup_temp_dir(), 'bench.json')
+
+        argv = sys.argv
+        try:
+            sys.argv = ['ampr', 'bench', '-n', '100', '-r', '1', '-d', 'strings', '-b', 'mpr_read_batches',
+                        '-o', out]
+            main()
+        finally:
+            sys.argv = argv
+
+        with open(out) as f:
+            results = json.load(f)
+
+        self.assertEqual([('strings', 'mpr_read_batches')],
+                         [(r['dataset'], r['benchmark']) for r in results['results']])
@@ -36,6 +36,27 @@ class Test(TestBase):
         }
         return ret
 
+    def _load_generator(self, cache_fs, gen, path='foobar', metrics=None, **load_kwargs):
+        """ Loads the rows of a generator, which yields the header row first, to a new partition, with the
+        row spec and types intuited from the rows. Returns the partition. """
+        from ambry_sources.sources import GeneratorSource, SourceSpec
+        from ambry_sources import head, tail
+
+        def source():
+            return GeneratorSource(SourceSpec(path), gen())
+
+        f = HDFPartition(cache_fs, path, metrics=metrics)
+
+        ri = RowIntuiter().run(head(source(), 100), tail(source(), 100))
+        ti = TypeIntuiter().process_header(ri.headers).run(source())
+        with f.writer as w:
+            w.set_row_spec(self._row_intuiter_to_dict(ri), ri.headers)
+            w.set_types(ti)
+
+        f.load_rows(source(), **load_kwargs)
+
+        return f
+
     def _get_headers(self, source, spec):
         """ Collects headers from spec and returns them. """
         if spec.header_lines:
@@ -196,6 +217,505 @@ class Test(TestBase):
         self.assertEqual(rows[0], {'a': 0, 'b': 1, 'c': 2, 'd': 3, 'e': 4})
         self.assertEqual(rows[-1], {'a': 9, 'b': 10, 'c': 11, 'd': 12, 'e': 13})
 
+    def test_query(self):
+        cache_fs = fsopendir(self.setup_temp_dir())
+
+        def gen():
+            yield ['a', 'b', 'c']
+
+            for i in range(100):
+                yield [i, None if i % 10 == 0 else i % 7, float(i)]
+
+        f = self._load_generator(cache_fs, gen)
+
+        rows = list(f.query('b is not None and b > 4 and a < 50', ['c', 'a']))
+        self.assertEqual(
+            [(float(i), i) for i in range(50) if i % 10 != 0 and i % 7 > 4],
+            rows)
+
+    def test_where(self):
+        from ambry_sources.query import QueryError
+        cache_fs = fsopendir(self.setup_temp_dir())
+
+        def gen():
+            yield ['a', 'b', 'c', 'd']
+
+            for i in range(100):
+                yield [i, None if i % 10 == 0 else i % 7, None if i % 9 == 0 else float(i),
+                       None if i % 11 == 0 else 'x{}'.format(i % 3)]
+
+        f = self._load_generator(cache_fs, gen)
+
+        rows = list(f.where('(b < 3) & (a < 50)', ['c', 'a']))
+        self.assertEqual(
+            [(None if i % 9 == 0 else float(i), i) for i in range(50) if i % 10 != 0 and i % 7 < 3],
+            rows)
+
+        # None values don't match
+        self.assertEqual(
+            [i for i in range(100) if i % 9 != 0 and i % 3 == 1 and i % 11 != 0 and i < 30],
+            [row[0] for row in f.where('(c < 30.0) & (d == b"x1")')])
+
+        self.assertEqual(
+            [i for i in range(100) if i % 3 != 1 and i % 11 != 0],
+            [row[0] for row in f.where('d != b"x1"')])
+
+        # A comparison with None is neither true nor false, so it doesn't hide the other side of an or ...
+        self.assertEqual(
+            [i for i in range(100) if i < 5 or (i % 10 != 0 and i % 7 > 5)],
+            [row[0] for row in f.where('(a < 5) | (b > 5)')])
+
+        # ... and isn't true when it is negated.
+        self.assertEqual(
+            [i for i in range(100) if i % 10 != 0 and i % 7 <= 5],
+            [row[0] for row in f.where('~(b > 5)')])
+
+        self.assertEqual(
+            [i for i in range(100) if i < 5 or (i % 10 != 0 and i % 7 <= 5 and i % 9 != 0 and i > 90)],
+            [row[0] for row in f.where('(a < 5) | ~((b > 5) | (c <= 90.0))')])
+
+        self.assertEqual([(4,)], list(f.where('sqrt(a) == 5', 'b')))
+
+        with f.reader as r:
+            with self.assertRaises(QueryError):
+                r.where('foo > 3')
+
+            with self.assertRaises(QueryError):
+                r.where('a > 3', ['foo'])
+
+    def test_indexes(self):
+        from ambry_sources.hdf_partitions.core import HDFError, _null_guarded_condition
+        cache_fs = fsopendir(self.setup_temp_dir())
+
+        def gen():
+            yield ['a', 'b', 'c']
+
+            for i in range(1000):
+                yield [i, None if i % 10 == 0 else i % 7, 'x{}'.format(i % 13)]
+
+        f = self._load_generator(cache_fs, gen, indexes=['a'])
+        self.assertEqual(['a'], f.indexes)
+
+        f.create_index('b', kind='light')
+        f.create_index('b', kind='light')  # Already exists
+        self.assertEqual(['a', 'b'], f.indexes)
+
+        with f.reader as r:
+            table = r._h5_file.root.partition.rows
+            self.assertTrue(table.cols.a.index.is_csi)
+            self.assertEqual('light', table.cols.b.index.kind)
+
+            # The null guards don't stop the indexes from being used
+            for condition, names, used in (('(a > 500) & (b == 3)', ['a', 'b'], {'a', 'b'}),
+                                           ('c == b"x3"', ['c'], set())):
+                self.assertEqual(
+                    used,
+                    {name.split('.')[-1] for name in table.will_query_use_indexing(
+                        *_null_guarded_condition(table, condition, names))})
+
+        self.assertEqual(
+            [i for i in range(501, 1000) if i % 10 != 0 and i % 7 == 3],
+            [row[0] for row in f.where('(a > 500) & (b == 3)')])
+
+        with self.assertRaises(HDFError):
+            f.create_index('foo')
+
+    def test_iter_batches(self):
+        cache_fs = fsopendir(self.setup_temp_dir())
+
+        def gen():
+            yield ['a', 'b', 'c']
+
+            for i in range(100):
+                yield [i, None if i % 10 == 0 else i % 7, 'x{}'.format(i)]
+
+        f = self._load_generator(cache_fs, gen)
+
+        batches = list(f.iter_batches(30))
+        self.assertEqual([30, 30, 30, 10], [len(b) for b in batches])
+
+        rows = [row for batch in batches for row in batch]
+        self.assertEqual(
+            [(i, None if i % 10 == 0 else i % 7, 'x{}'.format(i)) for i in range(100)],
+            rows)
+
+    def test_iter_numpy(self):
+        from ambry_sources.hdf_partitions.core import MIN_INT32
+        cache_fs = fsopendir(self.setup_temp_dir())
+
+        def gen():
+            yield ['a', 'b', 'c']
+
+            for i in range(100):
+                yield [i, None if i % 10 == 0 else i % 7, None if i % 5 == 0 else i / 2.0]
+
+        f = self._load_generator(cache_fs, gen)
+
+        with f.reader as r:
+            batches = list(r.iter_numpy(40))
+
+        self.assertEqual([40, 40, 20], [len(b) for b in batches])
+        self.assertEqual(('a', 'b', 'c'), batches[0].dtype.names)
+        self.assertEqual(list(range(40, 80)), batches[1]['a'].tolist())
+        self.assertEqual(MIN_INT32, batches[0]['b'][10])
+
+        expected = [[i, None if i % 10 == 0 else i % 7, None if i % 5 == 0 else i / 2.0] for i in range(100)]
+
+        with f.reader as r:
+            self.assertEqual(expected, list(r.rows))
+
+        self.assertEqual(expected, [row.row for row in f])
+
+    def test_metrics(self):
+        from ambry_sources.metrics import MetricsCollector
+        cache_fs = fsopendir(self.setup_temp_dir())
+
+        def gen():
+            yield ['a', 'b']
+
+            for i in range(100):
+                yield [i, 'x{}'.format(i)]
+
+        events = []
+        f = self._load_generator(
+            cache_fs, gen, metrics=MetricsCollector(lambda e, p: events.append((e, p.name))))
+
+        self.assertEqual(
+            [('start', 'load_rows'), ('start', 'write_rows'), ('progress', 'write_rows'), ('end', 'write_rows'),
+             ('start', 'run_stats'), ('end', 'run_stats'), ('end', 'load_rows')],
+            events)
+
+        summary = f.metrics.summary()
+        self.assertEqual(100, summary['write_rows']['rows'])
+        self.assertGreater(summary['write_rows']['bytes_out'], 0)
+        self.assertEqual('load_rows', summary['run_stats']['parent'])
+        self.assertEqual(100, summary['run_stats']['rows'])
+        self.assertEqual(100, summary['load_rows']['rows'])
+
+    def test_compression(self):
+        cache_fs = fsopendir(self.setup_temp_dir())
+
+        rows = [[i, 'x{}'.format(i % 10), i / 3.0] for i in range(20000)]
+
+        sizes = {}
+
+        for name, kwargs in (('default', {}), ('zlib', dict(complib='zlib', complevel=9)),
+                             ('none', dict(complevel=0))):
+            f = HDFPartition(cache_fs, name, **kwargs)
+
+            with f.writer as w:
+                w.headers = ['a', 'b', 'c']
+                for i, type_ in enumerate(['int', 'str', 'float'], 1):
+                    w.column(i).type = type_
+                w.load_rows(rows)
+                self.assertEqual(20000, w.expectedrows)
+
+            with f.reader as r:
+                filters = r.filters
+                self.assertEqual(rows, list(r.rows))
+
+            sizes[name] = cache_fs.getsize(f.path)
+
+            if name == 'default':
+                self.assertEqual(('blosc', 5, True), (filters.complib, filters.complevel, filters.shuffle))
+            elif name == 'zlib':
+                self.assertEqual(('zlib', 9), (filters.complib, filters.complevel))
+            else:
+                self.assertEqual(0, filters.complevel)
+
+        self.assertLess(sizes['default'], sizes['none'] / 5)
+        self.assertLess(sizes['zlib'], sizes['none'] / 5)
+
+    def test_dates(self):
+        from ambry_sources.hdf_partitions.core import MIN_INT64
+        cache_fs = fsopendir(self.setup_temp_dir())
+
+        def row(i):
+            if i % 10 == 0:
+                return [i, None, None, None]
+            return [i, datetime.date(2000, 1, 1) + datetime.timedelta(days=i),
+                    datetime.datetime(2000, 1, 1, 12, 30, 15, i),
+                    datetime.time(i % 24, 15, 30)]
+
+        rows = [row(i) for i in range(100)]
+
+        # Strings in the source are parsed, and the ones that aren't dates are stored as None.
+        rows[1][1:] = ['2000-01-02', '2000-01-01T12:30:15.000001', '01:15:30']
+        rows[2][1:] = ['1/3/2000', 'NA', 'not a time']
+
+        f = HDFPartition(cache_fs, 'foobar')
+
+        with f.writer as w:
+            w.headers = ['a', 'b', 'c', 'd']
+            for i, type_ in enumerate(['int', 'date', 'datetime', 'time'], 1):
+                w.column(i).type = type_
+            w.load_rows(rows)
+
+        expected = [row(i) for i in range(100)]
+        expected[2][2:] = [None, None]
+
+        with f.reader as r:
+            self.assertEqual(['int', 'date', 'datetime', 'time'], [c.type for c in r.columns])
+            self.assertEqual(expected, list(r.rows))
+
+        batch = next(f.iter_numpy())
+        self.assertEqual(MIN_INT64, batch['b'][0])
+        self.assertEqual(expected[5][1], batch['b'].astype('datetime64[D]')[5].astype(object))
+        self.assertEqual(expected[5][3], batch['d'].astype('datetime64[us]')[5].astype(object).time())
+
+        # Conditions compare days since the epoch.
+        self.assertEqual(
+            [(i, expected[i][1]) for i in range(100) if i % 10 != 0 and i >= 90],
+            list(f.where('b >= {}'.format(10957 + 90), ['a', 'b'])))
+
+    def test_string_sizes(self):
+        from ambry_sources.hdf_partitions.core import MAX_STRING_SIZE
+        cache_fs = fsopendir(self.setup_temp_dir())
+
+        def text(i):
+            if i % 25 == 24:
+                return u('long {} ').format(i) * 200
+            elif i % 10 == 5:
+                return u('caf\xe9 \u2603 {}').format(i)
+            return u('t{}').format(i)
+
+        rows = [['C{}'.format(i % 10), text(i), None] for i in range(100)]
+
+        f = HDFPartition(cache_fs, 'foobar')
+
+        # The types are intuited from a sample of the rows, which has no long strings.
+        ti = TypeIntuiter().process_header(['code', 'text', 'empty']).run(rows[:20])
+        with f.writer as w:
+            w.headers = ['code', 'text', 'empty']
+            w.set_types(ti)
+
+        f.load_rows(rows)
+
+        with f.reader as r:
+            itemsizes = [r._h5_file.root.partition.rows.coldtypes[name].itemsize for name in r.headers]
+            overflow_rows = r.overflow['text'][0].tolist()
+            # None is stored as an empty string in string columns.
+            self.assertEqual([row[:2] + [''] for row in rows], list(r.rows))
+
+        self.assertEqual([2, 3, 1], itemsizes)
+        self.assertEqual([i for i in range(100) if i % 25 == 24 or i % 10 == 5], overflow_rows)
+        self.assertGreater(len(text(24)), MAX_STRING_SIZE)
+
+        # The condition compares the stored prefixes, but the rows have the whole strings.
+        self.assertEqual(
+            [('C{}'.format(i % 10), text(i)) for i in range(100) if i % 10 in (4, 5)],
+            list(f.where('(code == b"C4") | (code == b"C5")', ['code', 'text'])))
+
+    def test_from_mpr(self):
+        from ambry_sources.sources import GeneratorSource, SourceSpec
+        from ambry_sources.mpf import MPRowsFile
+        cache_fs = fsopendir(self.setup_temp_dir())
+
+        def gen():
+            yield ['id', 'code', 'value', 'date', 'text']
+
+            for i in range(2500):
+                yield [i, 'c{}'.format(i % 7), None if i % 11 == 0 else i / 4.0,
+                       datetime.date(2000, 1, 1) + datetime.timedelta(days=i),
+                       'long text ' * 30 if i % 500 == 7 else 'x{}'.format(i % 13)]
+
+        mpr = MPRowsFile(cache_fs, 'foobar').load_rows(GeneratorSource(SourceSpec('foobar'), gen()))
+
+        with mpr.reader as r:
+            expected = [list(row) for row in r.rows]
+            schema = r.meta['schema']
+
+        self.assertEqual(2500, len(expected))
+
+        for workers in (None, 2):
+            f = HDFPartition.from_mpr(mpr, path='foobar_{}'.format(workers), workers=workers)
+
+            with f.reader as r:
+                self.assertEqual(['id', 'code', 'value', 'date', 'text'], r.headers)
+                self.assertEqual(2500, r.n_rows)
+                self.assertEqual(expected, list(r.rows))
+
+                # The stats are copied, rather than computed again.
+                for hdf_col, mpr_col in zip(r.meta['schema'][1:], schema[1:]):
+                    for i, name in enumerate(schema[0]):
+                        if name in ('type', 'nuniques', 'stat_count', 'mean', 'std', 'min', 'max'):
+                            self.assertEqual(mpr_col[i], hdf_col[i], name)
+
+            self.assertIn('from_mpr', f.metrics.summary())
+            self.assertEqual(2500, f.metrics.summary()['from_mpr']['rows'])
+
+        self.assertEqual('foobar.h5', HDFPartition.from_mpr(mpr).path)
+
+    def test_column_stats(self):
+        from ambry_sources.hdf_partitions.stats import ColumnStats
+        from ambry_sources.stats import Stats, StatSet
+        cache_fs = fsopendir(self.setup_temp_dir())
+
+        def gen():
+            yield ['id', 'value', 'code', 'date', 'level']
+
+            for i in range(20000):
+                yield [i, None if i % 9 == 0 else (i % 97) / 4.0, 'c{}'.format(i % 13),
+                       datetime.date(2000, 1, 1) + datetime.timedelta(days=i % 50), i % 5]
+
+        f = self._load_generator(cache_fs, gen)
+
+        with f.reader as r:
+            schema = [(c.name, c.type) for c in r.columns]
+            expected = Stats(schema).run(r.iter_records())
+
+        with f.reader as r:
+            # Small chunks, so the primer rows and the moments span several of them.
+            stats = ColumnStats(schema, n_rows=r.n_rows).run(r, chunk_rows=3000)
+
+        for name, _ in schema:
+            a, b = expected[name].dict, stats[name].dict
+
+            for key in ('lom', 'count', 'min', 'max'):
+                self.assertEqual(a[key], b[key], (name, key))
+
+            if name in ('id', 'value', 'level'):
+                # StatSet leaves the last of the primer rows of numbers out of the counts and the hist.
+                self.assertIn(b['nuniques'] - a['nuniques'], (0, 1), name)
+                self.assertAlmostEqual(sum(a['hist']), sum(b['hist']), delta=20, msg=name)
+            else:
+                self.assertEqual(a['uvalues'], b['uvalues'], name)
+
+            for key in ('mean', 'std'):
+                if a[key] is None:
+                    self.assertIsNone(b[key], (name, key))
+                else:
+                    self.assertAlmostEqual(a[key], b[key], places=6, msg=(name, key))
+
+        # The quantiles are exact.
+        self.assertEqual(9999.5, stats['id'].p50)
+        self.assertEqual(4999.75, stats['id'].p25)
+        self.assertEqual(StatSet.LOM.ORDINAL, stats['level'].lom)
+
+        f.run_stats()
+
+        with f.reader as r:
+            self.assertEqual([20000] * 5, [c.stat_count for c in r.columns])
+            self.assertEqual(24.0, list(r.columns)[1].max)
+
+    def test_read(self):
+        from ambry_sources.query import QueryError
+        cache_fs = fsopendir(self.setup_temp_dir())
+
+        rows = [(i, None if i % 9 == 0 else i / 4.0, 'long ' * 300 if i % 7 == 3 else 'c{}'.format(i % 13),
+                 datetime.date(2000, 1, 1) + datetime.timedelta(days=i % 50)) for i in range(1000)]
+
+        def gen():
+            yield ['id', 'value', 'code', 'date']
+
+            for row in rows:
+                yield row
+
+        f = self._load_generator(cache_fs, gen)
+
+        for key in (slice(None), slice(10, 20), slice(5, 500, 7), slice(-5, None), slice(None, None, -3),
+                    slice(900, 10, -11), slice(20, 10), slice(2000, 3000)):
+            self.assertEqual(rows[key], f[key], key)
+
+        self.assertEqual(rows[3], f[3])
+        self.assertEqual(rows[-1], f[-1])
+
+        with self.assertRaises(IndexError):
+            f[1000]
+
+        with f.reader as r:
+            self.assertEqual([row[2:] for row in rows[3:30:4]], r.read(3, 30, 4, columns=['code', 'date']))
+            self.assertEqual([row[1:2] for row in rows[::-2]], r.read(step=-2, columns=['value']))
+
+            with self.assertRaises(QueryError):
+                r.read(columns=['foo'])
+
+    def test_append_rows(self):
+        cache_fs = fsopendir(self.setup_temp_dir())
+
+        def row(i):
+            return [i, None if i % 9 == 0 else (i % 97) / 4.0,
+                    'long ' * 300 if i % 701 == 3 else 'c{}'.format(i % 13),
+                    datetime.date(2000, 1, 1) + datetime.timedelta(days=i % 50), i % 5]
+
+        def load(path, parts):
+            (start, stop), parts = parts[0], parts[1:]
+
+            def gen():
+                yield ['id', 'value', 'code', 'date', 'level']
+
+                for i in range(start, stop):
+                    yield row(i)
+
+            f = self._load_generator(cache_fs, gen, path=path)
+
+            for start, stop in parts:
+                f.append_rows([row(i) for i in range(start, stop)])
+
+            return f
+
+        # The first part is loaded with fewer rows than the hist bins are built from.
+        full = load('full', [(0, 12000)])
+        appended = load('appended', [(0, 3000), (3000, 4000), (4000, 12000)])
+
+        self.assertEqual(12000, appended.n_rows)
+        self.assertEqual(full[:], appended[:])
+        self.assertEqual(8000, appended.metrics.summary()['run_stats']['rows'])
+
+        def stats(f):
+            with f.reader as r:
+                return [dict(c.items()) for c in r.columns]
+
+        full_stats = stats(full)
+
+        def assert_stats(appended_stats):
+            for a, b in zip(full_stats, appended_stats):
+                for key in ('stat_count', 'nuniques', 'min', 'max', 'p25', 'p50', 'p75', 'hist', 'lom', 'width'):
+                    self.assertEqual(a[key], b[key], (a['name'], key))
+
+                for key in ('mean', 'std', 'skewness', 'kurtosis'):
+                    if a[key] is None:
+                        self.assertIsNone(b[key], (a['name'], key))
+                    else:
+                        self.assertAlmostEqual(a[key], b[key], places=6, msg=(a['name'], key))
+
+                if a['name'] != 'id':  # The ids all have one row, so the top values are any of them.
+                    self.assertEqual(a['uvalues'], b['uvalues'], a['name'])
+
+        assert_stats(stats(appended))
+
+        # Rows written without the stats make the saved state stale, so all rows are read again.
+        with appended.writer as w:
+            w.insert_rows([row(i) for i in range(12000, 12100)])
+
+        appended.append_rows([row(i) for i in range(12100, 12200)])
+
+        self.assertEqual(12200, appended.metrics.summary()['run_stats']['rows'])
+
+        full.append_rows([row(i) for i in range(12000, 12200)])
+        full_stats = stats(full)
+
+        assert_stats(stats(appended))
+
+    def test_iter_records(self):
+        cache_fs = fsopendir(self.setup_temp_dir())
+
+        rows = [[i, None if i % 7 == 0 else i / 2.0, None if i % 8 == 0 else 'x{}'.format(i)] for i in range(100)]
+        rows[1][0] = None
+
+        def gen():
+            yield ['a', 'b', 'c']
+
+            for row in rows:
+                yield row
+
+        f = self._load_generator(cache_fs, gen)
+
+        with f.reader as r:
+            # The None replacements are converted back, as they are for the rows.
+            self.assertEqual(
+                [tuple(row[:2]) for row in rows], [(record.a, record.b) for record in r.iter_records()])
+
     def test_headers(self):
 
         fs = fsopendir('temp://')
@@ -10,7 +10,7 @@ from tables import open_file, Float64Col, StringCol, Int64Col, Int32Col
 
 from six import b
 
-from ambry_sources.hdf_partitions.core import _serialize, _deserialize
+from ambry_sources.hdf_partitions.core import _serialize, _deserialize, _apply_overflow, _null_mask, MIN_INT32
 from ambry_sources.mpf import MPRowsFile
 from ambry_sources.sources.util import RowProxy
 
@@ -76,8 +76,8 @@ class HDFPartitionTest(TestBase):
             self.assertEqual(hdf_partition.stats, 22)
 
     # run_stats tests
-    @patch('ambry_sources.hdf_partitions.core.Stats.run')
-    @patch('ambry_sources.hdf_partitions.core.Stats.__init__')
+    @patch('ambry_sources.hdf_partitions.stats.ColumnStats.run')
+    @patch('ambry_sources.hdf_partitions.stats.ColumnStats.__init__')
     def test_creates_stat_from_reader(self, fake_init, fake_run):
         fake_init.return_value = None
         fake_run.return_value = {'a': 1}
@@ -90,8 +90,8 @@ class HDFPartitionTest(TestBase):
                 ret = hdf_partition.run_stats()
                 self.assertEqual(ret, {'a': 1})
 
-    @patch('ambry_sources.hdf_partitions.core.Stats.run')
-    @patch('ambry_sources.hdf_partitions.core.Stats.__init__')
+    @patch('ambry_sources.hdf_partitions.stats.ColumnStats.run')
+    @patch('ambry_sources.hdf_partitions.stats.ColumnStats.__init__')
     def test_writes_stat_to_writer(self, fake_init, fake_run):
         fake_run.return_value = {'stat': 1}
         fake_init.return_value = None
@@ -200,6 +200,25 @@ class HDFWriterTest(TestBase):
             [x['col2'] for x in writer._h5_file.root.partition.rows.iterrows()],
             [b('row1'), b('row2')])
 
+    def test_writes_none_replacements(self):
+        temp_fs = fsopendir('temp://')
+        parent = MagicMock()
+        writer = HDFWriter(parent, temp_fs.getsyspath('temp.h5'))
+        writer.meta['schema'].append(self._get_column('col1', 'int'))
+        writer.meta['schema'].append(self._get_column('col2', 'float'))
+        writer.meta['schema'].append(self._get_column('col3', 'str'))
+        writer._write_rows(
+            rows=[[1, 1.5, u'r\xe9sum\xe9'], [None, None, None], ['NA', 'NA', 'NA'], ['x', 'y', 2]])
+
+        rows = writer._h5_file.root.partition.rows.read().tolist()
+        self.assertEqual(rows[0], (1, 1.5, u'r\xe9sum\xe9'.encode('utf-8')))
+        self.assertEqual(rows[3][2], b('2'))
+
+        for row in rows[1:]:
+            self.assertEqual(row[0], MIN_INT32)
+            self.assertTrue(math.isnan(row[1]))
+        self.assertEqual([b(''), b('')], [row[2] for row in rows[1:3]])
+
     # insert_row test
     @patch('ambry_sources.hdf_partitions.core.HDFWriter._write_rows')
     def test_inserts_row_to_the_cache(self, fake_write_rows):
@@ -246,6 +265,39 @@ class HDFWriterTest(TestBase):
         self.assertIsNone(writer._h5_file)
         self.assertEqual(h5_file.isopen, 0)
 
+    # flush_meta tests
+    def test_writes_meta_on_close_only(self):
+        temp_fs = fsopendir('temp://')
+        filename = temp_fs.getsyspath('temp.h5')
+        writer = HDFWriter(MagicMock(), filename)
+        writer.meta['schema'].append(self._get_column('col1', 'int'))
+
+        with patch.object(writer, '_write_meta', wraps=writer._write_meta) as fake_write_meta:
+            for i in range(3):
+                writer._write_rows(rows=[[i]])
+                writer.n_rows += 1
+            fake_write_meta.assert_not_called()
+
+            writer.close()
+            fake_write_meta.assert_called_once_with(list(HDFWriter.META_CHILDREN))
+
+        # Re-opening the file to change a type rewrites only the schema.
+        writer = HDFWriter(MagicMock(), filename)
+        self.assertEqual(writer.dirty, [])
+        self.assertEqual(writer.n_rows, 3)
+
+        writer.column('col1').type = 'float'
+        self.assertEqual(writer.dirty, ['schema'])
+
+        with patch.object(writer, '_save_about') as fake_save_about:
+            writer.flush_meta()
+            fake_save_about.assert_not_called()
+
+        self.assertEqual(writer.dirty, [])
+        writer.close()
+
+        self.assertEqual(HDFReader(None, filename).meta['schema'][1][2], 'float')
+
     # write_file_header tests
     def test_writes_file_header_to_table(self):
         temp_fs = fsopendir('temp://')
@@ -766,3 +818,42 @@ class TestDeserialize(unittest.TestCase):
     def test_returns_value_as_is(self):
         ret = _deserialize(11.0)
         self.assertEqual(ret, 11.0)
+
+
+class TestNullMask(unittest.TestCase):
+    """ Tests _null_mask function. """
+
+    def test_marks_none_and_nulls(self):
+        a = np.array([1, None, 'NA', '', 'x', 0], dtype=object)
+        self.assertEqual([False, True, True, False, False, False], _null_mask(a, 'NA').tolist())
+        self.assertEqual([False, True, True, True, False, False], _null_mask(a, 'NA', '').tolist())
+
+    def test_returns_empty_mask(self):
+        self.assertEqual([], _null_mask(np.array([], dtype=object)).tolist())
+
+
+class TestApplyOverflow(unittest.TestCase):
+    """ Tests _apply_overflow function. """
+
+    def _overflow(self):
+        return np.array([2, 5, 9, 20]), ['two', 'five', 'nine', 'twenty']
+
+    def test_replaces_values_of_overflow_rows(self):
+        values = ['a', 'b', 'c', 'd', 'e']
+        _apply_overflow(values, np.arange(3, 8), self._overflow())
+        self.assertEqual(['a', 'b', 'five', 'd', 'e'], values)
+
+    def test_replaces_values_of_unsorted_coordinates(self):
+        values = ['a', 'b', 'c', 'd', 'e']
+        _apply_overflow(values, np.array([20, 1, 9, 21, 2]), self._overflow())
+        self.assertEqual(['twenty', 'b', 'nine', 'd', 'two'], values)
+
+    def test_ignores_coordinates_after_last_overflow_row(self):
+        values = ['a', 'b']
+        _apply_overflow(values, np.array([21, 30]), self._overflow())
+        self.assertEqual(['a', 'b'], values)
+
+    def test_ignores_empty_coordinates(self):
+        values = []
+        _apply_overflow(values, np.array([], dtype=np.int64), self._overflow())
+        self.assertEqual([], values)
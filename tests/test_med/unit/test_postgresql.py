@@ -156,7 +156,8 @@ class MPRForeignDataWrapperTest(TestBase):
         mpr_wrapper = MPRForeignDataWrapper(options, columns)
 
         class FakeReader(object):
-            rows = iter([['1-1', '1-2'], ['2-1', '2-2']])
+            def iter_batches(self):
+                return iter([[['1-1', '1-2']], [['2-1', '2-2']]])
 
             def __enter__(self):
                 return self
@@ -23,7 +23,7 @@ class TestTable(unittest.TestCase):
         columns = []
         partition = AttrDict({
             'reader': {
-                'rows': [[1]]}})
+                'iter_batches': lambda: iter([[[1]]])}})
         table = Table(columns, partition)
         cursor = table.Open()
         self.assertTrue(hasattr(cursor, 'Next'))
@@ -36,7 +36,7 @@ class TestCursor(unittest.TestCase):
         if not rows:
             rows = [[1.1, 1.2], [2.1, 2.2], [3.1, 3.2]]
         if not reader:
-            reader = {'rows': rows, 'close': lambda x: None}
+            reader = {'iter_batches': lambda: iter([rows[:1], [], rows[1:]]), 'close': lambda x: None}
 
         table = AttrDict({
             'mprows': {
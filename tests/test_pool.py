@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+from copy import deepcopy
+import threading
+import time
+
+from fs.opener import fsopendir
+
+from ambry_sources.mpf import MPRowsFile
+from ambry_sources.pool import MPRPool
+from ambry_sources.sources import GeneratorSource, SourceSpec
+
+from tests import TestBase
+
+
+class MPRPoolTest(TestBase):
+
+    def _write_mpr(self, fs, name, n=100):
+
+        def gen():
+            yield ['id', 'name']
+
+            for i in range(n):
+                yield [i, '{}-{}'.format(name, i)]
+
+        f = MPRowsFile(fs, name)
+        if f.exists:
+            f.remove()
+
+        return f.load_rows(GeneratorSource(SourceSpec(name), gen()))
+
+    def test_reuses_meta_and_handles(self):
+        fs = fsopendir(self.setup_temp_dir())
+        self._write_mpr(fs, 'a')
+
+        pool = MPRPool()
+        f = MPRowsFile(fs, 'a', pool=pool)
+
+        with f.reader as r:
+            meta = r.meta
+            rows = list(r.rows)
+
+        self.assertEqual(dict(hits=0, misses=1, handle_hits=0, evictions=0, entries=1, idle_handles=1),
+                         pool.stats)
+
+        for i in range(3):
+            with f.reader as r:
+                self.assertIs(meta, r.meta)
+                self.assertEqual(rows, list(r.rows))
+
+        self.assertEqual(3, pool.hits)
+        self.assertEqual(3, pool.handle_hits)
+        self.assertEqual(1, pool.stats['idle_handles'])
+
+        # Two readers at once need two handles
+        r1, r2 = pool.reader(f), pool.reader(f)
+        self.assertEqual(rows, list(r1.rows))
+        self.assertEqual(rows, list(r2.rows))
+        r1.close()
+        r2.close()
+        self.assertEqual(2, pool.stats['idle_handles'])
+
+        # Metadata through other files and filesystems for the same path
+        self.assertEqual(meta, MPRowsFile(fs, 'a', pool=pool).meta)
+        self.assertEqual(meta, MPRowsFile(fsopendir(fs.getsyspath('/')), 'a', pool=pool).meta)
+        self.assertEqual(4 + 3, pool.hits)
+
+        # The shared metadata can't be changed, but copies can.
+        with f.reader as r:
+            expected = deepcopy(r.meta)
+
+            with self.assertRaises(TypeError):
+                r.meta['about']['load_time'] = 'changed'
+
+            with self.assertRaises(TypeError):
+                list(r.columns)[1].description = 'changed'
+
+            with self.assertRaises(TypeError):
+                r.meta['schema'].append([])
+
+            meta_copy = deepcopy(r.meta)
+            meta_copy['about']['load_time'] = 'changed'
+            meta_copy['schema'][1][1] = 'changed'
+
+        with f.reader as r:
+            self.assertEqual(expected, r.meta)
+            self.assertEqual(expected, meta)
+
+        pool.clear()
+        self.assertEqual(0, len(pool))
+        self.assertEqual(0, pool.stats['idle_handles'])
+
+    def test_cheaper_than_plain_open(self):
+        fs = fsopendir(self.setup_temp_dir())
+
+        def gen():
+            yield ['c{}'.format(i) for i in range(100)]
+
+            for j in range(10):
+                yield [i * j for i in range(100)]
+
+        MPRowsFile(fs, 'wide').load_rows(GeneratorSource(SourceSpec('wide'), gen()))
+
+        pool = MPRPool()
+
+        def open_meta(pool):
+            with MPRowsFile(fs, 'wide', pool=pool).reader as r:
+                return r.meta
+
+        self.assertEqual(open_meta(None)['schema'][1][:3], open_meta(pool)['schema'][1][:3])
+
+        def best(pool):
+            times = []
+            for i in range(10):
+                start = time.time()
+                open_meta(pool)
+                times.append(time.time() - start)
+            return min(times)
+
+        self.assertLess(best(pool), best(None))
+
+    def test_rewritten_file(self):
+        fs = fsopendir(self.setup_temp_dir())
+        self._write_mpr(fs, 'a', n=10)
+
+        pool = MPRPool()
+        f = MPRowsFile(fs, 'a', pool=pool)
+
+        self.assertEqual(11, f.n_rows)
+
+        time.sleep(0.01)  # Make sure the modification time changes
+        self._write_mpr(fs, 'a', n=20)
+
+        self.assertEqual(21, f.n_rows)
+        self.assertEqual(2, pool.misses)
+        self.assertEqual(1, pool.evictions)
+
+    def test_eviction(self):
+        fs = fsopendir(self.setup_temp_dir())
+
+        for name in 'abcd':
+            self._write_mpr(fs, name)
+
+        pool = MPRPool(size=2, handles=1)
+
+        for name in 'abcd':
+            MPRowsFile(fs, name, pool=pool).meta
+
+        self.assertEqual(2, len(pool))
+        self.assertEqual(2, pool.evictions)
+        self.assertEqual(1, pool.stats['idle_handles'])
+
+        MPRowsFile(fs, 'd', pool=pool).meta  # Still cached
+        MPRowsFile(fs, 'a', pool=pool).meta  # Evicted
+        self.assertEqual(1, pool.hits)
+        self.assertEqual(5, pool.misses)
+
+    def test_threads(self):
+        fs = fsopendir(self.setup_temp_dir())
+
+        for name in 'abc':
+            self._write_mpr(fs, name)
+
+        pool = MPRPool(size=2, handles=2)
+        errors = []
+
+        def read(name):
+            try:
+                for i in range(20):
+                    with MPRowsFile(fs, name, pool=pool).reader as r:
+                        rows = list(r.rows)
+                        assert len(rows) == 100 and rows[-1][1] == '{}-99'.format(name), rows[-1]
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=read, args=(name,)) for name in 'abcabc']
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual([], errors)
+        self.assertEqual(120, pool.hits + pool.misses)
+        self.assertLessEqual(pool.stats['idle_handles'], 2)
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import threading
+
+from six.moves import BaseHTTPServer
+
+from fs.opener import fsopendir
+
+from ambry_sources import head
+from ambry_sources.mpf import MPRowsFile
+from ambry_sources.remote import HTTPRangeFile
+from ambry_sources.sources import GeneratorSource, SourceSpec
+
+from tests import TestBase
+
+
+class RangeRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Serves files from the server's root directory, with support for single byte ranges. Counts the requests
+    and bytes sent. """
+
+    def log_message(self, *args):
+        pass
+
+    def _file(self):
+        path = os.path.join(self.server.root, self.path.lstrip('/'))
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def do_HEAD(self):
+        data = self._file()
+        if data is not None:
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+
+    def do_GET(self):
+        data = self._file()
+        if data is None:
+            return
+
+        self.server.n_requests += 1
+
+        m = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+
+        if not m or not self.server.ranges:
+            body = data
+            self.send_response(200)
+        else:
+            start = int(m.group(1))
+            end = min(int(m.group(2)) if m.group(2) else len(data) - 1, len(data) - 1)
+
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{}'.format(len(data)))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+            body = data[start:end + 1]
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, len(data)))
+
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.n_bytes += len(body)
+
+
+class HTTPRangeTest(TestBase):
+
+    def setUp(self):
+        super(HTTPRangeTest, self).setUp()
+
+        self.root = self.setup_temp_dir()
+
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), RangeRequestHandler)
+        self.server.root = self.root
+        self.server.ranges = True
+        self.server.n_requests = self.server.n_bytes = 0
+
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+        self.base_url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        super(HTTPRangeTest, self).tearDown()
+
+    def _write_mpr(self, n=150000):
+        import random
+
+        def gen():
+            rand = random.Random(1)
+            yield ['id', 'name', 'value']
+
+            for i in range(n):
+                yield [i, 'name-{}'.format(rand.random()), rand.random()]
+
+        f = MPRowsFile(fsopendir(self.root), 'remote')
+        f.load_rows(GeneratorSource(SourceSpec('remote'), gen()))
+
+        return f
+
+    def test_range_file(self):
+        data = bytes(bytearray(i % 251 for i in range(10000)))
+
+        with open(os.path.join(self.root, 'data'), 'wb') as f:
+            f.write(data)
+
+        f = HTTPRangeFile(self.base_url + '/data', block_size=1000)
+
+        self.assertEqual(data[:10], f.read(10))
+        self.assertEqual(data[10:20], f.read(10))
+        self.assertEqual(1, f.n_requests)  # The second read comes from the cached block
+
+        f.seek(5000)
+        self.assertEqual(data[5000:7500], f.read(2500))
+        self.assertEqual(7500, f.tell())
+
+        f.seek(-10, 2)
+        self.assertEqual(data[-10:], f.read(100))
+        self.assertEqual(b'', f.read(10))
+
+        f.seek(20)
+        self.assertEqual(data[20:], f.read())
+
+        f.close()
+
+        # A server that ignores ranges returns the whole file
+        self.server.ranges = False
+
+        f = HTTPRangeFile(self.base_url + '/data', block_size=1000)
+        f.seek(100)
+        self.assertEqual(data[100:200], f.read(100))
+        f.seek(-10, 2)
+        self.assertEqual(data[-10:], f.read())
+        self.assertEqual(1, f.n_requests)
+        f.close()
+
+    def test_reads_parts_of_remote_mpr(self):
+
+        local = self._write_mpr()
+        size = os.path.getsize(local.syspath)
+
+        with local.reader as r:
+            expected_meta = r.meta
+            expected_n_rows = r.n_rows
+            expected_rows = list(r.rows)
+
+        url = '{}/{}'.format(self.base_url, local.path.lstrip('/'))
+
+        # Header and metadata
+        f = MPRowsFile(url)
+        self.assertTrue(f.exists)
+        self.assertIsNone(f.syspath)
+
+        with f.reader as r:
+            self.assertEqual(expected_n_rows, r.n_rows)
+            self.assertEqual(expected_meta, r.meta)
+            self.assertEqual(['id', 'name', 'value'], r.headers)
+
+        self.assertLess(self.server.n_bytes, size / 4)
+
+        # First rows
+        self.server.n_bytes = 0
+
+        with MPRowsFile(url).reader as r:
+            self.assertEqual(expected_rows[:10], list(head(r.rows, 10)))
+
+        self.assertLess(self.server.n_bytes, size / 4)
+
+        # All rows
+        with MPRowsFile(url).reader as r:
+            self.assertEqual(expected_rows, list(r.rows))
+
+    def test_missing_file(self):
+        from fs.errors import ResourceNotFoundError
+
+        f = MPRowsFile(self.base_url + '/missing.mpr')
+        self.assertFalse(f.exists)
+
+        with self.assertRaises(ResourceNotFoundError):
+            HTTPRangeFile(self.base_url + '/missing.mpr').read(10)
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+try:
+    # py3
+    from unittest.mock import patch
+except ImportError:
+    # py2
+    from mock import patch
+
+from ambry_sources.sources.util import RowProxy, GeoRowProxy, RowRecord, GeoRowRecord, row_class
+
+
+class RowClassTest(unittest.TestCase):
+
+    def test_returns_cached_class_for_headers(self):
+        self.assertIs(row_class(['a', 'b']), row_class(('a', 'b')))
+        self.assertIsNot(row_class(['a', 'b']), row_class(['a', 'c']))
+
+    def test_caches_only_recent_classes(self):
+        from ambry_sources.sources import util
+
+        Row = row_class(['a', 'b'])
+
+        for i in range(util.ROW_CLASSES - 1):
+            row_class(['c{}'.format(i)])
+
+        self.assertIs(Row, row_class(['a', 'b']))  # Still cached, and now the most recently used
+
+        for i in range(util.ROW_CLASSES):
+            row_class(['d{}'.format(i)])
+
+        self.assertEqual(util.ROW_CLASSES, len(util._row_classes))
+        self.assertIsNot(Row, row_class(['a', 'b']))
+
+    def test_accesses_values_by_attribute_name_and_position(self):
+        Row = row_class(['a', 'b', 'c'])
+        r = Row([1, 2, 3])
+        self.assertIsInstance(r, RowRecord)
+        self.assertEqual((r.a, r.b, r.c), (1, 2, 3))
+        self.assertEqual((r['a'], r['c']), (1, 3))
+        self.assertEqual((r[0], r[-1]), (1, 3))
+        self.assertEqual(r[1:], (2, 3))
+        self.assertEqual(r.row, (1, 2, 3))
+        self.assertEqual(list(r), [1, 2, 3])
+        self.assertEqual(len(r), 3)
+
+    def test_has_the_same_mapping_interface_as_row_proxy(self):
+        headers = ['a', 'b', 'c']
+        r = row_class(headers)([1, 2, 3])
+        rp = RowProxy(headers).set_row([1, 2, 3])
+        self.assertEqual(r.dict, rp.dict)
+        self.assertEqual(r.keys(), list(rp.keys()))
+        self.assertEqual(r.values(), list(rp.values()))
+        self.assertEqual(r.items(), list(rp.items()))
+        self.assertEqual(list(r.headers), rp.headers)
+
+    def test_raises_key_error_for_unknown_name(self):
+        r = row_class(['a', 'b'])([1, 2])
+        with self.assertRaises(KeyError):
+            r['z']
+        with self.assertRaises(AttributeError):
+            r.z
+
+    def test_stores_values_in_slots(self):
+        r = row_class(['a', 'b'])([1, 2])
+        self.assertFalse(hasattr(r, '__dict__'))
+        r.a = 3
+        r['b'] = 4
+        self.assertEqual(r.row, (3, 4))
+        with self.assertRaises(AttributeError):
+            r.z = 5
+
+    def test_pads_short_rows_and_truncates_long_rows(self):
+        Row = row_class(['a', 'b', 'c'])
+        self.assertEqual(Row([1]).row, (1, None, None))
+        self.assertEqual(Row([1, 2, 3, 4]).row, (1, 2, 3))
+
+    def test_conflicting_and_invalid_names_are_only_available_by_key(self):
+        r = row_class(['dict', 'count', 'my col', 'class', 'count'])([1, 2, 3, 4, 5])
+        self.assertEqual(r.dict, {'dict': 1, 'count': 5, 'my col': 3, 'class': 4})
+        self.assertEqual(r.count, 2)
+        self.assertEqual((r['my col'], r['class'], r[3]), (3, 4, 4))
+
+    def test_compares_equal_to_record_with_same_values(self):
+        Row = row_class(['a', 'b'])
+        self.assertEqual(Row([1, 2]), Row([1, 2]))
+        self.assertNotEqual(Row([1, 2]), Row([1, 3]))
+        self.assertEqual(Row([1, 2]).copy(), Row([1, 2]))
+
+    def test_geometry_headers_create_geo_record(self):
+        Row = row_class(['id', 'geometry'])
+        self.assertTrue(issubclass(Row, GeoRowRecord))
+
+        r = Row([1, 'POINT (1 2)'])
+        with patch('shapely.wkt.loads') as fake_loads:
+            fake_loads.return_value.__geo_interface__ = {'type': 'Point'}
+            r.__geo_interface__
+            gi = r.__geo_interface__
+            fake_loads.assert_called_once_with('POINT (1 2)')
+        self.assertEqual(gi, {'type': 'Point', 'properties': {'id': 1}})
+
+
+class GeoRowProxyTest(unittest.TestCase):
+
+    def test_parses_geometry_once_per_row(self):
+        rp = GeoRowProxy(['id', 'geometry'])
+
+        with patch('shapely.wkt.loads') as fake_loads:
+            fake_loads.side_effect = lambda wkt: type('G', (object,), {'__geo_interface__': {'wkt': wkt}})()
+
+            rp.set_row([1, 'POINT (1 2)'])
+            rp.__geo_interface__
+            gi = rp.__geo_interface__
+            self.assertEqual(fake_loads.call_count, 1)
+            self.assertEqual(gi, {'wkt': 'POINT (1 2)', 'properties': {'id': 1}})
+
+            rp.set_row([2, 'POINT (3 4)'])
+            gi = rp.__geo_interface__
+            self.assertEqual(fake_loads.call_count, 2)
+            self.assertEqual(gi, {'wkt': 'POINT (3 4)', 'properties': {'id': 2}})
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+from collections import Counter
+
+from fs.opener import fsopendir
+
+from ambry_sources import testing
+from ambry_sources.mpf import MPRowsFile
+
+from tests import TestBase
+
+
+class GenerateTest(TestBase):
+
+    def test_deterministic(self):
+        fs = fsopendir(self.setup_temp_dir())
+
+        testing.generate('preamble', 200, seed=5, fs=fs, path='a.csv')
+        testing.generate('preamble', 200, seed=5, fs=fs, path='b.csv')
+        testing.generate('preamble', 200, seed=6, fs=fs, path='c.csv')
+
+        self.assertEqual(fs.getcontents('a.csv'), fs.getcontents('b.csv'))
+        self.assertNotEqual(fs.getcontents('a.csv'), fs.getcontents('c.csv'))
+
+        self.assertEqual(list(testing.rows('mixed', 50, seed=2)), list(testing.rows('mixed', 50, seed=2)))
+
+    def test_intuiters_find_layout(self):
+        fs = fsopendir(self.setup_temp_dir())
+
+        for layout in ('csv', 'preamble', 'tsv', 'fixed', 'xlsx', 'mixed'):
+            path = 'gen_' + layout
+            spec = testing.generate(layout, 300, seed=1, fs=fs, path=path)
+
+            expected = (spec.header_lines, spec.start_line)
+            end_line = spec.end_line
+
+            if layout != 'fixed':  # Make the RowIntuiter find the layout
+                spec.header_lines, spec.start_line, spec.end_line = False, None, None
+
+            f = MPRowsFile(fs, path + '.mpr').load_rows(testing.open_source(spec, fs, path))
+
+            with f.reader as r:
+                self.assertEqual(expected, (r.info['header_rows'], r.info['data_start_row']), layout)
+
+                if layout in ('preamble', 'xlsx'):  # The RowIntuiter only sets the end line if there is a footer
+                    self.assertEqual(end_line, r.info['data_end_row'], layout)
+
+                self.assertEqual(300, len(list(r.rows)), layout)
+
+                for c in r.columns:
+                    name = c.name.split('_', 4)[-1] if layout == 'preamble' else c.name
+                    self.assertEqual(spec.types[name], c.resolved_type, (layout, c.name))
+
+    def test_write(self):
+        fs = fsopendir(self.setup_temp_dir())
+
+        data = [[i, 'w' * (i % 7), None if i % 5 == 0 else i / 4.0] for i in range(30)]
+        columns = [('id', 'int'), ('word', 'str', dict(width=None)), ('x', 'float', dict(width=None))]
+
+        spec = testing.write(dict(format='fixed', columns=columns, header_rows=0), data, 30, fs=fs, path='w.txt')
+
+        self.assertEqual([12, 7, 5], [c.width for c in spec.columns])
+        self.assertEqual((None, 0, 29), (spec.header_lines, spec.start_line, spec.end_line))
+
+        rows = [[c.strip() for c in row] for row in testing.open_source(spec, fs, 'w.txt')]
+        self.assertEqual([[str(i), 'w' * (i % 7), '' if i % 5 == 0 else repr(i / 4.0)] for i in range(30)], rows)
+
+    def test_nulls_and_skew(self):
+        spec = dict(columns=[('code', 'code', dict(cardinality=100)), ('n', 'int')], null_rate=0.1)
+
+        rows = list(testing.rows(spec, 5000, seed=1))
+
+        nulls = sum(1 for row in rows for v in row if v is None)
+        self.assertTrue(800 < nulls < 1200, nulls)
+
+        counts = Counter(row[0] for row in rows if row[0] is not None).most_common()
+        self.assertLessEqual(len(counts), 100)
+        self.assertGreater(counts[0][1], 10 * counts[len(counts) // 2][1])
+
+    def test_bad_specs(self):
+        fs = fsopendir(self.setup_temp_dir())
+
+        with self.assertRaises(ValueError):
+            testing.generate('foo', 10, fs=fs)
+
+        with self.assertRaises(ValueError):
+            testing.generate(dict(columns=[('a', 'complex')]), 10, fs=fs)
+
+        with self.assertRaises(ValueError):
+            testing.generate(dict(layout='fixed', comment_rows=2), 10, fs=fs)
+
+        with self.assertRaises(ValueError):
+            testing.generate('xlsx', testing.EXCEL_MAX_ROWS, fs=fs)
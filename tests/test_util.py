@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+import io
+import time
+import unittest
+
+from fs.opener import fsopendir
+from fs.wrapfs import WrapFS
+
+from ambry_sources.mpf import MPRowsFile
+from ambry_sources.util import ReadAheadFile
+
+from tests import TestBase
+
+
+class SlowFile(object):
+    """ A file that sleeps on each read, like a file on a remote filesystem. """
+
+    def __init__(self, f, delay=0.001):
+        self._f = f
+        self.delay = delay
+        self.reads = 0
+
+    def read(self, size=-1):
+        self.reads += 1
+        time.sleep(self.delay)
+        return self._f.read(size)
+
+    def seek(self, offset, whence=0):
+        return self._f.seek(offset, whence)
+
+    def tell(self):
+        return self._f.tell()
+
+    def close(self):
+        self._f.close()
+
+
+class SlowFS(WrapFS):
+    """ A filesystem with slow files. """
+
+    def __init__(self, wrapped_fs):
+        super(SlowFS, self).__init__(wrapped_fs)
+        self.files = []
+
+    def _file_wrap(self, f, mode):
+        if 'r' in mode and '+' not in mode:
+            f = SlowFile(f)
+            self.files.append(f)
+        return f
+
+
+class ReadAheadFileTest(unittest.TestCase):
+
+    def _get_file(self, n=100000):
+        data = bytes(bytearray(i % 251 for i in range(n)))
+        return data, SlowFile(io.BytesIO(data))
+
+    def test_reads_whole_file_in_windows(self):
+        data, slow = self._get_file()
+
+        f = ReadAheadFile(slow, window=10000, buffers=2)
+        parts = []
+        while True:
+            part = f.read(777)
+            if not part:
+                break
+            parts.append(part)
+
+        self.assertEqual(data, b''.join(parts))
+        self.assertEqual(len(data), f.tell())
+        # One read per window, plus the read that finds the end of the file.
+        self.assertEqual(11, slow.reads)
+        f.close()
+
+    def test_read_all(self):
+        data, slow = self._get_file()
+
+        f = ReadAheadFile(slow, window=3000)
+        f.seek(10)
+        self.assertEqual(data[10:], f.read())
+        self.assertEqual(b'', f.read(10))
+        f.close()
+
+    def test_seeks(self):
+        data, slow = self._get_file()
+
+        f = ReadAheadFile(slow, window=1000, buffers=2)
+
+        self.assertEqual(data[:10], f.read(10))
+
+        # Backward, within the buffer
+        f.seek(5)
+        self.assertEqual(data[5:15], f.read(10))
+
+        # Relative, forward, within the read-ahead window
+        f.seek(1500, 1)
+        self.assertEqual(1515, f.tell())
+        self.assertEqual(data[1515:1530], f.read(15))
+
+        # Far forward, and back to the start, which restart the thread
+        f.seek(90000)
+        self.assertEqual(data[90000:90010], f.read(10))
+        f.seek(0)
+        self.assertEqual(data[:2500], f.read(2500))
+
+        # From the end
+        f.seek(-10, 2)
+        self.assertEqual(data[-10:], f.read(100))
+        f.seek(20)
+        self.assertEqual(data[20:30], f.read(10))
+
+        f.close()
+
+    def test_raises_read_errors(self):
+
+        class BrokenFile(SlowFile):
+            def read(self, size=-1):
+                raise IOError('Broken')
+
+        f = ReadAheadFile(BrokenFile(io.BytesIO(b'abc')))
+
+        with self.assertRaises(IOError):
+            f.read(1)
+
+
+class ReadAheadMPRTest(TestBase):
+
+    def test_reads_mpr_from_slow_filesystem(self):
+        from ambry_sources.sources import GeneratorSource, SourceSpec
+
+        cache_fs = fsopendir(self.setup_temp_dir())
+
+        def gen():
+            yield ['id', 'name', 'value']
+
+            for i in range(20000):
+                yield [i, 'name-{}'.format(i), i * 1.5]
+
+        MPRowsFile(cache_fs, 'slow').load_rows(GeneratorSource(SourceSpec('slow'), gen()))
+
+        slow_fs = SlowFS(cache_fs)
+
+        with MPRowsFile(slow_fs, 'slow').reader as r:
+            expected = list(r.rows)
+            expected_meta = r.meta
+
+        direct_reads = sum(f.reads for f in slow_fs.files)
+
+        slow_fs.files = []
+
+        f = MPRowsFile(slow_fs, 'slow', read_ahead=16 * 1024)
+
+        with f.reader as r:
+            self.assertIsInstance(r._fh, ReadAheadFile)
+            self.assertEqual(expected, list(r.rows))
+            self.assertEqual(expected_meta, r.meta)
+
+        self.assertLess(sum(f.reads for f in slow_fs.files), direct_reads)